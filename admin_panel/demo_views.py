@@ -2,8 +2,13 @@
 Демо-версия админ-панели без требования аутентификации
 Используется для демонстрации функционала
 """
+from django.contrib.auth.decorators import login_required, user_passes_test
 from django.shortcuts import render
 from django.http import JsonResponse, HttpResponse
+from django.utils.cache import get_conditional_response
+
+from .structure_data import get_structure_payload
+from .views import is_admin
 
 
 def admin_demo_dashboard(request):
@@ -26,17 +31,12 @@ def admin_demo_dashboard(request):
     
     try:
         from users.models import User
-        from mlm.models import Payment, Bonus, Withdrawal
+        from mlm.models import Payment, Withdrawal
+        
+        from mlm.services import get_dashboard_counters
         
         # Пытаемся получить реальные данные
-        stats['total_users'] = User.objects.count()
-        stats['active_users'] = User.objects.filter(is_active_mlm=True).count()
-        stats['participants'] = User.objects.filter(status='participant').count()
-        stats['partners'] = User.objects.filter(status='partner').count()
-        stats['total_payments'] = Payment.objects.filter(status='completed').aggregate(Sum=__import__('django.db.models', fromlist=['Sum']).Sum('amount'))['Sum'] or 0
-        stats['pending_payments'] = Payment.objects.filter(status='pending').count()
-        stats['total_bonuses'] = Bonus.objects.aggregate(Sum=__import__('django.db.models', fromlist=['Sum']).Sum('amount'))['Sum'] or 0
-        stats['pending_withdrawals'] = Withdrawal.objects.filter(status='pending').count()
+        stats.update(get_dashboard_counters())
         
         recent_users = User.objects.order_by('-date_joined')[:10]
         recent_payments = Payment.objects.order_by('-created_at')[:10]
@@ -203,3 +203,32 @@ def build_structure_tree(user, level=0):
         'status': 'root' if level == 0 else 'partner',
         'partners': [build_structure_tree(partner, level + 1) for partner in partners]
     }
+
+
+def _int_param(request, name):
+    try:
+        return int(request.GET[name])
+    except (KeyError, ValueError):
+        return None
+
+
+@login_required
+@user_passes_test(is_admin)
+def structure_data_api(request):
+    """
+    JSON майнд-карты (только для администраторов: в карточках имена и суммы
+    бонусов). Параметры: root (id пользователя), depth, cursor,
+    page_size. Снимок кэшируется по версии структуры; если If-None-Match
+    совпадает с ETag, отвечаем 304 без обращения к БД.
+    """
+    payload, etag = get_structure_payload(
+        root_user_id=_int_param(request, 'root'),
+        max_depth=_int_param(request, 'depth'),
+        cursor=request.GET.get('cursor') or None,
+        page_size=_int_param(request, 'page_size'),
+    )
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = JsonResponse(payload)
+    response['ETag'] = etag
+    return response
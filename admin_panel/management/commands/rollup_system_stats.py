@@ -0,0 +1,32 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from admin_panel.stats_rollup import rollup_system_stats
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет дневные сводки SystemStats (по умолчанию — с последнего сохраненного дня). '
+        'Без celery beat запускайте из cron: 5 * * * * python manage.py rollup_system_stats'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--since',
+            help='Пересчитать начиная с даты (ГГГГ-ММ-ДД)'
+        )
+        parser.add_argument(
+            '--until',
+            help='Последний пересчитываемый день (по умолчанию сегодня)'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            start = date.fromisoformat(options['since']) if options['since'] else None
+            end = date.fromisoformat(options['until']) if options['until'] else None
+        except ValueError as e:
+            raise CommandError(f'Неверная дата: {e}')
+
+        days = rollup_system_stats(start, end)
+        self.stdout.write(self.style.SUCCESS(f'📊 Обновлено дневных сводок: {days}'))
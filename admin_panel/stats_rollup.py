@@ -0,0 +1,196 @@
+"""
+Дневные сводки SystemStats.
+Каждая метрика считается одним GROUP BY по дню (TruncDate) за весь
+пересчитываемый диапазон, строки пишутся одним bulk_create с обновлением
+при конфликте по дате. Повторный запуск продолжает с последнего
+сохраненного дня, поэтому история добирается инкрементально.
+
+Запуск: celery beat (CELERY_BEAT_SCHEDULE в настройках) или cron без celery:
+    5 * * * * python manage.py rollup_system_stats
+"""
+
+from __future__ import annotations
+
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from typing import Dict, List, Optional
+
+from django.db.models import Count, DecimalField, Q, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from users.models import User
+from mlm.models import Bonus, Payment, Withdrawal
+
+from .models import SystemStats
+
+ZERO = Decimal('0.00')
+
+# Поля SystemStats, которые пересчитываются из исходных таблиц
+DAILY_FIELDS = (
+    'new_registrations',
+    'active_users',
+    'total_payments',
+    'completed_payments',
+    'pending_payments',
+    'total_bonuses_paid',
+    'green_bonuses',
+    'red_bonuses',
+    'total_withdrawals',
+    'pending_withdrawals',
+)
+
+
+def _money(condition: Optional[Q] = None, field: str = 'amount'):
+    return Coalesce(
+        Sum(field, filter=condition),
+        Value(ZERO),
+        output_field=DecimalField(max_digits=15, decimal_places=2),
+    )
+
+
+def _day_start(day: date) -> datetime:
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _by_day(queryset, date_field: str, start: date, end: date, **aggregates) -> Dict[date, Dict]:
+    """Один GROUP BY по дню: {день: {метрика: значение}} за [start, end]."""
+    rows = (
+        queryset.filter(**{
+            f'{date_field}__gte': _day_start(start),
+            f'{date_field}__lt': _day_start(end + timedelta(days=1)),
+        })
+        .annotate(day=TruncDate(date_field))
+        .order_by()
+        .values('day')
+        .annotate(**aggregates)
+    )
+    return {row.pop('day'): row for row in rows}
+
+
+def _first_activity_date() -> Optional[date]:
+    first = User.objects.order_by('date_joined').values_list('date_joined', flat=True).first()
+    return timezone.localtime(first).date() if first else None
+
+
+def get_rollup_start() -> Optional[date]:
+    """
+    С какого дня пересчитывать: последний сохраненный день (он мог быть
+    неполным), а при пустой таблице — день первой регистрации.
+    """
+    last = SystemStats.objects.order_by('-date').values_list('date', flat=True).first()
+    return last or _first_activity_date()
+
+
+def rollup_system_stats(start: Optional[date] = None, end: Optional[date] = None) -> int:
+    """
+    Пересчитывает SystemStats за дни [start, end] и возвращает число строк.
+    active_users — пользователи с завершенным платежом за день,
+    total_users — нарастающий итог регистраций на конец дня.
+    """
+    end = end or timezone.localdate()
+    start = start or get_rollup_start()
+    if start is None or start > end:
+        return 0
+
+    registrations = _by_day(User.objects.all(), 'date_joined', start, end, new_registrations=Count('id'))
+    # Завершенные суммы относятся к дню завершения, а не создания: так
+    # уже посчитанные дни не меняются, когда платеж или вывод закрыт позже.
+    payments = _by_day(
+        Payment.objects.all(), 'created_at', start, end,
+        total_payments=_money(),
+        pending_payments=_money(Q(status='pending')),
+    )
+    completed = _by_day(
+        Payment.objects.filter(status='completed'), 'completed_at', start, end,
+        completed_payments=_money(),
+        active_users=Count('user', distinct=True),
+    )
+    bonuses = _by_day(
+        Bonus.objects.all(), 'created_at', start, end,
+        total_bonuses_paid=_money(),
+        green_bonuses=_money(Q(bonus_type='green')),
+        red_bonuses=_money(Q(bonus_type='red')),
+    )
+    withdrawals = _by_day(
+        Withdrawal.objects.filter(status__in=['pending', 'processing']), 'created_at', start, end,
+        pending_withdrawals=_money(),
+    )
+    paid_out = _by_day(
+        Withdrawal.objects.filter(status='completed'), 'processed_at', start, end,
+        total_withdrawals=_money(),
+    )
+
+    total_users = User.objects.filter(date_joined__lt=_day_start(start)).count()
+    now = timezone.now()
+    rows: List[SystemStats] = []
+    day = start
+    while day <= end:
+        values = {field: 0 for field in DAILY_FIELDS}
+        for metric in (registrations, payments, completed, bonuses, withdrawals, paid_out):
+            values.update(metric.get(day, {}))
+        total_users += values['new_registrations']
+        rows.append(SystemStats(date=day, total_users=total_users, created_at=now, **values))
+        day += timedelta(days=1)
+
+    SystemStats.objects.bulk_create(
+        rows,
+        batch_size=1000,
+        update_conflicts=True,
+        unique_fields=['date'],
+        update_fields=['total_users', 'created_at', *DAILY_FIELDS],
+    )
+    return len(rows)
+
+
+def get_money_totals() -> Dict[str, Decimal]:
+    """
+    Денежные итоги за все время: закрытые дни — суммой SystemStats,
+    последний сохраненный (возможно неполный) день и все после него —
+    живыми агрегатами по исходным таблицам, чтобы итоги не отставали
+    от сводки.
+    """
+    payments = Payment.objects.filter(status='completed')
+    bonuses = Bonus.objects.all()
+    withdrawals = Withdrawal.objects.filter(status='completed')
+    totals = {'total_payments': ZERO, 'total_bonuses': ZERO, 'total_withdrawals': ZERO}
+
+    tail_start = SystemStats.objects.order_by('-date').values_list('date', flat=True).first()
+    if tail_start is not None:
+        totals = SystemStats.objects.filter(date__lt=tail_start).aggregate(
+            total_payments=_money(field='completed_payments'),
+            total_bonuses=_money(field='total_bonuses_paid'),
+            total_withdrawals=_money(field='total_withdrawals'),
+        )
+        since = _day_start(tail_start)
+        payments = payments.filter(completed_at__gte=since)
+        bonuses = bonuses.filter(created_at__gte=since)
+        withdrawals = withdrawals.filter(processed_at__gte=since)
+
+    totals['total_payments'] += payments.aggregate(total=_money())['total']
+    totals['total_bonuses'] += bonuses.aggregate(total=_money())['total']
+    totals['total_withdrawals'] += withdrawals.aggregate(total=_money())['total']
+    return totals
+
+
+def get_daily_stats(days: int = 30) -> List[Dict]:
+    """Последние days дней из SystemStats одним запросом; пропуски — нулями."""
+    end = timezone.localdate()
+    start = end - timedelta(days=days - 1)
+    stored = {
+        row['date']: row
+        for row in SystemStats.objects.filter(date__range=(start, end)).values('date', 'total_users', *DAILY_FIELDS)
+    }
+    daily = []
+    for offset in range(days):
+        day = end - timedelta(days=offset)
+        row = stored.get(day, {})
+        daily.append({
+            'date': day,
+            'registrations': row.get('new_registrations', 0),
+            'payments': row.get('completed_payments', ZERO),
+            'bonuses': row.get('total_bonuses_paid', ZERO),
+            'withdrawals': row.get('total_withdrawals', ZERO),
+            'total_users': row.get('total_users'),
+        })
+    return daily
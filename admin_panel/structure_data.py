@@ -1,15 +1,24 @@
 from __future__ import annotations
 
+import base64
+import json
 from collections import defaultdict
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass
+from datetime import datetime
 from decimal import Decimal
 from typing import Dict, List, Optional, Tuple
 
-from django.db.models import Sum
+from django.db.models import Count, Q, Sum
 from django.utils import timezone
 
 from users.models import User
 from mlm.models import MLMStructure, Bonus, Payment
+from mlm.services.structure_version import get_structure_snapshot
+from mlm.tree_metrics import compute_tree_metrics
+
+NODE_ORDERING = ("level", "position", "created_at", "id")
+# Больше карточек за страницу не отдаем, сколько бы ни попросили
+MAX_PAGE_SIZE = 500
 
 
 @dataclass
@@ -17,6 +26,20 @@ class StructureDataset:
     cards: List[Dict]
     child_map: List[Tuple[str, List[str]]]
     uid_counter: int
+    # Курсор следующей страницы карточек (None — страниц больше нет)
+    next_cursor: Optional[str] = None
+
+
+@dataclass
+class _NodeRow:
+    """Легкая строка узла: id, родитель, уровень и статус, без модели пользователя."""
+
+    user_id: int
+    parent_id: Optional[int]
+    level: int
+    status: str
+    children_count: int
+    descendants_count: int
 
 
 @dataclass
@@ -39,181 +62,205 @@ def _resolve_root_user(structures: List[MLMStructure]) -> Optional[User]:
     )
 
 
-def _build_children_map(structures: List[MLMStructure]) -> Dict[int, List[int]]:
-    children: Dict[int, List[int]] = defaultdict(list)
-    for node in structures:
-        if node.parent_id:
-            children[node.parent_id].append(node.user_id)
-    return children
-
-
-def _build_descendants_counter(children_map: Dict[int, List[int]]):
-    cache: Dict[int, int] = {}
+@dataclass
+class _RootAnchor:
+    """Путь и уровень корня; корень без узла начинает собственную ветку на уровне -1."""
 
-    def _count(user_id: int) -> int:
-        if user_id in cache:
-            return cache[user_id]
-        total = 0
-        for child_id in children_map.get(user_id, []):
-            total += 1 + _count(child_id)
-        cache[user_id] = total
-        return total
+    path: str
+    level: int
+    descendants_count: Optional[int]
 
-    return _count, cache
+    @property
+    def has_node(self) -> bool:
+        return self.descendants_count is not None
 
 
-def _build_level_calculator(children_map: Dict[int, List[int]]):
-    cache: Dict[int, int] = {}
+def _root_anchor(root_user: User) -> _RootAnchor:
+    row = MLMStructure.objects.filter(user=root_user).values_list(
+        "path", "level", "descendants_count"
+    ).first()
+    return _RootAnchor(*row) if row else _RootAnchor(MLMStructure.path_segment(root_user.id), -1, None)
 
-    def _calculate(user_id: int) -> int:
-        if user_id in cache:
-            return cache[user_id]
 
-        child_ids = children_map.get(user_id, [])
-        if len(child_ids) < 3:
-            cache[user_id] = 0
-            return 0
+def _structure_scope(
+    root_user: Optional[User], max_depth: Optional[int], anchor: Optional[_RootAnchor] = None
+):
+    """Узлы для визуализации: все дерево или поддерево root_user не глубже max_depth."""
+    if root_user is None:
+        return MLMStructure.objects.all() if max_depth is None else (
+            MLMStructure.objects.filter(level__lte=max_depth)
+        )
+    anchor = anchor or _root_anchor(root_user)
+    scope = MLMStructure.objects.filter(path__startswith=anchor.path)
+    if max_depth is not None:
+        scope = scope.filter(level__lte=anchor.level + max_depth)
+    return scope
 
-        child_levels = [_calculate(child_id) for child_id in child_ids]
 
-        level = 0
-        while sum(1 for child_level in child_levels if child_level >= level) >= 3:
-            level += 1
+@dataclass
+class _PageCursor:
+    """Ключ последней отданной карточки (порядок NODE_ORDERING), ее номер в уровне и число отданных узлов."""
+
+    level: int
+    position: int
+    created_at: datetime
+    id: int
+    level_index: int
+    seen: int
+
+    def encode(self) -> str:
+        raw = json.dumps([
+            self.level, self.position, self.created_at.isoformat(), self.id, self.level_index, self.seen,
+        ])
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+    @classmethod
+    def decode(cls, cursor: Optional[str]) -> Optional["_PageCursor"]:
+        """Разбирает курсор; испорченный курсор означает первую страницу."""
+        if not cursor:
+            return None
+        try:
+            raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+            level, position, created_at, node_id, level_index, seen = json.loads(raw)
+            return cls(
+                int(level), int(position), datetime.fromisoformat(created_at),
+                int(node_id), int(level_index), int(seen),
+            )
+        except (TypeError, ValueError):
+            return None
+
+    def after(self) -> Q:
+        """Узлы строго после курсора в порядке NODE_ORDERING (keyset)."""
+        return (
+            Q(level__gt=self.level)
+            | Q(level=self.level, position__gt=self.position)
+            | Q(level=self.level, position=self.position, created_at__gt=self.created_at)
+            | Q(level=self.level, position=self.position, created_at=self.created_at, id__gt=self.id)
+        )
 
-        cache[user_id] = level
-        return level
 
-    return _calculate, cache
+def _user_card(user: User, card_id: str, parent_id: Optional[str], level: Optional[int], display_level: int,
+               left: int, top: int, direct: int, total: int, bonus: Decimal, payout: Decimal) -> Dict:
+    """level — вычисленный уровень; в окнах и страницах он неизвестен (None), displayLevel — глубина."""
+    return {
+        "id": card_id,
+        "parent": parent_id,
+        "name": (user.get_full_name() or "").strip() or user.username,
+        "uid": user.referral_code or f"{user.id:07d}",
+        "username": user.username,
+        "level": level,
+        "displayLevel": display_level,
+        "left": left,
+        "top": top,
+        "status": user.status,
+        "rank": user.rank,
+        "directReferrals": direct,
+        "totalReferrals": total,
+        "directInvites": direct,
+        "bonusYellow": float(bonus),
+        "payoutGreen": float(payout),
+    }
 
 
 def build_structure_dataset(
     root_user: Optional[User] = None,
+    max_depth: Optional[int] = None,
+    cursor: Optional[str] = None,
+    page_size: Optional[int] = None,
 ) -> Tuple[StructureDataset, StructureStats]:
     """
     Собирает данные структуры и статистику на основе MLMStructure.
-    """
-
-    structures = list(
-        MLMStructure.objects.select_related("user", "parent").order_by(
-            "level", "position", "created_at"
-        )
-    )
+    С root_user загружается только его поддерево (по префиксу пути), с
+    max_depth — не глубже заданного числа уровней. С page_size карточки
+    отдаются страницами (см. _build_structure_page).
 
+    Вычисленный уровень требует всего поддерева, поэтому в окне max_depth
+    он не считается: level карточек и корня — None, уровни статистики —
+    по глубине.
+    """
+    if page_size is not None:
+        return _build_structure_page(root_user, max_depth, cursor, min(max(page_size, 1), MAX_PAGE_SIZE))
+
+    windowed = max_depth is not None
+    scope = _structure_scope(root_user, max_depth)
+    structures = list(scope.select_related("user", "parent").order_by(*NODE_ORDERING))
+    nodes = [
+        _NodeRow(s.user_id, s.parent_id, s.level, s.user.status, s.children_count, s.descendants_count)
+        for s in structures
+    ]
     if not root_user:
         root_user = _resolve_root_user(structures)
 
-    children_map = _build_children_map(structures)
-    count_descendants, descendants_cache = _build_descendants_counter(children_map)
-    calculate_level, levels_cache = _build_level_calculator(children_map)
+    # Корень без собственного узла добавляется в метрики виртуальной вершиной
+    root_has_node = bool(root_user) and any(node.user_id == root_user.id for node in nodes)
+    pairs = [(node.user_id, node.parent_id) for node in nodes]
+    if root_user and not root_has_node:
+        pairs.append((root_user.id, None))
+    metrics = compute_tree_metrics(pairs)
 
-    # Посчитаем для всех пользователей, чтобы кэши были заполнены
-    for node in structures:
-        count_descendants(node.user_id)
-        calculate_level(node.user_id)
-    if root_user:
-        count_descendants(root_user.id)
-        calculate_level(root_user.id)
-
-    user_ids = [node.user_id for node in structures]
-    if root_user and root_user.id not in user_ids:
-        user_ids.append(root_user.id)
-
-    bonus_totals: Dict[int, Decimal] = {
-        entry["user"]: entry["total"]
-        for entry in Bonus.objects.filter(user_id__in=user_ids)
-        .values("user")
-        .annotate(total=Sum("amount"))
+    # Размеры поддеревьев берем из счетчиков узлов: окно по глубине их обрезает
+    descendants_cache: Dict[int, int] = {
+        node.user_id: node.descendants_count for node in nodes
     }
+    if root_user and not root_has_node:
+        descendants_cache[root_user.id] = metrics.get(root_user.id, "descendants")
 
-    payout_totals: Dict[int, Decimal] = {
-        entry["user"]: entry["total"]
-        for entry in Payment.objects.filter(
-            user_id__in=user_ids, payment_type="withdrawal", status="completed"
-        )
-        .values("user")
-        .annotate(total=Sum("amount"))
-    }
+    include_root_card = bool(root_user) and not root_has_node
+    user_ids = [s.user_id for s in structures]
+    if include_root_card:
+        user_ids.append(root_user.id)
 
-    user_card_ids: Dict[int, str] = {}
-    if root_user:
-        user_card_ids[root_user.id] = "root"
+    bonus_totals, payout_totals = _money_totals(user_ids)
+    card_id = _card_ids(root_user)
 
+    level_offsets: Dict[int, int] = defaultdict(int)
     cards: List[Dict] = []
     child_map_for_front: Dict[str, List[str]] = defaultdict(list)
-    level_offsets: Dict[int, int] = defaultdict(int)
-    statuses: Dict[int, str] = {}
-
-    def _card_id(user_id: int) -> str:
-        if user_id in user_card_ids:
-            return user_card_ids[user_id]
-        if root_user and user_id == root_user.id:
-            user_card_ids[user_id] = "root"
-        else:
-            user_card_ids[user_id] = f"user-{user_id}"
-        return user_card_ids[user_id]
-
     for node in structures:
-        statuses[node.user_id] = node.user.status
-        card_id = _card_id(node.user_id)
-        parent_id = _card_id(node.parent_id) if node.parent_id else None
+        node_card_id = card_id(node.user_id)
+        # Корень поддерева рисуется без родителя: тот вне выборки
+        is_root = root_user and node.user_id == root_user.id
+        parent_id = card_id(node.parent_id) if node.parent_id and not is_root else None
         idx = level_offsets[node.level]
         level_offsets[node.level] += 1
 
-        direct_referrals = len(children_map.get(node.user_id, []))
-        total_referrals = descendants_cache.get(node.user_id, 0)
-        computed_level = levels_cache.get(node.user_id, node.level or 0)
-
+        computed_level = metrics.get(node.user_id, "computed_level")
         cards.append(
-            {
-                "id": card_id,
-                "parent": parent_id,
-                "name": (node.user.get_full_name() or "").strip()
-                or node.user.username,
-                "uid": node.user.referral_code
-                or f"{node.user.id:07d}",
-                "username": node.user.username,
-                "level": computed_level,
-                "displayLevel": computed_level,
-                "left": 400 + node.level * 320,
-                "top": 200 + idx * 200,
-                "status": node.user.status,
-                "rank": node.user.rank,
-                "directReferrals": direct_referrals,
-                "totalReferrals": total_referrals,
-                "directInvites": direct_referrals,
-                "bonusYellow": float(bonus_totals.get(node.user_id, Decimal("0"))),
-                "payoutGreen": float(payout_totals.get(node.user_id, Decimal("0"))),
-            }
+            _user_card(
+                node.user,
+                node_card_id,
+                parent_id,
+                None if windowed else computed_level,
+                metrics.get(node.user_id, "depth") if windowed else computed_level,
+                left=400 + node.level * 320,
+                top=200 + idx * 200,
+                # На границе окна max_depth детей в выборке нет — берем счетчик узла
+                direct=max(metrics.get(node.user_id, "children"), node.children_count),
+                total=descendants_cache.get(node.user_id, 0),
+                bonus=bonus_totals.get(node.user_id, Decimal("0")),
+                payout=payout_totals.get(node.user_id, Decimal("0")),
+            )
         )
         if parent_id:
-            child_map_for_front[parent_id].append(card_id)
+            child_map_for_front[parent_id].append(node_card_id)
 
-    if root_user and all(card["id"] != "root" for card in cards):
-        root_level = levels_cache.get(root_user.id, 0)
-        root_direct = len(children_map.get(root_user.id, []))
-        root_total = descendants_cache.get(root_user.id, 0)
+    if include_root_card:
+        root_level = metrics.get(root_user.id, "computed_level")
         cards.insert(
             0,
-            {
-                "id": "root",
-                "parent": None,
-                "name": (root_user.get_full_name() or "").strip()
-                or root_user.username,
-                "uid": root_user.referral_code
-                or f"{root_user.id:07d}",
-                "username": root_user.username,
-                "level": root_level,
-                "displayLevel": root_level,
-                "left": 2400,
-                "top": 200,
-                "status": root_user.status,
-                "rank": root_user.rank,
-                "directReferrals": root_direct,
-                "totalReferrals": root_total,
-                "directInvites": root_direct,
-                "bonusYellow": float(bonus_totals.get(root_user.id, Decimal("0"))),
-                "payoutGreen": float(payout_totals.get(root_user.id, Decimal("0"))),
-            },
+            _user_card(
+                root_user,
+                "root",
+                None,
+                None if windowed else root_level,
+                0 if windowed else root_level,
+                left=2400,
+                top=200,
+                direct=metrics.get(root_user.id, "children"),
+                total=descendants_cache.get(root_user.id, 0),
+                bonus=bonus_totals.get(root_user.id, Decimal("0")),
+                payout=payout_totals.get(root_user.id, Decimal("0")),
+            ),
         )
 
     dataset = StructureDataset(
@@ -224,25 +271,16 @@ def build_structure_dataset(
         uid_counter=len(cards) + 5,
     )
 
-    level_stats: Dict[int, Dict[str, int]] = defaultdict(
-        lambda: {"total": 0, "partners": 0, "participants": 0}
+    # Виртуальный корень стоит последним и в статистику узлов не входит
+    statuses = [node.status for node in nodes]
+    histogram = metrics.level_histogram(
+        "depth" if windowed else "computed_level", labels=statuses, positions=range(len(nodes))
     )
-    total_partners = 0
-    total_participants = 0
-    for node in structures:
-        computed_level = levels_cache.get(node.user_id, node.level or 0)
-        level_entry = level_stats[computed_level]
-        level_entry["total"] += 1
-        if node.user.status == "partner":
-            level_entry["partners"] += 1
-            total_partners += 1
-        elif node.user.status == "participant":
-            level_entry["participants"] += 1
-            total_participants += 1
-
-    formatted_levels = [
-        {"level": level, **stats}
-        for level, stats in sorted(level_stats.items(), key=lambda item: item[0])
+    formatted_levels = _format_levels(histogram)
+    first_line = [
+        statuses[position]
+        for position in range(len(nodes))
+        if root_user and metrics.parent[position] == metrics.index.get(root_user.id)
     ]
 
     root_stats = None
@@ -251,34 +289,258 @@ def build_structure_dataset(
             "name": (root_user.get_full_name() or "").strip() or root_user.username,
             "username": root_user.username,
             "rank": root_user.rank,
-            "level": levels_cache.get(root_user.id, 0),
-            "direct_referrals": len(children_map.get(root_user.id, [])),
-            "partners_on_first_line": sum(
-                1
-                for child_id in children_map.get(root_user.id, [])
-                if statuses.get(child_id) == "partner"
-            ),
-            "participants_on_first_line": sum(
-                1
-                for child_id in children_map.get(root_user.id, [])
-                if statuses.get(child_id) == "participant"
-            ),
+            "level": None if windowed else metrics.get(root_user.id, "computed_level"),
+            "direct_referrals": metrics.get(root_user.id, "children"),
+            "partners_on_first_line": first_line.count("partner"),
+            "participants_on_first_line": first_line.count("participant"),
             "total_descendants": descendants_cache.get(root_user.id, 0),
         }
 
-    stats = StructureStats(
+    return dataset, _structure_stats(root_stats, formatted_levels, len(nodes))
+
+
+def _money_totals(user_ids: List[int]) -> Tuple[Dict[int, Decimal], Dict[int, Decimal]]:
+    """Суммы бонусов и завершенных выплат по пользователям карточек."""
+    bonus_totals: Dict[int, Decimal] = {
+        entry["user"]: entry["total"]
+        for entry in Bonus.objects.filter(user_id__in=user_ids)
+        .values("user")
+        .annotate(total=Sum("amount"))
+    }
+    payout_totals: Dict[int, Decimal] = {
+        entry["user"]: entry["total"]
+        for entry in Payment.objects.filter(
+            user_id__in=user_ids, payment_type="withdrawal", status="completed"
+        )
+        .values("user")
+        .annotate(total=Sum("amount"))
+    }
+    return bonus_totals, payout_totals
+
+
+def _card_ids(root_user: Optional[User]):
+    def card_id(user_id: int) -> str:
+        return "root" if root_user and user_id == root_user.id else f"user-{user_id}"
+
+    return card_id
+
+
+def _format_levels(histogram: Dict[int, Dict[str, int]]) -> List[Dict]:
+    return [
+        {
+            "level": level,
+            "total": entry["total"],
+            "partners": entry.get("partner", 0),
+            "participants": entry.get("participant", 0),
+        }
+        for level, entry in histogram.items()
+    ]
+
+
+def _structure_stats(root_stats: Optional[Dict], levels: List[Dict], nodes: int) -> StructureStats:
+    return StructureStats(
         root=root_stats,
-        levels=formatted_levels,
+        levels=levels,
         totals={
-            "nodes": len(structures),
-            "partners": total_partners,
-            "participants": total_participants,
-            "max_depth": max(
-                (levels_cache.get(node.user_id, node.level or 0) for node in structures),
-                default=0,
-            ),
+            "nodes": nodes,
+            "partners": sum(level["partners"] for level in levels),
+            "participants": sum(level["participants"] for level in levels),
+            "max_depth": max((level["level"] for level in levels), default=0),
         },
         generated_at=timezone.now().isoformat(),
     )
 
-    return dataset, stats
+
+def _build_structure_page(
+    root_user: Optional[User],
+    max_depth: Optional[int],
+    cursor: Optional[str],
+    page_size: int,
+) -> Tuple[StructureDataset, StructureStats]:
+    """
+    Страница карточек по keyset-курсору над (level, position, created_at, id):
+    из БД читаются только узлы страницы, статистика — агрегатами GROUP BY,
+    каркас дерева в память не загружается. Вычисленный уровень на странице
+    неизвестен, displayLevel и уровни статистики — глубина от корня.
+    Номер карточки в уровне переносится курсором, поэтому страницы
+    раскладываются так же, как цельная выгрузка.
+    """
+    if root_user is None:
+        root_node = (
+            MLMStructure.objects.filter(parent__isnull=True)
+            .select_related("user").order_by(*NODE_ORDERING).first()
+        )
+        scope = _structure_scope(None, max_depth)
+        root_user = root_node.user if root_node else _resolve_root_user([])
+        anchor = _RootAnchor("", 0, root_node.descendants_count) if root_node else _RootAnchor("", -1, None)
+    else:
+        anchor = _root_anchor(root_user)
+        scope = _structure_scope(root_user, max_depth, anchor)
+
+    after = _PageCursor.decode(cursor)
+    page_query = scope.select_related("user").order_by(*NODE_ORDERING)
+    if after is not None:
+        page_query = page_query.filter(after.after())
+    rows = list(page_query[:page_size + 1])
+    page = rows[:page_size]
+
+    include_root_card = bool(root_user) and after is None and not anchor.has_node
+    user_ids = [node.user_id for node in page]
+    if include_root_card:
+        user_ids.append(root_user.id)
+    bonus_totals, payout_totals = _money_totals(user_ids)
+    card_id = _card_ids(root_user)
+
+    level_offsets: Dict[int, int] = defaultdict(int)
+    if after is not None:
+        level_offsets[after.level] = after.level_index + 1
+    cards: List[Dict] = []
+    child_map_for_front: Dict[str, List[str]] = defaultdict(list)
+    for node in page:
+        node_card_id = card_id(node.user_id)
+        is_root = root_user and node.user_id == root_user.id
+        parent_id = card_id(node.parent_id) if node.parent_id and not is_root else None
+        idx = level_offsets[node.level]
+        level_offsets[node.level] += 1
+        cards.append(
+            _user_card(
+                node.user,
+                node_card_id,
+                parent_id,
+                None,
+                node.level - anchor.level,
+                left=400 + node.level * 320,
+                top=200 + idx * 200,
+                direct=node.children_count,
+                total=node.descendants_count,
+                bonus=bonus_totals.get(node.user_id, Decimal("0")),
+                payout=payout_totals.get(node.user_id, Decimal("0")),
+            )
+        )
+        if parent_id:
+            child_map_for_front[parent_id].append(node_card_id)
+
+    seen = (after.seen if after else 0) + len(page)
+    next_cursor = None
+    if len(rows) > page_size:
+        last = page[-1]
+        next_cursor = _PageCursor(
+            last.level, last.position, last.created_at, last.id, level_offsets[last.level] - 1, seen
+        ).encode()
+
+    # Статистика агрегатами: уровни по глубине и первая линия корня
+    histogram: Dict[int, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+    for row in scope.order_by().values("level", "user__status").annotate(total=Count("id")):
+        entry = histogram[row["level"] - anchor.level]
+        entry["total"] += row["total"]
+        entry[row["user__status"]] += row["total"]
+    formatted_levels = _format_levels({depth: dict(entry) for depth, entry in sorted(histogram.items())})
+    nodes_count = sum(level["total"] for level in formatted_levels)
+
+    root_stats = None
+    if root_user:
+        first_line = {
+            row["user__status"]: row["total"]
+            for row in MLMStructure.objects.filter(parent=root_user).order_by()
+            .values("user__status").annotate(total=Count("id"))
+        }
+        direct = sum(first_line.values())
+        total = anchor.descendants_count if anchor.has_node else nodes_count
+        if include_root_card:
+            cards.insert(
+                0,
+                _user_card(
+                    root_user, "root", None, None, 0, left=2400, top=200, direct=direct, total=total,
+                    bonus=bonus_totals.get(root_user.id, Decimal("0")),
+                    payout=payout_totals.get(root_user.id, Decimal("0")),
+                ),
+            )
+        root_stats = {
+            "name": (root_user.get_full_name() or "").strip() or root_user.username,
+            "username": root_user.username,
+            "rank": root_user.rank,
+            "level": None,
+            "direct_referrals": direct,
+            "partners_on_first_line": first_line.get("partner", 0),
+            "participants_on_first_line": first_line.get("participant", 0),
+            "total_descendants": total,
+        }
+
+    dataset = StructureDataset(
+        cards=cards,
+        child_map=[(parent, children) for parent, children in child_map_for_front.items()],
+        uid_counter=seen + 5,
+        next_cursor=next_cursor,
+    )
+    return dataset, _structure_stats(root_stats, formatted_levels, nodes_count)
+
+
+def structure_payload(dataset: StructureDataset, stats: StructureStats) -> Dict:
+    """JSON майнд-карты в формате фронта: structure (карточки и связи) и stats."""
+    return {
+        "structure": {
+            "cards": dataset.cards,
+            "childMap": [[parent, children] for parent, children in dataset.child_map],
+            "uidCounter": dataset.uid_counter,
+            "nextCursor": dataset.next_cursor,
+        },
+        "stats": asdict(stats),
+    }
+
+
+def get_structure_payload(
+    root_user_id: Optional[int] = None,
+    max_depth: Optional[int] = None,
+    cursor: Optional[str] = None,
+    page_size: Optional[int] = None,
+) -> Tuple[Dict, str]:
+    """
+    Снимок майнд-карты и его ETag из кэша текущей версии структуры; БД
+    читается только при промахе. Ключ кэша строится из нормализованных
+    параметров: page_size ограничен, курсор пересобран из разобранного
+    (испорченный — первая страница), без page_size курсор не учитывается.
+    """
+    if page_size is None:
+        cursor = None
+    else:
+        page_size = min(max(page_size, 1), MAX_PAGE_SIZE)
+        page_cursor = _PageCursor.decode(cursor)
+        cursor = page_cursor.encode() if page_cursor else None
+
+    def build() -> Dict:
+        root_user = User.objects.filter(pk=root_user_id).first() if root_user_id else None
+        return structure_payload(*build_structure_dataset(root_user, max_depth, cursor, page_size))
+
+    return get_structure_snapshot(
+        f"dataset:{root_user_id}:{max_depth}:{cursor}:{page_size}", build
+    )
+
+
+def build_admin_tree(root_user: Optional[User], max_depth: int) -> Optional[Dict]:
+    """
+    Вложенное дерево для шаблонов админки ({user, mlm_structure, children,
+    level}) на max_depth уровней: окно поддерева читается одним запросом,
+    вложенность собирается проходом по узлам, упорядоченным по уровню.
+    """
+    if root_user is None or max_depth < 1:
+        return None
+    nodes = list(
+        _structure_scope(root_user, max_depth - 1).select_related("user").order_by(*NODE_ORDERING)
+    )
+    metrics = compute_tree_metrics((node.user_id, node.parent_id) for node in nodes)
+    tree = {
+        node.user_id: {
+            "user": node.user,
+            "mlm_structure": node,
+            "children": [],
+            "level": metrics.get(node.user_id, "depth"),
+        }
+        for node in nodes
+    }
+    if root_user.id not in tree:
+        return None
+    for node in nodes:
+        parent = tree.get(node.parent_id)
+        if parent is not None and node.user_id != root_user.id:
+            parent["children"].append(tree[node.user_id])
+    return tree[root_user.id]
@@ -0,0 +1,15 @@
+try:
+    from celery import shared_task
+except ImportError:
+    shared_task = None
+
+from admin_panel.stats_rollup import rollup_system_stats
+
+rollup_system_stats_task = None
+
+if shared_task is not None:
+
+    @shared_task
+    def rollup_system_stats_task():
+        """Сводка по расписанию CELERY_BEAT_SCHEDULE: добирает дни с последнего сохраненного."""
+        return rollup_system_stats()
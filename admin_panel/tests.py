@@ -1,3 +1,196 @@
-from django.test import TestCase
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import include, path
+from django.utils import timezone
+
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.messages.storage.fallback import FallbackStorage
+from django.contrib.sessions.backends.base import SessionBase
+
+from mlm.models import Bonus, MLMStructure, Payment, Withdrawal
+from mlm.services import create_payout_batch, post_credit, post_debit
+from users.models import User
+
+from .models import SystemStats
+from .stats_rollup import get_daily_stats, get_money_totals, rollup_system_stats
+from .demo_views import structure_data_api
+from .views import process_withdrawal, withdrawals_list
+from .structure_data import build_structure_dataset
+
+
+class SystemStatsRollupTests(TestCase):
+    """Дневные сводки считаются GROUP BY и добираются инкрементально."""
+
+    def setUp(self):
+        now = timezone.now()
+        self.today = timezone.localdate()
+        for days_ago, name in ((2, 'early'), (2, 'early_2'), (0, 'today')):
+            user = User.objects.create(username=name, email=f'{name}@example.com')
+            User.objects.filter(pk=user.pk).update(date_joined=now - timedelta(days=days_ago))
+            Payment.objects.create(
+                user=user, amount=100, payment_type='registration', status='completed',
+                created_at=now - timedelta(days=days_ago), completed_at=now - timedelta(days=days_ago),
+            )
+            Bonus.objects.create(user=user, amount=25, bonus_type='green', created_at=now - timedelta(days=days_ago))
+
+    def test_rollup_backfills_and_continues(self):
+        with self.assertNumQueries(10):
+            self.assertEqual(rollup_system_stats(), 3)
+
+        first = SystemStats.objects.get(date=self.today - timedelta(days=2))
+        self.assertEqual((first.new_registrations, first.total_users), (2, 2))
+        self.assertEqual(first.completed_payments, Decimal('200.00'))
+        self.assertEqual(first.green_bonuses, Decimal('50.00'))
+        self.assertEqual(SystemStats.objects.get(date=self.today).total_users, 3)
+
+        # Повторный запуск пересчитывает только последний (текущий) день
+        Bonus.objects.create(user=User.objects.get(username='today'), amount=10, bonus_type='red')
+        self.assertEqual(rollup_system_stats(), 1)
+        self.assertEqual(SystemStats.objects.get(date=self.today).total_bonuses_paid, Decimal('35.00'))
+
+        with self.assertNumQueries(1):
+            daily = get_daily_stats(30)
+        self.assertEqual(len(daily), 30)
+        self.assertEqual(daily[0]['registrations'], 1)
+
+    def test_money_totals_add_live_tail(self):
+        self.assertEqual(get_money_totals()['total_payments'], Decimal('300.00'))
+        rollup_system_stats()
+
+        # Бонус после сводки виден в итогах сразу, без нового прогона
+        Bonus.objects.create(user=User.objects.get(username='today'), amount=10, bonus_type='red')
+        with self.assertNumQueries(5):
+            totals = get_money_totals()
+        self.assertEqual(totals['total_payments'], Decimal('300.00'))
+        self.assertEqual(totals['total_bonuses'], Decimal('85.00'))
+        self.assertEqual(totals['total_withdrawals'], Decimal('0.00'))
+
+
+class StructureDatasetTests(TestCase):
+    """Данные майнд-карты: поддерево, окно по глубине и страницы."""
+
+    def setUp(self):
+        self.root = User.objects.create(username='root', email='root@example.com')
+        MLMStructure.objects.create(user=self.root, level=0)
+        self.users = {}
+        for name, parent, level, position in (
+            ('a', 'root', 1, 1), ('b', 'root', 1, 2), ('c', 'a', 2, 1), ('d', 'c', 3, 1),
+        ):
+            user = User.objects.create(username=name, email=f'{name}@example.com')
+            parent_user = self.root if parent == 'root' else self.users[parent]
+            MLMStructure.objects.create(user=user, parent=parent_user, level=level, position=position)
+            self.users[name] = user
+
+    def test_subtree_with_depth_window(self):
+        dataset, stats = build_structure_dataset(self.users['a'], max_depth=1)
+        self.assertEqual([card['username'] for card in dataset.cards], ['a', 'c'])
+        self.assertIsNone(dataset.cards[0]['parent'])
+        # Узел на границе окна сохраняет число прямых приглашенных
+        self.assertEqual(dataset.cards[1]['directReferrals'], 1)
+        # Вычисленный уровень в окне неизвестен, вместо него — глубина
+        self.assertEqual([card['level'] for card in dataset.cards], [None, None])
+        self.assertEqual([card['displayLevel'] for card in dataset.cards], [0, 1])
+        self.assertEqual(stats.totals['nodes'], 2)
+
+    def test_pages_cover_whole_tree(self):
+        usernames, tops, cursor = [], [], None
+        while True:
+            with self.assertNumQueries(6):
+                dataset, stats = build_structure_dataset(self.root, cursor=cursor, page_size=2)
+            usernames += [card['username'] for card in dataset.cards]
+            tops += [card['top'] for card in dataset.cards]
+            cursor = dataset.next_cursor
+            if cursor is None:
+                break
+        full, _ = build_structure_dataset(self.root)
+        self.assertEqual(usernames, [card['username'] for card in full.cards])
+        self.assertEqual(tops, [card['top'] for card in full.cards])
+        # Страницы считают статистику агрегатами — так же, как окно по глубине
+        _, window_stats = build_structure_dataset(self.root, max_depth=10)
+        self.assertEqual(stats.levels, window_stats.levels)
+        self.assertEqual(stats.root, window_stats.root)
+
+    def _get(self, params, user=None, **headers):
+        request = RequestFactory().get('/', params, **headers)
+        request.user = user or self.staff
+        return structure_data_api(request)
+
+    def test_snapshot_etag_follows_structure_version(self):
+        cache.clear()
+        self.staff = User.objects.create(username='staff', email='staff@example.com', is_staff=True)
+        response = self._get({'root': self.root.pk})
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        with self.assertNumQueries(0):
+            response = self._get({'root': self.root.pk}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        user = User.objects.create(username='e', email='e@example.com')
+        MLMStructure.objects.create(user=user, parent=self.users['b'], level=2, position=1)
+        response = self._get({'root': self.root.pk}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_api_requires_admin_and_normalizes_cache_key(self):
+        cache.clear()
+        self.staff = User.objects.create(username='staff', email='staff@example.com', is_staff=True)
+        self.assertEqual(self._get({}, user=AnonymousUser()).status_code, 302)
+        self.assertEqual(self._get({}, user=self.users['a']).status_code, 302)
+
+        etag = self._get({'page_size': 10 ** 6})['ETag']
+        # Испорченный курсор и огромный page_size попадают в тот же снимок
+        with self.assertNumQueries(0):
+            response = self._get({'page_size': 10 ** 9, 'cursor': 'garbage'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+# Маршруты админки, на которые делают redirect тестируемые представления
+urlpatterns = [
+    path('admin-panel/', include((
+        [path('withdrawals/', withdrawals_list, name='withdrawals_list')], 'admin_panel'
+    ))),
+]
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class ProcessWithdrawalTests(TestCase):
+    """Одиночная обработка вывода не трогает выводы в пакете и обработанные."""
+
+    def setUp(self):
+        self.admin = User.objects.create(username='boss', email='boss@example.com', is_staff=True)
+        self.user = User.objects.create(username='payee', email='payee@example.com', referral_code='PAYEE001')
+        post_credit(self.user, 100, 'bonus')
+        post_debit(self.user, 40, 'withdrawal')
+        self.withdrawal = Withdrawal.objects.create(
+            user=self.user, amount=40, payment_method='card', payment_details='{}'
+        )
+
+    def _post(self, action):
+        request = RequestFactory().post('/', {'action': action})
+        request.user = self.admin
+        request.session = SessionBase()
+        request._messages = FallbackStorage(request)
+        return process_withdrawal(request, self.withdrawal.id)
+
+    def _balance(self):
+        self.user.refresh_from_db()
+        return self.user.balance
+
+    def test_reject_refunds_once_and_skips_batched(self):
+        self._post('reject')
+        self._post('reject')
+        self.assertEqual(self._balance(), Decimal('100.00'))
+
+        post_debit(self.user, 40, 'withdrawal')
+        self.withdrawal = Withdrawal.objects.create(
+            user=self.user, amount=40, payment_method='card', payment_details='{}'
+        )
+        create_payout_batch({})
+        self._post('reject')
+        self.assertEqual(self._balance(), Decimal('60.00'))
+        self.withdrawal.refresh_from_db()
+        self.assertEqual(self.withdrawal.status, 'processing')
 
-# Create your tests here.
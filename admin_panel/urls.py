@@ -11,6 +11,10 @@ urlpatterns = [
     path('structure/', demo_views.admin_demo_structure_v6, name='structure_view'),  # Новая горизонтальная майнд-карта
     path('structure-v3/', demo_views.admin_demo_structure_v3, name='structure_v3_view'),
     path('structure-v2/', demo_views.admin_demo_structure_v2, name='structure_v2_view'),
+    # Пакетные выплаты
+    path('payouts/create/', views.payout_batch_create, name='payout_batch_create'),
+    path('payouts/<int:batch_id>/process/', views.payout_batch_process, name='payout_batch_process'),
+    path('payouts/<int:batch_id>/export/', views.payout_batch_export, name='payout_batch_export'),
     # API endpoints
     path('api/structure-data/', demo_views.structure_data_api, name='structure_data_api'),
     path('api/save-card/', demo_views.save_card_api, name='save_card_api'),
@@ -1,21 +1,35 @@
+from decimal import Decimal
+
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib import messages
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.db import transaction
 from django.utils import timezone
 from django.core.paginator import Paginator
-from django.db.models import Q, Count, Sum
+from django.db.models import Q, Count, Max, Sum
 from django.utils.crypto import get_random_string
 from users.models import User, UserProfile
-from mlm.models import MLMStructure, Payment, Bonus, Withdrawal, MLMSettings, RankUpgrade
+from mlm.models import MLMStructure, Payment, Bonus, Withdrawal, MLMSettings, RankUpgrade, PayoutBatch
 from mlm.services import (
+    approve_payout_batch,
+    create_payout_batch,
+    enqueue_registration_completed,
     get_bonus_summary,
+    get_dashboard_counters,
+    get_descendant_ids,
     get_structure_statistics,
-    get_next_position,
+    move_subtree,
     place_user_in_structure,
+    post_credit,
+    post_debit,
+    reject_payout_batch,
+    stream_payout_file,
 )
+from mlm.services.payouts import PAYOUT_FORMATS, PayoutBatchError
 from .models import AdminAction, SystemNotification, SystemStats
+from .stats_rollup import get_daily_stats, get_money_totals
+from .structure_data import build_admin_tree
 import json
 
 
@@ -26,43 +40,7 @@ def is_admin(user):
 
 def _collect_descendant_ids(user):
     """Возвращает список идентификаторов всех потомков пользователя."""
-    descendants = []
-    children = (
-        MLMStructure.objects.filter(parent=user)
-        .select_related("user")
-        .order_by("position", "created_at")
-    )
-    for child in children:
-        child_user = child.user
-        descendants.append(child_user.id)
-        descendants.extend(_collect_descendant_ids(child_user))
-    return descendants
-
-
-def _recalculate_child_levels(root_user, base_level):
-    """Пересчитывает уровни структуры для всех потомков."""
-    children = (
-        MLMStructure.objects.filter(parent=root_user)
-        .select_related("user")
-        .order_by("position", "created_at")
-    )
-    for child in children:
-        child.level = base_level + 1
-        child.save(update_fields=["level"])
-        _recalculate_child_levels(child.user, child.level)
-
-
-def _normalize_positions(parent_user):
-    """Приводит позиции партнеров к последовательному виду."""
-    siblings = (
-        MLMStructure.objects.filter(parent=parent_user)
-        .select_related("user")
-        .order_by("position", "created_at")
-    )
-    for idx, sibling in enumerate(siblings, start=1):
-        if sibling.position != idx:
-            sibling.position = idx
-            sibling.save(update_fields=["position"])
+    return get_descendant_ids(user)
 
 
 @login_required
@@ -70,17 +48,8 @@ def _normalize_positions(parent_user):
 def dashboard(request):
     """Главная страница админ-панели"""
     
-    # Общая статистика
-    stats = {
-        'total_users': User.objects.count(),
-        'active_users': User.objects.filter(is_active_mlm=True).count(),
-        'participants': User.objects.filter(status='participant').count(),
-        'partners': User.objects.filter(status='partner').count(),
-        'total_payments': Payment.objects.filter(status='completed').aggregate(Sum('amount'))['amount__sum'] or 0,
-        'pending_payments': Payment.objects.filter(status='pending').count(),
-        'total_bonuses': Bonus.objects.aggregate(Sum('amount'))['amount__sum'] or 0,
-        'pending_withdrawals': Withdrawal.objects.filter(status='pending').count(),
-    }
+    # Общая статистика (кэшируется, сбрасывается сигналами)
+    stats = get_dashboard_counters()
     
     # Последние действия
     recent_users = User.objects.order_by('-date_joined')[:10]
@@ -128,10 +97,7 @@ def users_list(request):
         users = users.filter(rank=rank)
     
     # Статистика для дашборда
-    total_users = User.objects.count()
-    active_partners = User.objects.filter(status='partner').count()
-    new_users_week = User.objects.filter(date_joined__gte=timezone.now() - timezone.timedelta(days=7)).count()
-    total_balance = User.objects.aggregate(Sum('balance'))['balance__sum'] or 0
+    counters = get_dashboard_counters()
     
     # Пагинация
     paginator = Paginator(users, 25)
@@ -140,10 +106,10 @@ def users_list(request):
     
     context = {
         'users': page_obj,
-        'total_users': total_users,
-        'active_partners': active_partners,
-        'new_users_week': new_users_week,
-        'total_balance': total_balance,
+        'total_users': counters['total_users'],
+        'active_partners': counters['partners'],
+        'new_users_week': counters['new_users_week'],
+        'total_balance': counters['total_balance'],
         'search': search,
         'status': status,
         'rank': rank,
@@ -294,6 +260,9 @@ def user_edit(request, user_id):
     if request.method == 'POST':
         try:
             with transaction.atomic():
+                # Строка блокируется, чтобы корректировка считалась от актуального
+                # баланса, а не от прочитанного до параллельных начислений
+                user = User.objects.select_for_update().get(pk=user.pk)
                 # Обновление основных полей
                 user.username = request.POST.get('username', user.username)
                 user.email = request.POST.get('email', user.email)
@@ -303,10 +272,22 @@ def user_edit(request, user_id):
                 user.telegram_username = request.POST.get('telegram_username', user.telegram_username)
                 user.status = request.POST.get('status', user.status)
                 user.rank = int(request.POST.get('rank', user.rank))
-                user.balance = float(request.POST.get('balance', user.balance))
+                new_balance = Decimal(request.POST.get('balance', user.balance))
                 user.is_verified = request.POST.get('is_verified') == 'on'
                 user.is_active_mlm = request.POST.get('is_active_mlm') == 'on'
-                user.save()
+                user.save(update_fields=[
+                    'username', 'email', 'first_name', 'last_name', 'phone',
+                    'telegram_username', 'status', 'rank', 'is_verified', 'is_active_mlm',
+                ])
+                
+                # Баланс меняется только корректирующей проводкой
+                difference = new_balance - user.balance
+                if difference > 0:
+                    post_credit(user, difference, 'adjustment', earned=False,
+                                description=f'Корректировка администратором {request.user.username}')
+                elif difference < 0:
+                    post_debit(user, -difference, 'adjustment', allow_negative=True,
+                               description=f'Корректировка администратором {request.user.username}')
                 
                 # Логирование действия
                 AdminAction.objects.create(
@@ -365,27 +346,7 @@ def user_move(request, user_id):
             try:
                 with transaction.atomic():
                     old_parent = mlm_structure.parent
-                    
-                    if new_parent:
-                        new_parent_structure = getattr(new_parent, 'mlm_structure', None)
-                        new_level = (new_parent_structure.level + 1) if new_parent_structure else 1
-                        mlm_structure.parent = new_parent
-                        mlm_structure.position = get_next_position(new_parent)
-                    else:
-                        new_level = 0
-                        mlm_structure.parent = None
-                        mlm_structure.position = 0
-                    
-                    mlm_structure.level = new_level
-                    mlm_structure.save(update_fields=['parent', 'position', 'level'])
-                    
-                    if old_parent:
-                        _normalize_positions(old_parent)
-                    
-                    if new_parent:
-                        _normalize_positions(new_parent)
-                    
-                    _recalculate_child_levels(user, mlm_structure.level)
+                    move_subtree(mlm_structure, new_parent)
                     
                     AdminAction.objects.create(
                         admin_user=request.user,
@@ -423,36 +384,12 @@ def structure_view(request):
         root_user = User.objects.first()
     
     # Построение дерева структуры
-    def build_tree(user, max_depth=5, current_depth=0):
-        if current_depth >= max_depth:
-            return None
-        
-        try:
-            mlm_structure = user.mlm_structure
-        except MLMStructure.DoesNotExist:
-            return None
-        
-        children = MLMStructure.objects.filter(parent=user).order_by('position')
-        tree_children = []
-        
-        for child in children:
-            child_tree = build_tree(child.user, max_depth, current_depth + 1)
-            if child_tree:
-                tree_children.append(child_tree)
-        
-        return {
-            'user': user,
-            'mlm_structure': mlm_structure,
-            'children': tree_children,
-            'level': current_depth
-        }
-    
-    structure_tree = build_tree(root_user) if root_user else None
+    structure_tree = build_admin_tree(root_user, max_depth=5)
     
     # Статистика структуры
     total_in_structure = MLMStructure.objects.count()
     active_partners = User.objects.filter(status='partner').count()
-    max_depth = MLMStructure.objects.aggregate(max_level=Count('level'))['max_level'] or 0
+    max_depth = MLMStructure.objects.filter(parent__isnull=True).aggregate(max_depth=Max('max_depth'))['max_depth'] or 0
     avg_level = MLMStructure.objects.aggregate(avg_level=Count('level'))['avg_level'] or 0
     
     context = {
@@ -525,7 +462,11 @@ def approve_payment(request, payment_id):
                 if payment.payment_type == 'registration':
                     payment.user.status = 'partner'
                     payment.user.last_payment_date = timezone.now()
-                    payment.user.save()
+                    # Только эти поля: баланс и счетчики меняются атомарными UPDATE
+                    payment.user.save(update_fields=['status', 'last_payment_date'])
+                    
+                    # Размещение и бонусы выполняются задачей после коммита
+                    enqueue_registration_completed(payment)
                 
                 # Логирование действия
                 AdminAction.objects.create(
@@ -659,8 +600,25 @@ def process_withdrawal(request, withdrawal_id):
     if request.method == 'POST':
         action = request.POST.get('action')
         
+        if action not in ('approve', 'reject'):
+            messages.error(request, 'Неизвестное действие')
+            return redirect('admin_panel:withdrawals_list')
+        
         try:
             with transaction.atomic():
+                # Обрабатываем только ожидающий вывод вне пакета выплат: строка
+                # блокируется, поэтому повторная отправка или пакет не вернут
+                # средства дважды и не отклонят уже выплаченный вывод
+                locked = (
+                    Withdrawal.objects.select_for_update()
+                    .filter(pk=withdrawal.pk, status='pending', payout_batch__isnull=True)
+                    .first()
+                )
+                if locked is None:
+                    messages.error(request, 'Вывод уже обработан или включен в пакет выплат')
+                    return redirect('admin_panel:withdrawals_list')
+                withdrawal = locked
+                
                 if action == 'approve':
                     withdrawal.status = 'completed'
                     withdrawal.processed_at = timezone.now()
@@ -677,8 +635,14 @@ def process_withdrawal(request, withdrawal_id):
                     withdrawal.save()
                     
                     # Возвращаем средства на баланс
-                    withdrawal.user.balance += withdrawal.amount
-                    withdrawal.user.save()
+                    post_credit(
+                        withdrawal.user,
+                        withdrawal.amount,
+                        'withdrawal_refund',
+                        withdrawal=withdrawal,
+                        earned=False,
+                        description=f'Возврат по отклоненному выводу #{withdrawal.id}',
+                    )
                     
                     messages.success(request, 'Вывод средств отклонен')
                 
@@ -699,40 +663,113 @@ def process_withdrawal(request, withdrawal_id):
     return render(request, 'admin_panel/process_withdrawal.html', {'withdrawal': withdrawal})
 
 
+@login_required
+@user_passes_test(is_admin)
+def payout_batch_create(request):
+    """Формирование пакета выплат из ожидающих выводов по фильтру"""
+    
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Метод не поддерживается'}, status=405)
+    
+    filters = {
+        'payment_method': request.POST.get('payment_method', ''),
+        'min_amount': request.POST.get('min_amount') or None,
+        'max_amount': request.POST.get('max_amount') or None,
+        'created_after': request.POST.get('created_after', ''),
+        'created_before': request.POST.get('created_before', ''),
+    }
+    
+    with transaction.atomic():
+        batch = create_payout_batch(filters, created_by=request.user)
+        AdminAction.objects.create(
+            admin_user=request.user,
+            action_type='withdrawal_process',
+            description=f'Сформирован пакет выплат #{batch.id}: {batch.withdrawals_count} на {batch.total_amount}$',
+            details={'payout_batch_id': batch.id, 'action': 'create', 'filters': batch.filters}
+        )
+    
+    return JsonResponse({
+        'batch_id': batch.id,
+        'withdrawals_count': batch.withdrawals_count,
+        'total_amount': str(batch.total_amount),
+    })
+
+
+@login_required
+@user_passes_test(is_admin)
+def payout_batch_process(request, batch_id):
+    """Одобрение или отклонение пакета выплат целиком"""
+    
+    batch = get_object_or_404(PayoutBatch, id=batch_id)
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Метод не поддерживается'}, status=405)
+    
+    action = request.POST.get('action')
+    try:
+        with transaction.atomic():
+            if action == 'approve':
+                processed = approve_payout_batch(batch, processed_by=request.user)
+            elif action == 'reject':
+                processed = reject_payout_batch(
+                    batch,
+                    processed_by=request.user,
+                    admin_notes=request.POST.get('admin_notes', ''),
+                )
+            else:
+                return JsonResponse({'error': 'Неизвестное действие'}, status=400)
+            
+            AdminAction.objects.create(
+                admin_user=request.user,
+                action_type='withdrawal_process',
+                description=f'Обработан пакет выплат #{batch.id}: {processed} выводов',
+                details={'payout_batch_id': batch.id, 'action': action}
+            )
+    except PayoutBatchError as e:
+        return JsonResponse({'error': str(e)}, status=409)
+    
+    return JsonResponse({'batch_id': batch.id, 'action': action, 'processed': processed})
+
+
+@login_required
+@user_passes_test(is_admin)
+def payout_batch_export(request, batch_id):
+    """Потоковая выгрузка файла выплат для платежного провайдера"""
+    
+    batch = get_object_or_404(PayoutBatch, id=batch_id)
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in PAYOUT_FORMATS:
+        return JsonResponse({'error': 'Неизвестный формат'}, status=400)
+    
+    content_type = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    response = StreamingHttpResponse(stream_payout_file(batch, fmt), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="payout_batch_{batch.id}.{fmt}"'
+    return response
+
+
 @login_required
 @user_passes_test(is_admin)
 def statistics(request):
     """Статистика системы"""
     
-    # Общая статистика
+    # Общая статистика: деньги — сводки SystemStats плюс живой хвост с последнего дня сводки
+    status_stats = list(User.objects.values('status').annotate(count=Count('id')))
+    by_status = {row['status']: row['count'] for row in status_stats}
+    totals = get_money_totals()
     stats = {
-        'total_users': User.objects.count(),
-        'active_users': User.objects.filter(is_active_mlm=True).count(),
-        'participants': User.objects.filter(status='participant').count(),
-        'partners': User.objects.filter(status='partner').count(),
-        'total_payments': Payment.objects.filter(status='completed').aggregate(Sum('amount'))['amount__sum'] or 0,
-        'total_bonuses': Bonus.objects.aggregate(Sum('amount'))['amount__sum'] or 0,
-        'total_withdrawals': Withdrawal.objects.filter(status='completed').aggregate(Sum('amount'))['amount__sum'] or 0,
+        'total_users': sum(by_status.values()),
+        'active_users': get_dashboard_counters()['active_users'],
+        'participants': by_status.get('participant', 0),
+        'partners': by_status.get('partner', 0),
+        'total_payments': totals['total_payments'],
+        'total_bonuses': totals['total_bonuses'],
+        'total_withdrawals': totals['total_withdrawals'],
     }
     
     # Статистика по рангам
     rank_stats = User.objects.values('rank').annotate(count=Count('id')).order_by('rank')
     
-    # Статистика по статусам
-    status_stats = User.objects.values('status').annotate(count=Count('id'))
-    
-    # Ежедневная статистика за последние 30 дней
-    daily_stats = []
-    for i in range(30):
-        date = timezone.now().date() - timezone.timedelta(days=i)
-        daily_registrations = User.objects.filter(date_joined__date=date).count()
-        daily_payments = Payment.objects.filter(created_at__date=date, status='completed').aggregate(Sum('amount'))['amount__sum'] or 0
-        
-        daily_stats.append({
-            'date': date,
-            'registrations': daily_registrations,
-            'payments': daily_payments,
-        })
+    # Ежедневная статистика за последние 30 дней (заполняется rollup_system_stats)
+    daily_stats = get_daily_stats(30)
     
     context = {
         'stats': stats,
@@ -803,31 +840,7 @@ def user_structure(request, user_id):
         children = []
     
     # Построение дерева структуры
-    def build_tree(current_user, max_depth=3, current_depth=0):
-        if current_depth >= max_depth:
-            return None
-        
-        try:
-            current_mlm = current_user.mlm_structure
-        except MLMStructure.DoesNotExist:
-            return None
-        
-        children = MLMStructure.objects.filter(parent=current_user).order_by('position')
-        tree_children = []
-        
-        for child in children:
-            child_tree = build_tree(child.user, max_depth, current_depth + 1)
-            if child_tree:
-                tree_children.append(child_tree)
-        
-        return {
-            'user': current_user,
-            'mlm_structure': current_mlm,
-            'children': tree_children,
-            'level': current_depth
-        }
-    
-    structure_tree = build_tree(user)
+    structure_tree = build_admin_tree(user, max_depth=3)
     
     context = {
         'user': user,
@@ -1,3 +1,4 @@
+import logging
 from decimal import Decimal
 
 from rest_framework import viewsets, status
@@ -11,14 +12,16 @@ from rest_framework.authtoken.models import Token
 from django.db import transaction
 from django.db.models import Q, Count, Sum
 from django.utils import timezone
+from django.utils.cache import get_conditional_response
 from users.models import User, UserProfile
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
-from mlm.models import MLMStructure, Payment, Bonus, Withdrawal, MLMSettings, MLMPartner
+from mlm.models import MLMStructure, Payment, Bonus, Withdrawal, MLMPartner
 from django.db.utils import ProgrammingError, OperationalError
 from django.core.management import call_command
-from mlm.services.placement import place_user_in_structure
-from mlm.services.bonuses import calculate_bonuses
+from mlm.services.jobs import enqueue_registration_completed
+from mlm.services.settings_cache import get_active_settings
+from mlm.services.structure_version import get_structure_snapshot
 import traceback
 from .serializers import (
     UserSerializer, UserProfileSerializer, 
@@ -29,6 +32,8 @@ import json
 import uuid
 from django.utils.crypto import get_random_string
 
+logger = logging.getLogger(__name__)
+
 
 class UserViewSet(viewsets.ModelViewSet):
     """API для управления пользователями"""
@@ -111,8 +116,8 @@ class MLMViewSet(viewsets.ViewSet):
         return username, email, password
 
     def _get_registration_amount(self) -> Decimal:
-        settings = MLMSettings.objects.filter(is_active=True).first()
-        if settings and settings.registration_fee:
+        settings = get_active_settings()
+        if settings.registration_fee:
             return settings.registration_fee
         return Decimal("100.00")
 
@@ -139,7 +144,7 @@ class MLMViewSet(viewsets.ViewSet):
         if user.status == 'participant':
             user.status = 'partner'
             user.rank = 0
-            user.save()
+            user.save(update_fields=['status', 'rank'])
             return Response({'status': 'success', 'message': 'Статус обновлен до партнера'})
         return Response({'status': 'error', 'message': 'Нельзя обновить статус'})
     
@@ -390,24 +395,17 @@ class MLMViewSet(viewsets.ViewSet):
             user.last_payment_date = timezone.now()
             user.save(update_fields=['status', 'last_payment_date'])
 
-            placement = None
-            if user.invited_by:
-                try:
-                    placement = place_user_in_structure(user, user.invited_by)
-                except Exception as exc:
-                    # Если пользователь уже размещен, пропускаем
-                    if not MLMStructure.objects.filter(user=user).exists():
-                        raise exc
-
-            try:
-                calculate_bonuses(user, payment)
-            except Exception:
-                pass
+            # Размещение и бонусы выполняются задачей после коммита
+            job = enqueue_registration_completed(payment)
 
+        job.refresh_from_db()
+        placement = MLMStructure.objects.select_related('parent').filter(user=user).first()
         return Response(
             {
                 'success': True,
                 'user_id': user.id,
+                'job_id': job.id,
+                'job_status': job.status,
                 'placement_parent': placement.parent.username if placement and placement.parent else None,
             }
         )
@@ -436,7 +434,26 @@ class MLMViewSet(viewsets.ViewSet):
 
     @action(detail=False, methods=['get'], permission_classes=[AllowAny], url_path='structure')
     def structure(self, request):
-        """API для получения структуры партнеров для админ-панели"""
+        """API для получения структуры партнеров для админ-панели.
+        Ответ кэшируется по версии структуры и отдается с ETag: неизмененное
+        дерево по If-None-Match стоит 304 без обращения к БД."""
+        owner = request.user.pk if request.user and request.user.is_authenticated and request.user.is_superuser else None
+        try:
+            data, etag = get_structure_snapshot(
+                f'api:{owner or "default"}', lambda: self._build_structure_data(request)
+            )
+        except Exception:
+            # Ошибку сборки не кэшируем: пустой ответ без ETag, следующий запрос соберет заново
+            logger.exception("Не удалось собрать структуру для /api/structure/")
+            return Response([])
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = Response(data)
+        response['ETag'] = etag
+        return response
+
+    def _build_structure_data(self, request):
+        """Список узлов структуры для ответа /api/structure/"""
         try:
             # Try new project structure (EquilibriumNew)
             from mlm.models import StructureNode, Tariff
@@ -455,30 +472,27 @@ class MLMViewSet(viewsets.ViewSet):
                     'tariff': node.tariff.name if node.tariff else None,
                     'position': node.position,
                 })
-            return Response(data)
+            return data
         except (ImportError, AttributeError):
-            # Fallback to MLMPartner if StructureNode doesn't exist (current project)
-            try:
-                user = self._get_root_user(request)
-                if user is None:
-                    return Response([], status=status.HTTP_200_OK)
-                
-                partners = MLMPartner.objects.filter(root_user=user, is_active=True)
-                data = []
-                for partner in partners:
-                    data.append({
-                        'id': partner.id,
-                        'uid': partner.unique_id,
-                        'name': partner.human_name,
-                        'level': partner.level,
-                        'parent_id': partner.parent.id if partner.parent else None,
-                        'tariff': None,
-                        'position': {'x': partner.position_x, 'y': partner.position_y},
-                    })
-                return Response(data)
-            except Exception as e:
-                # Return empty list on any error to prevent crashes
-                return Response([], status=status.HTTP_200_OK)
+            # Fallback to MLMPartner if StructureNode doesn't exist (current project).
+            # Errors propagate to structure() so an empty result is never cached.
+            user = self._get_root_user(request)
+            if user is None:
+                return []
+
+            partners = MLMPartner.objects.filter(root_user=user, is_active=True)
+            data = []
+            for partner in partners:
+                data.append({
+                    'id': partner.id,
+                    'uid': partner.unique_id,
+                    'name': partner.human_name,
+                    'level': partner.level,
+                    'parent_id': partner.parent.id if partner.parent else None,
+                    'tariff': None,
+                    'position': {'x': partner.position_x, 'y': partner.position_y},
+                })
+            return data
 
     @action(detail=False, methods=['get'], permission_classes=[AllowAny], url_path='queue')
     def queue(self, request):
@@ -562,7 +576,7 @@ class AdminViewSet(viewsets.ViewSet):
                     user.is_staff = True
                     user.email = email
                     user.set_password(password)
-                    user.save()
+                    user.save(update_fields=['is_superuser', 'is_staff', 'email', 'password'])
                     self._ensure_mlm_structure(user)
                     return Response({
                         'status': 'updated',
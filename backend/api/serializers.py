@@ -2,6 +2,7 @@ from rest_framework import serializers
 
 from core.models import User
 from mlm.models import Tariff, StructureNode
+from mlm.services import get_active_tariff
 from billing.models import Payment, Bonus
 
 
@@ -21,7 +22,7 @@ class RegisterPartnerSerializer(serializers.Serializer):
 
     def validate_tariff_code(self, value: str) -> str:
         try:
-            tariff = Tariff.objects.get(code=value, is_active=True)
+            tariff = get_active_tariff(value)
         except Tariff.DoesNotExist as exc:
             raise serializers.ValidationError("Tariff is not available") from exc
         self.context['tariff'] = tariff
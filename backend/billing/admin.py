@@ -1,6 +1,7 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 
 from billing.models import Payment, Bonus
+from billing.services import complete_registrations
 
 
 @admin.register(Payment)
@@ -8,6 +9,15 @@ class PaymentAdmin(admin.ModelAdmin):
     list_display = ("id", "user", "tariff", "amount", "status", "created_at", "completed_at")
     list_filter = ("status", "tariff")
     search_fields = ("user__username", "external_id")
+    actions = ("approve_registrations",)
+
+    @admin.action(description="Complete selected pending registrations")
+    def approve_registrations(self, request, queryset):
+        payments = queryset.filter(status=Payment.Status.PENDING).select_related("user__invited_by", "tariff").order_by("created_at")
+        batch = complete_registrations(payments)
+        self.message_user(request, f"Completed {len(batch.placements)} registrations", messages.SUCCESS)
+        for payment, reason in batch.skipped:
+            self.message_user(request, f"Skipped payment {payment.pk} of {payment.user}: {reason}", messages.WARNING)
 
 
 @admin.register(Bonus)
@@ -0,0 +1,39 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from billing.replay import REPLAY_CHUNK_SIZE, replay_signup_bonuses
+
+
+class Command(BaseCommand):
+    help = 'Replay signup bonus rules over completed payments and report differences'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=REPLAY_CHUNK_SIZE,
+                            help='Payments per comparison chunk and cursor fetch')
+        parser.add_argument('--jsonl', action='store_true',
+                            help='Print every difference as a JSON line')
+        parser.add_argument('--show', type=int, default=20,
+                            help='How many differences to print without --jsonl')
+
+    def handle(self, *args, **options):
+        totals = {}
+        shown = 0
+        for diff in replay_signup_bonuses(chunk_size=options['chunk_size']):
+            totals[diff.kind] = totals.get(diff.kind, 0) + 1
+            if options['jsonl']:
+                self.stdout.write(json.dumps(diff.as_dict(), default=str))
+            elif shown < options['show']:
+                shown += 1
+                self.stdout.write(
+                    f"  {diff.kind}: user {diff.user_id}, payment {diff.payment_id}, "
+                    f"{diff.bonus_type or '-'}, expected {diff.expected}, actual {diff.actual}"
+                )
+
+        if options['jsonl']:
+            return
+        if not totals:
+            self.stdout.write(self.style.SUCCESS('Stored bonuses match the replayed rules'))
+            return
+        for kind, count in sorted(totals.items()):
+            self.stdout.write(self.style.WARNING(f'{kind}: {count}'))
@@ -0,0 +1,123 @@
+"""
+Replay of the signup bonus rules over the payment history.
+
+Completed payments are streamed in completed_at order through iterator(), so
+Postgres serves them from a server-side cursor. Stored bonuses are compared
+chunk by chunk; only per-parent child counts are kept for the whole run.
+"""
+
+from collections import Counter
+from dataclasses import asdict, dataclass
+from decimal import Decimal
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from django.db.models import Q
+from django.db.models.functions import Coalesce
+
+from billing.models import Bonus, Payment
+from billing.services import calculate_bonus_amounts
+from mlm.models import Tariff
+
+REPLAY_CHUNK_SIZE = 2000
+MAX_PARTNERS = 3
+
+# (payment, recipient, bonus type, amount)
+BonusKey = Tuple[int, int, str, Decimal]
+
+
+@dataclass
+class ReplayDiff:
+    """A missing or extra bonus, or a placement parent holding too many partners."""
+
+    kind: str
+    user_id: int
+    payment_id: Optional[int] = None
+    bonus_type: str = ""
+    expected: Optional[Decimal] = None
+    actual: Optional[Decimal] = None
+
+    def as_dict(self) -> Dict:
+        return asdict(self)
+
+
+def _expected_bonuses(payment_id, inviter_id, parent_id, tariff) -> Iterator[BonusKey]:
+    """Same rules as apply_signup_bonuses."""
+    green_amount, yellow_amount = calculate_bonus_amounts(tariff)
+    if inviter_id and green_amount > 0:
+        yield payment_id, inviter_id, Bonus.Type.GREEN.value, green_amount
+    if parent_id and yellow_amount > 0:
+        yield payment_id, parent_id, Bonus.Type.YELLOW.value, yellow_amount
+
+
+def _diff_chunk(expected: List[BonusKey], payment_ids: List[int]) -> Iterator[ReplayDiff]:
+    actual = Counter(
+        Bonus.objects.filter(payment_id__in=payment_ids)
+        .order_by()
+        .values_list('payment_id', 'user_id', 'bonus_type', 'amount')
+    )
+    wanted = Counter(expected)
+    for (payment_id, user_id, bonus_type, amount), count in (wanted - actual).items():
+        for _ in range(count):
+            yield ReplayDiff('missing', user_id, payment_id, bonus_type, expected=amount)
+    for (payment_id, user_id, bonus_type, amount), count in (actual - wanted).items():
+        for _ in range(count):
+            yield ReplayDiff('extra', user_id, payment_id, bonus_type, actual=amount)
+
+
+def replay_signup_bonuses(chunk_size: int = REPLAY_CHUNK_SIZE) -> Iterator[ReplayDiff]:
+    """
+    Yield every difference between stored bonuses and the replayed rules.
+    Placement parents come from the stored structure; the replay only checks
+    that no parent received more than MAX_PARTNERS partners along the way.
+    Amounts use the current tariff percentages.
+    """
+    tariffs = {tariff.pk: tariff for tariff in Tariff.objects.all()}
+    payments = (
+        Payment.objects.filter(status=Payment.Status.COMPLETED, user__structure_node__isnull=False)
+        .order_by(Coalesce('completed_at', 'created_at'), 'id')
+        .values_list(
+            'id',
+            'user_id',
+            'user__invited_by_id',
+            'user__structure_node__parent_id',
+            'user__structure_node__tariff_id',
+            'tariff_id',
+        )
+    )
+
+    placed = set()
+    child_counts: Dict[int, int] = {}
+    expected: List[BonusKey] = []
+    payment_ids: List[int] = []
+
+    rows = payments.iterator(chunk_size=chunk_size)
+    for payment_id, user_id, inviter_id, parent_id, node_tariff_id, tariff_id in rows:
+        payment_ids.append(payment_id)
+        if parent_id and user_id not in placed:
+            placed.add(user_id)
+            child_counts[parent_id] = child_counts.get(parent_id, 0) + 1
+            if child_counts[parent_id] > MAX_PARTNERS:
+                yield ReplayDiff(
+                    'placement', parent_id, payment_id,
+                    expected=Decimal(MAX_PARTNERS), actual=Decimal(child_counts[parent_id]),
+                )
+        tariff = tariffs[node_tariff_id or tariff_id]
+        expected.extend(_expected_bonuses(payment_id, inviter_id, parent_id, tariff))
+
+        if len(payment_ids) >= chunk_size:
+            yield from _diff_chunk(expected, payment_ids)
+            expected, payment_ids = [], []
+
+    if payment_ids:
+        yield from _diff_chunk(expected, payment_ids)
+
+    # Bonuses are only paid for completed payments of placed users.
+    orphans = (
+        Bonus.objects.filter(
+            ~Q(payment__status=Payment.Status.COMPLETED) | Q(payment__user__structure_node__isnull=True)
+        )
+        .order_by('id')
+        .values_list('payment_id', 'user_id', 'bonus_type', 'amount')
+    )
+    for payment_id, user_id, bonus_type, amount in orphans.iterator(chunk_size=chunk_size):
+        yield ReplayDiff('extra', user_id, payment_id, bonus_type, actual=amount)
@@ -1,43 +1,126 @@
+from dataclasses import dataclass, field
 from decimal import Decimal
-from typing import Tuple
+from functools import lru_cache
+from typing import Iterable, List, Tuple
 
 from django.db import transaction
 
 from core.models import User
 from billing.models import Payment, Bonus
 from mlm.models import StructureNode, Tariff
+from mlm.services import place_user
 
 
-def calculate_bonus_amounts(tariff: Tariff) -> Tuple[Decimal, Decimal]:
-    green = tariff.entry_amount * (Decimal(tariff.green_bonus_percent) / Decimal(100))
-    yellow = tariff.entry_amount * (Decimal(tariff.yellow_bonus_percent) / Decimal(100))
+@lru_cache(maxsize=256)
+def _bonus_amounts(entry_amount: Decimal, green_percent: Decimal, yellow_percent: Decimal) -> Tuple[Decimal, Decimal]:
+    green = entry_amount * (Decimal(green_percent) / Decimal(100))
+    yellow = entry_amount * (Decimal(yellow_percent) / Decimal(100))
     return green.quantize(Decimal('0.01')), yellow.quantize(Decimal('0.01'))
 
 
+def calculate_bonus_amounts(tariff: Tariff) -> Tuple[Decimal, Decimal]:
+    """Green and yellow amounts for a tariff, cached by its amount and percentages."""
+    return _bonus_amounts(
+        Decimal(tariff.entry_amount),
+        Decimal(tariff.green_bonus_percent),
+        Decimal(tariff.yellow_bonus_percent),
+    )
+
+
+@transaction.atomic
+def apply_signup_bonuses_bulk(pairs: Iterable[Tuple[Payment, StructureNode]]) -> List[Bonus]:
+    """
+    Create green (inviter) and yellow (placement parent) bonuses for many
+    (payment, placement) pairs. Inviters and tariffs are read with one query
+    each, amounts are computed once per tariff and every bonus is written by
+    a single bulk_create.
+    """
+    pairs = list(pairs)
+    if not pairs:
+        return []
+
+    users = {
+        user_id: (inviter_id, username)
+        for user_id, inviter_id, username in User.objects.filter(
+            pk__in={payment.user_id for payment, _ in pairs}
+        ).values_list('id', 'invited_by_id', 'username')
+    }
+    tariff_ids = {placement.tariff_id or payment.tariff_id for payment, placement in pairs}
+    amounts = {tariff.pk: calculate_bonus_amounts(tariff) for tariff in Tariff.objects.filter(pk__in=tariff_ids)}
+
+    bonuses = []
+    for payment, placement in pairs:
+        inviter_id, username = users[payment.user_id]
+        green_amount, yellow_amount = amounts[placement.tariff_id or payment.tariff_id]
+        if inviter_id and green_amount > 0:
+            bonuses.append(Bonus(
+                user_id=inviter_id,
+                source_user_id=payment.user_id,
+                payment=payment,
+                bonus_type=Bonus.Type.GREEN,
+                amount=green_amount,
+                description=f"Invite bonus from {username}",
+            ))
+        if placement.parent_id and yellow_amount > 0:
+            bonuses.append(Bonus(
+                user_id=placement.parent_id,
+                source_user_id=payment.user_id,
+                payment=payment,
+                bonus_type=Bonus.Type.YELLOW,
+                amount=yellow_amount,
+                description=f"Transition bonus from {username}",
+            ))
+    return Bonus.objects.bulk_create(bonuses, batch_size=1000)
+
+
+def apply_signup_bonuses(payment: Payment, placement: StructureNode) -> List[Bonus]:
+    return apply_signup_bonuses_bulk([(payment, placement)])
+
+
+@dataclass
+class RegistrationBatch:
+    placements: List[StructureNode] = field(default_factory=list)
+    # (payment, reason) pairs left pending
+    skipped: List[Tuple[Payment, str]] = field(default_factory=list)
+
+
 @transaction.atomic
-def apply_signup_bonuses(payment: Payment, placement: StructureNode) -> None:
-    user = payment.user
-    inviter = user.invited_by
-    tariff = placement.tariff or payment.tariff
-    green_amount, yellow_amount = calculate_bonus_amounts(tariff)
-
-    if inviter and green_amount > 0:
-        Bonus.objects.create(
-            user=inviter,
-            source_user=user,
-            payment=payment,
-            bonus_type=Bonus.Type.GREEN,
-            amount=green_amount,
-            description=f"Invite bonus from {user.username}",
-        )
-
-    parent_owner = placement.parent
-    if parent_owner and yellow_amount > 0:
-        Bonus.objects.create(
-            user=parent_owner,
-            source_user=user,
-            payment=payment,
-            bonus_type=Bonus.Type.YELLOW,
-            amount=yellow_amount,
-            description=f"Transition bonus from {user.username}",
-        )
+def complete_registrations(payments: Iterable[Payment]) -> RegistrationBatch:
+    """
+    Approve pending payments in one transaction: mark them completed, turn
+    their users into partners, place them and apply all signup bonuses at once.
+    The payments are re-read under a row lock, so a concurrent approval cannot
+    complete them twice. Each user is registered by one payment only; payments
+    of users without an inviter, users already placed in the structure and
+    further payments of the same user are left pending and reported as skipped.
+    """
+    locked = list(
+        Payment.objects.select_for_update(of=('self',))
+        .filter(pk__in=[payment.pk for payment in payments], status=Payment.Status.PENDING)
+        .select_related('user__invited_by', 'tariff')
+        .order_by('created_at', 'id')
+    )
+    placed_user_ids = set(
+        StructureNode.objects.filter(user_id__in={payment.user_id for payment in locked})
+        .values_list('user_id', flat=True)
+    )
+
+    batch = RegistrationBatch()
+    pairs = []
+    for payment in locked:
+        user = payment.user
+        if not user.invited_by_id:
+            batch.skipped.append((payment, 'user has no inviter'))
+            continue
+        if user.pk in placed_user_ids:
+            batch.skipped.append((payment, 'user is already placed'))
+            continue
+        placed_user_ids.add(user.pk)
+        payment.mark_completed()
+        user.status = User.Status.PARTNER
+        user.save(update_fields=['status'])
+        placement = place_user(inviter=user.invited_by, new_user=user, tariff=payment.tariff)
+        pairs.append((payment, placement))
+    apply_signup_bonuses_bulk(pairs)
+    batch.placements = [placement for _, placement in pairs]
+    return batch
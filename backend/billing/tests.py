@@ -1,3 +1,75 @@
 from django.test import TestCase
 
-# Create your tests here.
+from billing.models import Bonus, Payment
+from billing.replay import replay_signup_bonuses
+from billing.services import apply_signup_bonuses, apply_signup_bonuses_bulk, complete_registrations
+from core.models import User
+from mlm.models import StructureNode, Tariff
+from mlm.services import place_user
+
+
+class SignupBonusReplayTests(TestCase):
+    def setUp(self):
+        self.tariff = Tariff.objects.create(code='replay', name='Replay', entry_amount=100)
+        self.root = User.objects.create(username='root', referral_code='ROOT0000')
+        StructureNode.objects.create(user=self.root, parent=None, position=1, level=0, tariff=self.tariff)
+        for index in range(5):
+            user = User.objects.create(username=f'member_{index}', referral_code=f'M{index:07d}', invited_by=self.root)
+            payment = Payment.objects.create(user=user, tariff=self.tariff, amount=100)
+            payment.mark_completed()
+            apply_signup_bonuses(payment, place_user(inviter=self.root, new_user=user, tariff=self.tariff))
+
+    def test_replay_matches_stored_bonuses(self):
+        self.assertEqual(list(replay_signup_bonuses(chunk_size=2)), [])
+
+    def test_replay_reports_missing_and_extra(self):
+        bonus = Bonus.objects.filter(bonus_type=Bonus.Type.YELLOW).order_by('id').last()
+        bonus.amount += 1
+        bonus.save(update_fields=['amount'])
+
+        self.assertEqual(
+            sorted(diff.kind for diff in replay_signup_bonuses(chunk_size=2)),
+            ['extra', 'missing'],
+        )
+
+
+class BulkSignupBonusTests(TestCase):
+    def setUp(self):
+        self.tariff = Tariff.objects.create(code='bulk', name='Bulk', entry_amount=100, green_bonus_percent=40)
+        self.root = User.objects.create(username='root', referral_code='ROOT0000')
+        StructureNode.objects.create(user=self.root, parent=None, position=1, level=0, tariff=self.tariff)
+        self.payments = [
+            Payment.objects.create(
+                user=User.objects.create(username=f'bulk_{index}', referral_code=f'B{index:07d}', invited_by=self.root),
+                tariff=self.tariff,
+                amount=100,
+            )
+            for index in range(5)
+        ]
+
+    def test_batch_approval_writes_bonuses_in_bulk(self):
+        placements = complete_registrations(self.payments).placements
+
+        self.assertEqual(len(placements), 5)
+        self.assertEqual(Bonus.objects.filter(bonus_type=Bonus.Type.GREEN, amount=40).count(), 5)
+        self.assertEqual(Bonus.objects.filter(bonus_type=Bonus.Type.YELLOW, amount=50).count(), 5)
+        self.assertEqual(list(replay_signup_bonuses()), [])
+
+        # Savepoint pair, inviters, tariffs and one INSERT, regardless of the batch size
+        with self.assertNumQueries(5):
+            apply_signup_bonuses_bulk(zip(self.payments, placements))
+
+    def test_placed_users_and_repeat_payments_are_skipped(self):
+        placed = self.payments[0].user
+        place_user(inviter=self.root, new_user=placed, tariff=self.tariff)
+        repeat = Payment.objects.create(user=self.payments[1].user, tariff=self.tariff, amount=100)
+
+        batch = complete_registrations([*self.payments, repeat])
+
+        self.assertEqual(len(batch.placements), 4)
+        self.assertEqual(
+            sorted((payment.pk, reason) for payment, reason in batch.skipped),
+            [(self.payments[0].pk, 'user is already placed'), (repeat.pk, 'user is already placed')],
+        )
+        self.assertEqual(Payment.objects.filter(status=Payment.Status.PENDING).count(), 2)
+        self.assertEqual(StructureNode.objects.count(), 6)
@@ -0,0 +1,55 @@
+"""
+Admin dashboard counters.
+
+Every KPI comes from one conditional-aggregate query per table. The result is
+cached for a short TTL and dropped by model signals (see core.signals), so the
+dashboard's auto-refresh hits the cache instead of the database.
+"""
+
+from decimal import Decimal
+from typing import Dict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, DecimalField, Q, Sum, Value
+from django.db.models.functions import Coalesce
+
+from billing.models import Bonus, Payment
+from core.models import User
+from mlm.models import StructureNode
+
+DASHBOARD_CACHE_KEY = 'core:dashboard:counters'
+DEFAULT_DASHBOARD_TTL = 30
+
+
+def compute_dashboard_counters() -> Dict:
+    counters = User.objects.aggregate(
+        total_users=Count('id'),
+        partners=Count('id', filter=Q(status=User.Status.PARTNER)),
+        participants=Count('id', filter=Q(status=User.Status.PARTICIPANT)),
+    )
+    counters['total_nodes'] = StructureNode.objects.count()
+    counters.update(Payment.objects.aggregate(
+        pending_payments=Count('id', filter=Q(status=Payment.Status.PENDING)),
+    ))
+    counters.update(Bonus.objects.aggregate(
+        total_bonuses=Coalesce(
+            Sum('amount'), Value(Decimal('0.00')), output_field=DecimalField(max_digits=14, decimal_places=2)
+        ),
+    ))
+    return counters
+
+
+def get_dashboard_counters() -> Dict:
+    counters = cache.get(DASHBOARD_CACHE_KEY)
+    if counters is None:
+        counters = compute_dashboard_counters()
+        cache.set(DASHBOARD_CACHE_KEY, counters, getattr(settings, 'DASHBOARD_COUNTERS_TTL', DEFAULT_DASHBOARD_TTL))
+    return counters
+
+
+def invalidate_dashboard_counters() -> None:
+    """Drop the cached counters now and again after commit."""
+    cache.delete(DASHBOARD_CACHE_KEY)
+    transaction.on_commit(lambda: cache.delete(DASHBOARD_CACHE_KEY))
@@ -0,0 +1,20 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from billing.models import Bonus, Payment
+from core.dashboard import invalidate_dashboard_counters
+from core.models import User
+from mlm.models import StructureNode
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+@receiver(post_save, sender=StructureNode)
+@receiver(post_delete, sender=StructureNode)
+@receiver(post_save, sender=Payment)
+@receiver(post_delete, sender=Payment)
+@receiver(post_save, sender=Bonus)
+@receiver(post_delete, sender=Bonus)
+def reset_dashboard_counters(sender, raw=False, **kwargs):
+    if not raw:
+        invalidate_dashboard_counters()
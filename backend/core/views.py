@@ -5,6 +5,7 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 
+from core.dashboard import get_dashboard_counters
 from core.models import User
 try:
     from mlm.models import StructureNode, Tariff
@@ -19,14 +20,7 @@ except ImportError:
 @require_http_methods(["GET"])
 def admin_dashboard(request):
     """Главная страница админ-панели"""
-    stats = {
-        'total_users': User.objects.count(),
-        'partners': User.objects.filter(status=User.Status.PARTNER).count(),
-        'participants': User.objects.filter(status=User.Status.PARTICIPANT).count(),
-        'total_nodes': StructureNode.objects.count() if StructureNode else 0,
-        'pending_payments': Payment.objects.filter(status=Payment.Status.PENDING).count() if Payment else 0,
-        'total_bonuses': sum(b.amount for b in Bonus.objects.all()) if Bonus else 0,
-    }
+    stats = get_dashboard_counters()
     return render(request, 'admin/dashboard.html', {'stats': stats})
 
 
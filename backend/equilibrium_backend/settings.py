@@ -206,3 +206,18 @@ REST_FRAMEWORK = {
 
 TELEGRAM_BOT_TOKEN = env("TELEGRAM_BOT_TOKEN", default="")
 TELEGRAM_WEBAPP_URL = env("TELEGRAM_WEBAPP_URL", default="")
+
+# Placement strategy: first_fit, least_filled or leftmost_deepest
+MLM_PLACEMENT_STRATEGY = env("MLM_PLACEMENT_STRATEGY", default="first_fit")
+
+# Cache versions (tariffs) must be shared by every gunicorn and Celery worker,
+# so production uses Redis. LocMem is process-local and only suits development;
+# check mlm.W001 warns about it when DEBUG is off.
+REDIS_URL = env("REDIS_URL", default="")
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        }
+    }
@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.checks import Warning, register
+
+# Cache backends whose contents are visible to the current process only
+PROCESS_LOCAL_CACHES = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+
+@register()
+def check_shared_cache(app_configs, **kwargs):
+    """The tariff cache version lives in the default cache; a process-local one hides bumps from other workers."""
+    backend = settings.CACHES.get("default", {}).get("BACKEND", "")
+    if settings.DEBUG or backend not in PROCESS_LOCAL_CACHES:
+        return []
+    return [
+        Warning(
+            "The default cache is process-local: tariff changes will not reach other workers.",
+            hint="Set REDIS_URL to use a shared Redis cache.",
+            id="mlm.W001",
+        )
+    ]
@@ -1,19 +1,73 @@
-from collections import deque
+import random
+import time
 from decimal import Decimal
 from typing import Optional
 
 from django.conf import settings
-from django.db import transaction
+from django.core.cache import cache
+from django.db import IntegrityError, OperationalError, transaction
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
 
 from core.models import User
+from mlm.engine import FirstFitStrategy, PlacementStrategy, TreeSnapshot, get_strategy
 from mlm.models import StructureNode, Tariff
 
+PLACEMENT_ATTEMPTS = 5
+PLACEMENT_RETRY_DELAY = 0.05
+TARIFFS_VERSION_KEY = 'mlm:tariffs:version'
+
+_tariffs_cache: tuple[int, list[Tariff]] | None = None
+
+
+class PlacementConflict(Exception):
+    """The chosen parent was filled by a concurrent placement."""
+
+
+def get_tariffs_version() -> int:
+    # Seeded from the clock so an evicted key never comes back as an old version.
+    version = cache.get(TARIFFS_VERSION_KEY)
+    if version is None:
+        cache.add(TARIFFS_VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(TARIFFS_VERSION_KEY)
+    return version
+
+
+def bump_tariffs_version() -> None:
+    global _tariffs_cache
+    _tariffs_cache = None
+    try:
+        cache.incr(TARIFFS_VERSION_KEY)
+    except ValueError:
+        cache.add(TARIFFS_VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def invalidate_tariff_cache() -> None:
+    """Drop cached tariffs now and again on commit, so other workers never cache uncommitted rows."""
+    bump_tariffs_version()
+    transaction.on_commit(bump_tariffs_version)
+
+
+def _get_active_tariffs() -> list[Tariff]:
+    global _tariffs_cache
+    version = get_tariffs_version()
+    cached = _tariffs_cache
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    tariffs = list(Tariff.objects.filter(is_active=True).order_by('entry_amount'))
+    _tariffs_cache = (version, tariffs)
+    return tariffs
+
 
 def get_active_tariff(code: str | None = None) -> Tariff:
-    qs = Tariff.objects.filter(is_active=True).order_by('entry_amount')
+    """Return an active tariff from the process-local cache, reloading it when the shared version changes."""
+    tariffs = _get_active_tariffs()
     if code:
-        return qs.get(code=code)
-    return qs.first()
+        for tariff in tariffs:
+            if tariff.code == code:
+                return tariff
+        raise Tariff.DoesNotExist(f"Active tariff {code!r} does not exist")
+    return tariffs[0] if tariffs else None
 
 
 def get_next_position(parent: User, max_partners: int = 3) -> int:
@@ -27,42 +81,78 @@ def get_next_position(parent: User, max_partners: int = 3) -> int:
     return max_partners
 
 
-def find_parent_for_new_partner(inviter: User, max_partners: int = 3) -> User:
-    queue = deque([inviter])
-    visited: set[int] = set()
-    while queue:
-        candidate = queue.popleft()
-        if candidate.id in visited:
-            continue
-        visited.add(candidate.id)
-
-        children_count = StructureNode.objects.filter(parent=candidate).count()
-        if children_count < max_partners:
-            return candidate
-
-        descendants = (
-            StructureNode.objects.filter(parent=candidate)
-            .select_related('user')
-            .order_by('created_at')
+def get_placement_strategy() -> PlacementStrategy:
+    return get_strategy(getattr(settings, 'MLM_PLACEMENT_STRATEGY', FirstFitStrategy.name))
+
+
+def subtree_user_ids(root: User) -> RawSQL:
+    """Recursive CTE selecting the user ids below root; UNION stops on corrupted cycles."""
+    table = StructureNode._meta.db_table
+    return RawSQL(
+        f"""
+        WITH RECURSIVE subtree(user_id) AS (
+            SELECT user_id FROM {table} WHERE parent_id = %s
+            UNION
+            SELECT node.user_id FROM {table} node JOIN subtree ON node.parent_id = subtree.user_id
         )
-        for node in descendants:
-            queue.append(node.user)
-    return inviter
+        SELECT user_id FROM subtree
+        """,
+        (root.pk,),
+    )
+
+
+def load_tree_snapshot(root: User) -> TreeSnapshot:
+    """Load the subtree under root in one query and snapshot it."""
+    rows = (
+        StructureNode.objects.filter(Q(user_id=root.pk) | Q(user_id__in=subtree_user_ids(root)))
+        .order_by('created_at')
+        .values_list('user_id', 'parent_id', 'created_at')
+    )
+    return TreeSnapshot.build(root.pk, rows.iterator(chunk_size=5000))
+
+
+def find_parent_for_new_partner(inviter: User, max_partners: int = 3) -> User:
+    parent_id = get_placement_strategy().select_parent_id(load_tree_snapshot(inviter), max_partners)
+    if parent_id is None or parent_id == inviter.pk:
+        return inviter
+    return User.objects.get(pk=parent_id)
+
+
+def _lock_parent(parent: User) -> StructureNode | None:
+    node = StructureNode.objects.select_for_update().filter(user=parent).first()
+    if node is None:
+        # Parent has no node yet: serialize on the user row instead.
+        User.objects.select_for_update().filter(pk=parent.pk).exists()
+    return node
+
+
+def _place_locked(inviter: User, new_user: User, tariff: Tariff, max_partners: int) -> StructureNode:
+    parent_user = find_parent_for_new_partner(inviter, max_partners=max_partners)
+    parent_node = _lock_parent(parent_user)
+    if StructureNode.objects.filter(parent=parent_user).exclude(user=new_user).count() >= max_partners:
+        # A concurrent placement filled the parent while we waited for the lock.
+        raise PlacementConflict(f"Parent {parent_user.pk} is already full")
+    level = (parent_node.level + 1) if parent_node else 0
+    position = get_next_position(parent_user, max_partners)
+    node, _ = StructureNode.objects.update_or_create(
+        user=new_user,
+        defaults={
+            'parent': parent_user,
+            'position': position,
+            'level': level,
+            'tariff': tariff,
+        }
+    )
+    return node
 
 
 def place_user(inviter: User, new_user: User, tariff: Tariff, max_partners: int = 3) -> StructureNode:
-    with transaction.atomic():
-        parent_user = find_parent_for_new_partner(inviter, max_partners=max_partners)
-        parent_node = StructureNode.objects.filter(user=parent_user).first()
-        level = (parent_node.level + 1) if parent_node else 0
-        position = get_next_position(parent_user, max_partners)
-        node, _ = StructureNode.objects.update_or_create(
-            user=new_user,
-            defaults={
-                'parent': parent_user,
-                'position': position,
-                'level': level,
-                'tariff': tariff,
-            }
-        )
-        return node
+    """Place a user under the inviter's spillover parent, retrying on concurrent conflicts."""
+    for attempt in range(1, PLACEMENT_ATTEMPTS + 1):
+        try:
+            with transaction.atomic():
+                return _place_locked(inviter, new_user, tariff, max_partners)
+        except (PlacementConflict, IntegrityError, OperationalError):
+            if attempt == PLACEMENT_ATTEMPTS:
+                raise
+            time.sleep(random.uniform(0, PLACEMENT_RETRY_DELAY * attempt))
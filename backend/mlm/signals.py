@@ -0,0 +1,11 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from mlm.models import Tariff
+from mlm.services import invalidate_tariff_cache
+
+
+@receiver(post_save, sender=Tariff)
+@receiver(post_delete, sender=Tariff)
+def reset_tariff_cache(sender, **kwargs):
+    invalidate_tariff_cache()
@@ -1,3 +1,99 @@
-from django.test import TestCase
+from concurrent.futures import ThreadPoolExecutor
+from unittest import skipIf
 
-# Create your tests here.
+from django.db import connection
+from django.db.models import Count
+from django.test import TestCase, TransactionTestCase
+
+from core.models import User
+from mlm.models import StructureNode, Tariff
+from mlm.services import get_active_tariff, load_tree_snapshot, place_user
+
+
+def _sqlite_without_write_locks() -> bool:
+    # Deferred SQLite transactions deadlock concurrent writers instead of waiting,
+    # so SQLite only stands in for Postgres with transaction_mode=IMMEDIATE.
+    return (
+        connection.vendor == 'sqlite'
+        and connection.settings_dict.get('OPTIONS', {}).get('transaction_mode') != 'IMMEDIATE'
+    )
+
+
+@skipIf(_sqlite_without_write_locks(), 'SQLite needs transaction_mode=IMMEDIATE for concurrent writers')
+class ConcurrentPlacementTests(TransactionTestCase):
+    USERS_COUNT = 1000
+    THREADS = 8
+
+    def setUp(self):
+        self.tariff = Tariff.objects.create(code='stress', name='Stress', entry_amount=100)
+        self.root = User.objects.create(username='root', referral_code='ROOT0000')
+        StructureNode.objects.create(user=self.root, parent=None, position=1, level=0, tariff=self.tariff)
+        User.objects.bulk_create(
+            User(username=f'stress_{index}', referral_code=f'S{index:07d}', invited_by=self.root)
+            for index in range(self.USERS_COUNT)
+        )
+
+    def _place_chunk(self, user_ids):
+        try:
+            for user in User.objects.filter(id__in=user_ids).order_by('id'):
+                place_user(inviter=self.root, new_user=user, tariff=self.tariff)
+        finally:
+            connection.close()
+
+    def test_parallel_placement_keeps_positions_unique(self):
+        user_ids = list(
+            User.objects.filter(invited_by=self.root).order_by('id').values_list('id', flat=True)
+        )
+        chunks = [user_ids[index::self.THREADS] for index in range(self.THREADS)]
+        with ThreadPoolExecutor(max_workers=self.THREADS) as pool:
+            list(pool.map(self._place_chunk, chunks))
+
+        self.assertEqual(StructureNode.objects.count(), self.USERS_COUNT + 1)
+        self.assertFalse(
+            StructureNode.objects.exclude(parent=None)
+            .values('parent')
+            .annotate(total=Count('id'))
+            .filter(total__gt=3)
+            .exists()
+        )
+
+
+class TreeSnapshotTests(TestCase):
+    def test_snapshot_reads_only_the_inviter_subtree(self):
+        users = {
+            name: User.objects.create(username=name, referral_code=name.upper())
+            for name in ('root', 'a', 'b', 'a1', 'other', 'other1')
+        }
+        for name, parent, position in (
+            ('root', None, 1), ('a', 'root', 1), ('b', 'root', 2), ('a1', 'a', 1),
+            ('other', None, 1), ('other1', 'other', 1),
+        ):
+            StructureNode.objects.create(
+                user=users[name], parent=users[parent] if parent else None, position=position
+            )
+
+        with self.assertNumQueries(1):
+            snapshot = load_tree_snapshot(users['a'])
+        self.assertEqual(list(snapshot.user_ids), [users['a'].pk, users['a1'].pk])
+
+        snapshot = load_tree_snapshot(users['root'])
+        self.assertEqual(
+            sorted(snapshot.user_ids), sorted(users[name].pk for name in ('root', 'a', 'b', 'a1'))
+        )
+        self.assertEqual(list(snapshot.child_counts[:1]), [2])
+
+
+class ActiveTariffCacheTests(TestCase):
+    def setUp(self):
+        self.tariff = Tariff.objects.create(code='cache-test', name='Cache test', entry_amount=100)
+
+    def test_cached_until_tariff_is_saved(self):
+        self.assertEqual(get_active_tariff('cache-test'), self.tariff)
+        with self.assertNumQueries(0):
+            get_active_tariff()
+            get_active_tariff('cache-test')
+
+        self.tariff.is_active = False
+        self.tariff.save()
+        with self.assertRaises(Tariff.DoesNotExist):
+            get_active_tariff('cache-test')
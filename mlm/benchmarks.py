@@ -0,0 +1,179 @@
+"""
+Замеры горячих путей MLM на синтетических троичных деревьях.
+Всё, что создается во время замера, откатывается вместе с транзакцией.
+"""
+
+import time
+import tracemalloc
+import uuid
+from dataclasses import dataclass
+from datetime import timedelta
+from decimal import Decimal
+from typing import Callable, List
+
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from mlm.models import MLMStructure, Payment
+from mlm.services import (
+    calculate_bonuses,
+    calculate_bonuses_batch,
+    find_placement_parent,
+    get_structure_statistics,
+    place_user_in_structure,
+    sync_open_slots,
+    verify_counters,
+)
+from users.models import User
+
+DEFAULT_SIZES = (1_000, 10_000, 100_000, 1_000_000)
+BONUS_BATCH_SIZE = 100
+
+
+@dataclass
+class BenchmarkResult:
+    operation: str
+    nodes: int
+    wall_time: float
+    queries: int
+    peak_memory_kb: float
+
+
+def generate_trinary_tree(size: int, max_partners: int = 3, batch_size: int = 5000) -> User:
+    """
+    Создает полное дерево из size узлов (включая корень) и возвращает корень.
+    """
+    run_id = uuid.uuid4().hex[:6]
+    started_at = timezone.now()
+    paths: List[str] = []
+    levels: List[int] = []
+    user_ids: List[int] = []
+
+    for batch_start in range(0, size, batch_size):
+        batch_end = min(batch_start + batch_size, size)
+        users = User.objects.bulk_create(
+            User(
+                username=f"bench_{run_id}_{index}",
+                email=f"bench_{run_id}_{index}@example.com",
+                password="!",
+                referral_code=f"B{run_id[:2]}{index:07d}",
+                status="partner" if index % 2 else "participant",
+            )
+            for index in range(batch_start, batch_end)
+        )
+
+        structures = []
+        for index, user in enumerate(users, start=batch_start):
+            user_ids.append(user.id)
+            if index == 0:
+                parent_index = None
+                paths.append(MLMStructure.path_segment(user.id))
+                levels.append(0)
+            else:
+                parent_index = (index - 1) // max_partners
+                paths.append(paths[parent_index] + MLMStructure.path_segment(user.id))
+                levels.append(levels[parent_index] + 1)
+            structures.append(
+                MLMStructure(
+                    user_id=user.id,
+                    parent_id=user_ids[parent_index] if parent_index is not None else None,
+                    position=((index - 1) % max_partners) + 1 if index else 0,
+                    level=levels[index],
+                    path=paths[index],
+                    created_at=started_at + timedelta(microseconds=index),
+                )
+            )
+        MLMStructure.objects.bulk_create(structures, batch_size=batch_size)
+
+    sync_open_slots(max_partners=max_partners)
+    verify_counters(fix=True)
+    return User.objects.get(id=user_ids[0])
+
+
+def measure(operation: str, nodes: int, func: Callable[[], object]) -> BenchmarkResult:
+    """
+    Выполняет func и фиксирует время, число SQL-запросов и пик памяти.
+    """
+    tracemalloc.start()
+    try:
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            func()
+            wall_time = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return BenchmarkResult(
+        operation=operation,
+        nodes=nodes,
+        wall_time=wall_time,
+        queries=len(captured),
+        peak_memory_kb=peak / 1024,
+    )
+
+
+def _rolled_back(func: Callable[[], object]) -> Callable[[], None]:
+    """
+    Оборачивает изменяющую операцию в точку сохранения с откатом.
+    """
+
+    def _run():
+        savepoint = transaction.savepoint()
+        try:
+            func()
+        finally:
+            transaction.savepoint_rollback(savepoint)
+
+    return _run
+
+
+def run_structure_benchmarks(size: int) -> List[BenchmarkResult]:
+    """
+    Строит дерево заданного размера и замеряет операции над ним.
+    """
+    from admin_panel.structure_data import build_structure_dataset
+
+    results = []
+    with transaction.atomic():
+        root_id = generate_trinary_tree(size).id
+        leaf = MLMStructure.objects.order_by("-level", "-created_at").select_related("user").first()
+        newcomer = User.objects.create(
+            username=f"bench_newcomer_{uuid.uuid4().hex[:8]}",
+            email=f"bench_newcomer_{uuid.uuid4().hex[:8]}@example.com",
+            invited_by_id=root_id,
+        )
+        payment = Payment(
+            user=leaf.user, amount=Decimal("100.00"), payment_type="registration"
+        )
+        batch_payments = [
+            Payment(user_id=user_id, amount=Decimal("100.00"), payment_type="registration")
+            for user_id in MLMStructure.objects.exclude(parent=None)
+            .order_by("-level", "-created_at")
+            .values_list("user_id", flat=True)[:BONUS_BATCH_SIZE]
+        ]
+
+        operations = [
+            ("find_placement_parent", lambda root: find_placement_parent(root)),
+            (
+                "place_user_in_structure",
+                lambda root: _rolled_back(lambda: place_user_in_structure(newcomer, root))(),
+            ),
+            (
+                "calculate_bonuses",
+                lambda root: _rolled_back(lambda: calculate_bonuses(leaf.user, payment))(),
+            ),
+            (
+                "calculate_bonuses_batch",
+                lambda root: _rolled_back(lambda: calculate_bonuses_batch(batch_payments))(),
+            ),
+            ("get_structure_statistics", lambda root: get_structure_statistics(root)),
+            ("build_structure_dataset", lambda root: build_structure_dataset(root)),
+        ]
+        for operation, func in operations:
+            # Свежий экземпляр, чтобы кэш связей не искажал число запросов.
+            root = User.objects.get(id=root_id)
+            results.append(measure(operation, size, lambda: func(root)))
+
+        transaction.set_rollback(True)
+    return results
@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.checks import Warning, register
+
+# Бэкенды, содержимое которых видно только текущему процессу
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register()
+def check_shared_cache(app_configs, **kwargs):
+    """
+    Версии настроек и снимков структуры живут в кэше по умолчанию. В
+    локальном кэше процесса смена версии не доходит до других воркеров.
+    """
+    backend = settings.CACHES.get('default', {}).get('BACKEND', '')
+    if settings.DEBUG or backend not in PROCESS_LOCAL_CACHES:
+        return []
+    return [
+        Warning(
+            'Кэш по умолчанию локален для процесса: изменения настроек MLM и структуры '
+            'не увидят другие воркеры до истечения TTL.',
+            hint='Задайте REDIS_URL, чтобы использовать общий кэш Redis.',
+            id='mlm.W001',
+        )
+    ]
@@ -0,0 +1,37 @@
+import json
+from dataclasses import asdict
+
+from django.core.management.base import BaseCommand
+
+from mlm.benchmarks import DEFAULT_SIZES, run_structure_benchmarks
+
+
+class Command(BaseCommand):
+    help = 'Замеряет размещение, бонусы и статистику на синтетических троичных деревьях'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes',
+            type=int,
+            nargs='+',
+            default=list(DEFAULT_SIZES[:2]),
+            help='Размеры деревьев (по умолчанию: 1000 10000)'
+        )
+        parser.add_argument(
+            '--json',
+            action='store_true',
+            help='Вывести результаты в формате JSON lines'
+        )
+
+    def handle(self, *args, **options):
+        for size in options['sizes']:
+            if not options['json']:
+                self.stdout.write(f"🌳 Дерево из {size} узлов...")
+            for result in run_structure_benchmarks(size):
+                if options['json']:
+                    self.stdout.write(json.dumps(asdict(result)))
+                else:
+                    self.stdout.write(
+                        f"  {result.operation:<26} {result.wall_time * 1000:>10.1f} ms"
+                        f" {result.queries:>7} запросов {result.peak_memory_kb:>10.0f} KiB"
+                    )
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from mlm.services.ranks import get_eligible_users, promote_eligible_users, verify_partner_counts
+
+
+class Command(BaseCommand):
+    help = 'Повышает ранг всем пользователям, выполнившим условие, за один проход'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--recount',
+            action='store_true',
+            help='Сначала сверить и исправить счетчики партнеров первой линии'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать, сколько пользователей будет повышено'
+        )
+
+    def handle(self, *args, **options):
+        if options['recount']:
+            drift = verify_partner_counts(fix=not options['dry_run'])
+            self.stdout.write(f"🔧 Расхождений в счетчиках партнеров: {len(drift)}")
+
+        if options['dry_run']:
+            self.stdout.write(f"👀 Готовы к повышению: {get_eligible_users().count()}")
+            return
+
+        promoted = promote_eligible_users()
+        self.stdout.write(self.style.SUCCESS(f'⬆️ Повышено пользователей: {promoted}'))
@@ -0,0 +1,95 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mlm.models import PayoutBatch
+from mlm.services.payouts import (
+    PAYOUT_FORMATS,
+    PayoutBatchError,
+    approve_payout_batch,
+    create_payout_batch,
+    reject_payout_batch,
+    stream_payout_file,
+)
+
+
+class Command(BaseCommand):
+    help = 'Пакетные выплаты: формирование пакета по фильтру, одобрение/отклонение и выгрузка файла выплат'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'action',
+            choices=['create', 'approve', 'reject', 'export'],
+            help='Действие с пакетом выплат'
+        )
+        parser.add_argument(
+            '--batch',
+            type=int,
+            help='ID пакета (для approve/reject/export)'
+        )
+        parser.add_argument('--payment-method', default='', help='Фильтр по способу вывода')
+        parser.add_argument('--min-amount', help='Минимальная сумма вывода')
+        parser.add_argument('--max-amount', help='Максимальная сумма вывода')
+        parser.add_argument('--created-before', default='', help='Выводы, созданные до даты (ISO)')
+        parser.add_argument('--notes', default='', help='Комментарий при отклонении')
+        parser.add_argument(
+            '--format',
+            choices=PAYOUT_FORMATS,
+            default='csv',
+            help='Формат файла выплат'
+        )
+        parser.add_argument(
+            '--output',
+            help='Файл для выгрузки (по умолчанию stdout)'
+        )
+
+    def handle(self, *args, **options):
+        action = options['action']
+        if action == 'create':
+            batch = create_payout_batch({
+                'payment_method': options['payment_method'],
+                'min_amount': options['min_amount'],
+                'max_amount': options['max_amount'],
+                'created_before': options['created_before'],
+            })
+            self.stdout.write(self.style.SUCCESS(
+                f'📦 Пакет #{batch.id}: {batch.withdrawals_count} выводов на {batch.total_amount}$'
+            ))
+            return
+
+        if not options['batch']:
+            raise CommandError('Укажите --batch')
+        try:
+            batch = PayoutBatch.objects.get(pk=options['batch'])
+        except PayoutBatch.DoesNotExist:
+            raise CommandError(f"Пакет #{options['batch']} не найден")
+
+        if action == 'export':
+            self._export(batch, options)
+            return
+
+        try:
+            if action == 'approve':
+                processed = approve_payout_batch(batch)
+                self.stdout.write(self.style.SUCCESS(f'✅ Пакет #{batch.id} выплачен: {processed} выводов'))
+            else:
+                processed = reject_payout_batch(batch, admin_notes=options['notes'])
+                self.stdout.write(self.style.SUCCESS(
+                    f'↩️ Пакет #{batch.id} отклонен, средства возвращены по {processed} выводам'
+                ))
+        except PayoutBatchError as e:
+            raise CommandError(str(e))
+
+    def _export(self, batch, options):
+        lines = stream_payout_file(batch, options['format'])
+        if not options['output']:
+            for line in lines:
+                sys.stdout.write(line)
+            return
+
+        written = 0
+        with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+            for line in lines:
+                output.write(line)
+                written += 1
+        self.stdout.write(self.style.SUCCESS(f"💾 Файл выплат {options['output']}: {written} строк"))
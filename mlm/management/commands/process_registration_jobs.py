@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from mlm.services.jobs import process_pending_registration_jobs
+
+
+class Command(BaseCommand):
+    help = (
+        'Обрабатывает задачи завершения регистрации (режим deferred или повтор упавших после паузы). '
+        'Без celery beat запускайте из cron: * * * * * python manage.py process_registration_jobs'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=100,
+            help='Сколько задач брать за один проход'
+        )
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Работать постоянно, опрашивая очередь'
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=2.0,
+            help='Пауза между проходами в режиме --loop (секунды)'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            processed = process_pending_registration_jobs(limit=options['limit'])
+            if processed:
+                self.stdout.write(f"✅ Обработано задач: {processed}")
+            if not options['loop']:
+                break
+            if not processed:
+                time.sleep(options['interval'])
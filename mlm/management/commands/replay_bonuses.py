@@ -0,0 +1,50 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from mlm.services.replay import REPLAY_CHUNK_SIZE, replay_bonuses
+
+
+class Command(BaseCommand):
+    help = 'Прогоняет правила бонусов по истории платежей и сверяет с записанными бонусами и балансами'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=REPLAY_CHUNK_SIZE,
+            help='Размер пачки платежей и курсоров'
+        )
+        parser.add_argument(
+            '--jsonl',
+            action='store_true',
+            help='Выводить каждое расхождение строкой JSON'
+        )
+        parser.add_argument(
+            '--show',
+            type=int,
+            default=20,
+            help='Сколько расхождений вывести подробно (без --jsonl)'
+        )
+
+    def handle(self, *args, **options):
+        totals = {}
+        shown = 0
+        for diff in replay_bonuses(chunk_size=options['chunk_size']):
+            totals[diff.kind] = totals.get(diff.kind, 0) + 1
+            if options['jsonl']:
+                self.stdout.write(json.dumps(diff.as_dict(), default=str, ensure_ascii=False))
+            elif shown < options['show']:
+                shown += 1
+                self.stdout.write(
+                    f"  {diff.kind}: пользователь {diff.user_id}, от {diff.from_user_id}, "
+                    f"{diff.bonus_type or '-'}, ожидалось {diff.expected}, фактически {diff.actual}"
+                )
+
+        if options['jsonl']:
+            return
+        if not totals:
+            self.stdout.write(self.style.SUCCESS('✅ Бонусы и балансы совпадают с прогоном правил'))
+            return
+        for kind, count in sorted(totals.items()):
+            self.stdout.write(self.style.WARNING(f'⚠️ {kind}: {count}'))
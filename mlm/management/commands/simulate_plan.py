@@ -0,0 +1,84 @@
+import json
+from dataclasses import asdict
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mlm import simulator
+
+
+class Command(BaseCommand):
+    help = 'Симулирует выплаты плана вознаграждений на снимке или синтетической сети и сравнивает с альтернативными настройками'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--source',
+            choices=['synthetic', 'snapshot'],
+            default='synthetic',
+            help='Синтетическая сеть или снимок текущей структуры'
+        )
+        parser.add_argument('--size', type=int, default=1_000_000, help='Размер синтетической сети')
+        parser.add_argument('--fill', type=float, default=0.9, help='Доля заполненных мест в первой линии')
+        parser.add_argument('--partner-ratio', type=float, default=1.0, help='Доля активных партнеров')
+        parser.add_argument('--seed', type=int, help='Зерно генератора')
+        parser.add_argument(
+            '--set',
+            action='append',
+            default=[],
+            metavar='ПАРАМЕТР=ЗНАЧЕНИЕ',
+            help='Альтернативное значение, например green_bonus_first=80 или spillover_percentages=5,3'
+        )
+        parser.add_argument(
+            '--json',
+            action='store_true',
+            help='Вывести результаты в формате JSON'
+        )
+
+    def handle(self, *args, **options):
+        if simulator.np is None:
+            raise CommandError('Для симулятора нужен numpy (pip install numpy)')
+
+        overrides = {}
+        for item in options['set']:
+            name, sep, value = item.partition('=')
+            if not sep:
+                raise CommandError(f'Ожидается ПАРАМЕТР=ЗНАЧЕНИЕ: {item}')
+            overrides[name.strip()] = value.strip()
+
+        baseline = simulator.PlanParameters.from_settings()
+        try:
+            scenario = baseline.with_overrides(overrides)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        if options['source'] == 'snapshot':
+            tree = simulator.snapshot_tree()
+        else:
+            tree = simulator.synthetic_tree(
+                options['size'],
+                fill=options['fill'],
+                partner_ratio=options['partner_ratio'],
+                seed=options['seed'],
+            )
+        current, alternative = simulator.compare_plans(tree, baseline, scenario)
+
+        if options['json']:
+            self.stdout.write(json.dumps(
+                {'baseline': asdict(current), 'scenario': asdict(alternative)}, default=str
+            ))
+            return
+
+        self.stdout.write(
+            f"🌳 Участников: {current.members}, регистраций: {current.registrations}, "
+            f"расчет {current.wall_time + alternative.wall_time:.2f} с"
+        )
+        self._table('Итого', {'всего': current.total}, {'всего': alternative.total})
+        self._table('По типам бонусов', current.by_type, alternative.by_type)
+        self._table('По уровням получателей', current.by_level, alternative.by_level)
+        self._table('По рангам получателей', current.by_rank, alternative.by_rank)
+
+    def _table(self, title, current, alternative):
+        self.stdout.write(f"\n📊 {title}:")
+        for key in sorted(current.keys() | alternative.keys()):
+            before = current.get(key, 0)
+            after = alternative.get(key, 0)
+            self.stdout.write(f"  {str(key):<12} {before:>16} → {after:>16} ({after - before:+})")
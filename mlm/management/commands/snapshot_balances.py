@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from mlm.services.ledger import take_balance_snapshots, verify_balances
+
+
+class Command(BaseCommand):
+    help = 'Фиксирует снимки балансов по журналу проводок'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Дополнительно сверить балансы пользователей с журналом'
+        )
+        parser.add_argument(
+            '--show',
+            type=int,
+            default=20,
+            help='Сколько расхождений вывести подробно'
+        )
+
+    def handle(self, *args, **options):
+        created = take_balance_snapshots()
+        self.stdout.write(self.style.SUCCESS(f'📸 Создано снимков балансов: {created}'))
+
+        if not options['verify']:
+            return
+
+        drift = verify_balances()
+        if not drift:
+            self.stdout.write(self.style.SUCCESS('✅ Балансы совпадают с журналом проводок'))
+            return
+
+        for row in drift[:options['show']]:
+            self.stdout.write(
+                f"  {row['username']} (#{row['user_id']}): баланс {row['balance']}, по журналу {row['ledger_balance']}"
+            )
+        self.stdout.write(self.style.WARNING(f'⚠️ Расхождений: {len(drift)}'))
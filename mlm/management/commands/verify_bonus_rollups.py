@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from mlm.services.rollups import ROLLUP_FIELDS, verify_bonus_rollups
+
+
+class Command(BaseCommand):
+    help = 'Сверяет сводки бонусов с пересчетом по таблице бонусов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fix',
+            action='store_true',
+            help='Исправить найденные расхождения'
+        )
+        parser.add_argument(
+            '--show',
+            type=int,
+            default=20,
+            help='Сколько расхождений вывести подробно'
+        )
+
+    def handle(self, *args, **options):
+        drift = verify_bonus_rollups(fix=options['fix'])
+        if not drift:
+            self.stdout.write(self.style.SUCCESS('✅ Сводки бонусов совпадают с пересчетом'))
+            return
+
+        for user_id, stored, expected in drift[:options['show']]:
+            changes = ', '.join(
+                f"{field}: {old} → {new}"
+                for field, old, new in zip(ROLLUP_FIELDS, stored, expected)
+                if old != new
+            )
+            self.stdout.write(f"  Пользователь {user_id}: {changes}")
+
+        if options['fix']:
+            self.stdout.write(self.style.SUCCESS(f'🔧 Исправлено сводок: {len(drift)}'))
+        else:
+            self.stdout.write(self.style.WARNING(f'⚠️ Расхождений: {len(drift)} (запустите с --fix)'))
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from mlm.services.counters import COUNTER_FIELDS, verify_counters
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счетчики поддеревьев с нуля и сообщает о расхождениях'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fix',
+            action='store_true',
+            help='Исправить найденные расхождения'
+        )
+        parser.add_argument(
+            '--show',
+            type=int,
+            default=20,
+            help='Сколько расхождений вывести подробно'
+        )
+
+    def handle(self, *args, **options):
+        drift = verify_counters(fix=options['fix'])
+        if not drift:
+            self.stdout.write(self.style.SUCCESS('✅ Счетчики поддеревьев совпадают с пересчетом'))
+            return
+
+        for user_id, stored, expected in drift[:options['show']]:
+            changes = ', '.join(
+                f"{field}: {old} → {new}"
+                for field, old, new in zip(COUNTER_FIELDS, stored, expected)
+                if old != new
+            )
+            self.stdout.write(f"  Пользователь {user_id}: {changes}")
+
+        if options['fix']:
+            self.stdout.write(self.style.SUCCESS(f'🔧 Исправлено узлов: {len(drift)}'))
+        else:
+            self.stdout.write(self.style.WARNING(f'⚠️ Расхождений: {len(drift)} (запустите с --fix)'))
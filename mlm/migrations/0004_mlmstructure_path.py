@@ -0,0 +1,55 @@
+from collections import defaultdict, deque
+
+from django.db import migrations, models
+
+
+def backfill_paths(apps, schema_editor):
+    MLMStructure = apps.get_model('mlm', 'MLMStructure')
+    nodes = list(
+        MLMStructure.objects.order_by('level', 'position', 'created_at').values_list(
+            'id', 'user_id', 'parent_id'
+        )
+    )
+    node_users = {user_id for _, user_id, _ in nodes}
+    children = defaultdict(list)
+    roots = []
+    for node_id, user_id, parent_id in nodes:
+        if parent_id and parent_id in node_users:
+            children[parent_id].append((node_id, user_id))
+        else:
+            roots.append((node_id, user_id, parent_id))
+
+    paths = {}
+    queue = deque()
+    for node_id, user_id, parent_id in roots:
+        prefix = f"{parent_id}/" if parent_id else ''
+        queue.append((node_id, user_id, f"{prefix}{user_id}/"))
+    while queue:
+        node_id, user_id, path = queue.popleft()
+        if node_id in paths:
+            continue
+        paths[node_id] = path
+        for child_id, child_user_id in children.get(user_id, []):
+            queue.append((child_id, child_user_id, f"{path}{child_user_id}/"))
+
+    updates = []
+    for node in MLMStructure.objects.filter(id__in=paths.keys()).only('id', 'path'):
+        node.path = paths[node.id]
+        updates.append(node)
+    MLMStructure.objects.bulk_update(updates, ['path'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mlm', '0003_mlmpartner'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mlmstructure',
+            name='path',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=1024),
+        ),
+        migrations.RunPython(backfill_paths, migrations.RunPython.noop),
+    ]
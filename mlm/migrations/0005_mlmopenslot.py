@@ -0,0 +1,67 @@
+# Generated by Django 5.2.1 on 2026-10-18 17:51
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_open_slots(apps, schema_editor):
+    MLMSettings = apps.get_model('mlm', 'MLMSettings')
+    MLMStructure = apps.get_model('mlm', 'MLMStructure')
+    MLMOpenSlot = apps.get_model('mlm', 'MLMOpenSlot')
+
+    settings_row = MLMSettings.objects.filter(is_active=True).first()
+    max_partners = (settings_row.max_partners_per_level if settings_row else 0) or 3
+    children_counts = dict(
+        MLMStructure.objects.exclude(parent_id=None)
+        .values('parent_id')
+        .annotate(total=Count('id'))
+        .values_list('parent_id', 'total')
+    )
+
+    slots = []
+    for structure in MLMStructure.objects.only('id', 'user_id', 'path', 'level', 'created_at').iterator():
+        children_count = children_counts.get(structure.user_id, 0)
+        if children_count < max_partners:
+            slots.append(
+                MLMOpenSlot(
+                    structure_id=structure.id,
+                    user_id=structure.user_id,
+                    path=structure.path,
+                    level=structure.level,
+                    children_count=children_count,
+                    created_at=structure.created_at,
+                )
+            )
+    MLMOpenSlot.objects.bulk_create(slots, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mlm', '0004_mlmstructure_path'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MLMOpenSlot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(db_index=True, max_length=1024)),
+                ('level', models.IntegerField(default=0)),
+                ('children_count', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField()),
+                ('structure', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='open_slot', to='mlm.mlmstructure')),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='open_slot', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Свободная позиция MLM',
+                'verbose_name_plural': 'Свободные позиции MLM',
+                'ordering': ['children_count', 'created_at', 'level'],
+                'indexes': [models.Index(fields=['children_count', 'created_at', 'level'], name='mlm_open_slot_order_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_open_slots, migrations.RunPython.noop),
+    ]
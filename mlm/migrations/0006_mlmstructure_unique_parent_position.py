@@ -0,0 +1,40 @@
+# Generated by Django 5.2.1 on 2026-10-18 17:53
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def renumber_duplicate_positions(apps, schema_editor):
+    MLMStructure = apps.get_model('mlm', 'MLMStructure')
+    parent_ids = (
+        MLMStructure.objects.exclude(parent_id=None)
+        .values('parent_id', 'position')
+        .annotate(total=Count('id'))
+        .filter(total__gt=1)
+        .values_list('parent_id', flat=True)
+        .distinct()
+    )
+    for parent_id in list(parent_ids):
+        siblings = list(
+            MLMStructure.objects.filter(parent_id=parent_id).order_by('position', 'created_at', 'id')
+        )
+        for index, sibling in enumerate(siblings, start=1):
+            sibling.position = index
+        MLMStructure.objects.bulk_update(siblings, ['position'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mlm', '0005_mlmopenslot'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(renumber_duplicate_positions, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='mlmstructure',
+            constraint=models.UniqueConstraint(fields=('parent', 'position'), name='mlm_structure_unique_parent_position'),
+        ),
+    ]
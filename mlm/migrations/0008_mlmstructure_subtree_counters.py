@@ -0,0 +1,95 @@
+# Generated by Django 5.2.1 on 2026-10-18 18:25
+
+from collections import defaultdict, deque
+
+from django.db import migrations, models
+
+
+def backfill_subtree_counters(apps, schema_editor):
+    MLMStructure = apps.get_model('mlm', 'MLMStructure')
+
+    statuses = {}
+    children = defaultdict(list)
+    for user_id, parent_id, status in MLMStructure.objects.values_list('user_id', 'parent_id', 'user__status').iterator():
+        statuses[user_id] = status
+        children[parent_id].append(user_id)
+
+    order = []
+    visited = set()
+    queue = deque(
+        user_id
+        for parent_id, child_ids in children.items()
+        if parent_id is None or parent_id not in statuses
+        for user_id in child_ids
+    )
+    while queue:
+        user_id = queue.popleft()
+        if user_id in visited:
+            continue
+        visited.add(user_id)
+        order.append(user_id)
+        queue.extend(children.get(user_id, ()))
+
+    counters = {}
+    for user_id in reversed(order):
+        descendants = partners = participants = max_depth = 0
+        for child_id in children.get(user_id, ()):
+            child = counters[child_id]
+            descendants += 1 + child['descendants_count']
+            partners += child['partners_count'] + (statuses[child_id] == 'partner')
+            participants += child['participants_count'] + (statuses[child_id] == 'participant')
+            max_depth = max(max_depth, child['max_depth'] + 1)
+        counters[user_id] = {
+            'children_count': len(children.get(user_id, ())),
+            'descendants_count': descendants,
+            'partners_count': partners,
+            'participants_count': participants,
+            'max_depth': max_depth,
+        }
+
+    structures = []
+    for structure in MLMStructure.objects.filter(user_id__in=list(counters)).only('id', 'user_id').iterator():
+        for field, value in counters[structure.user_id].items():
+            setattr(structure, field, value)
+        structures.append(structure)
+    MLMStructure.objects.bulk_update(
+        structures,
+        ['children_count', 'descendants_count', 'partners_count', 'participants_count', 'max_depth'],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mlm', '0007_registrationjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mlmstructure',
+            name='children_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='mlmstructure',
+            name='descendants_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='mlmstructure',
+            name='max_depth',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='mlmstructure',
+            name='participants_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='mlmstructure',
+            name='partners_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_subtree_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 5.2.1 on 2026-10-18 18:53
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def create_opening_entries(apps, schema_editor):
+    User = apps.get_model('users', 'User')
+    LedgerEntry = apps.get_model('mlm', 'LedgerEntry')
+
+    entries = []
+    for user_id, balance in User.objects.exclude(balance=0).values_list('id', 'balance').iterator():
+        entries.append(LedgerEntry(
+            user_id=user_id,
+            entry_type='credit' if balance > 0 else 'debit',
+            reason='opening',
+            amount=abs(balance),
+            description='Начальный остаток при переходе на журнал проводок',
+        ))
+    LedgerEntry.objects.bulk_create(entries, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mlm', '0008_mlmstructure_subtree_counters'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('last_entry_id', models.BigIntegerField(db_index=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balance_snapshots', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Снимок баланса',
+                'verbose_name_plural': 'Снимки балансов',
+                'ordering': ['-last_entry_id'],
+                'indexes': [models.Index(fields=['user', '-last_entry_id'], name='mlm_snapshot_user_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entry_type', models.CharField(choices=[('credit', 'Зачисление'), ('debit', 'Списание')], max_length=10)),
+                ('reason', models.CharField(choices=[('bonus', 'Бонус'), ('withdrawal', 'Вывод средств'), ('withdrawal_refund', 'Возврат вывода'), ('payment', 'Платеж'), ('adjustment', 'Корректировка'), ('opening', 'Начальный остаток')], max_length=20)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('description', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('bonus', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ledger_entries', to='mlm.bonus')),
+                ('payment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ledger_entries', to='mlm.payment')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ledger_entries', to=settings.AUTH_USER_MODEL)),
+                ('withdrawal', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ledger_entries', to='mlm.withdrawal')),
+            ],
+            options={
+                'verbose_name': 'Проводка',
+                'verbose_name_plural': 'Проводки',
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['user', 'id'], name='mlm_ledger_user_idx')],
+            },
+        ),
+        migrations.RunPython(create_opening_entries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.2.1 on 2026-10-18 19:06
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def backfill_bonus_rollups(apps, schema_editor):
+    Bonus = apps.get_model('mlm', 'Bonus')
+    BonusRollup = apps.get_model('mlm', 'BonusRollup')
+
+    green = Q(bonus_type='green')
+    red = Q(bonus_type='red')
+    unpaid = Q(is_paid=False)
+    rows = Bonus.objects.order_by().values('user_id').annotate(
+        total_count=Count('id'),
+        total_amount=Sum('amount'),
+        green_count=Count('id', filter=green),
+        green_amount=Sum('amount', filter=green),
+        red_count=Count('id', filter=red),
+        red_amount=Sum('amount', filter=red),
+        unpaid_count=Count('id', filter=unpaid),
+        unpaid_amount=Sum('amount', filter=unpaid),
+    )
+    BonusRollup.objects.bulk_create(
+        (
+            BonusRollup(**{field: value or 0 for field, value in row.items()})
+            for row in rows.iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mlm', '0009_balance_ledger'),
+        ('users', '0002_user_direct_partners_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BonusRollup',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='bonus_rollup', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('total_count', models.PositiveIntegerField(default=0)),
+                ('total_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('green_count', models.PositiveIntegerField(default=0)),
+                ('green_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('red_count', models.PositiveIntegerField(default=0)),
+                ('red_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('unpaid_count', models.PositiveIntegerField(default=0)),
+                ('unpaid_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+            options={
+                'verbose_name': 'Сводка бонусов',
+                'verbose_name_plural': 'Сводки бонусов',
+            },
+        ),
+        migrations.RunPython(backfill_bonus_rollups, migrations.RunPython.noop),
+    ]
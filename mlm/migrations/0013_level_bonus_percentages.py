@@ -0,0 +1,23 @@
+# Generated by Django 5.2.1 on 2026-10-18 19:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mlm', '0012_payoutbatch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mlmsettings',
+            name='matching_percentages',
+            field=models.JSONField(blank=True, default=list, help_text='Проценты от зеленых/красных бонусов предкам получателя по уровням'),
+        ),
+        migrations.AddField(
+            model_name='mlmsettings',
+            name='spillover_percentages',
+            field=models.JSONField(blank=True, default=list, help_text='Проценты от платежа предкам плательщика по уровням, например [5, 3, 2]'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.1 on 2026-10-18 19:44
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mlm', '0013_level_bonus_percentages'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='mlmopenslot',
+            name='path',
+            field=models.TextField(),
+        ),
+        migrations.AlterField(
+            model_name='mlmstructure',
+            name='path',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddIndex(
+            model_name='mlmopenslot',
+            index=models.Index(fields=['path'], name='mlm_open_slot_path_prefix_idx', opclasses=['text_pattern_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='mlmstructure',
+            index=models.Index(fields=['path'], name='mlm_structure_path_prefix_idx', opclasses=['text_pattern_ops']),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-18 20:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mlm', '0014_path_text_prefix_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='registrationjob',
+            name='next_attempt_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
@@ -13,16 +13,104 @@ class MLMStructure(models.Model):
     parent = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='children')
     position = models.IntegerField(default=0)  # Позиция в структуре (1, 2, 3)
     level = models.IntegerField(default=0)  # Уровень в структуре
+    # Материализованный путь от корня: "1/5/12/" (id пользователей через "/").
+    # Длина растет с глубиной, а spillover дает длинные цепочки — поэтому
+    # TextField; префиксный индекс объявлен в Meta.
+    path = models.TextField(blank=True, default='')
+    # Денормализованные счетчики поддерева (ведет mlm.services.counters)
+    children_count = models.IntegerField(default=0)
+    descendants_count = models.IntegerField(default=0)
+    partners_count = models.IntegerField(default=0)
+    participants_count = models.IntegerField(default=0)
+    max_depth = models.IntegerField(default=0)  # Глубина поддерева относительно узла
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(default=timezone.now)
     
+    PATH_SEPARATOR = '/'
+    
     def __str__(self):
         return f"{self.user.username} - Уровень {self.level}, Позиция {self.position}"
     
+    @classmethod
+    def path_segment(cls, user_id):
+        """Сегмент материализованного пути для пользователя"""
+        return f"{user_id}{cls.PATH_SEPARATOR}"
+    
+    def build_path(self):
+        """Строит путь узла по пути родителя (или от корня)"""
+        if not self.parent_id:
+            return self.path_segment(self.user_id)
+        parent_path = (
+            MLMStructure.objects.filter(user_id=self.parent_id)
+            .values_list('path', flat=True)
+            .first()
+        )
+        # Родитель без собственного узла считается корнем ветки
+        return (parent_path or self.path_segment(self.parent_id)) + self.path_segment(self.user_id)
+    
+    def get_ancestor_ids(self):
+        """Идентификаторы предков от корня к непосредственному родителю"""
+        return [int(part) for part in self.path.split(self.PATH_SEPARATOR) if part][:-1]
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Родитель на момент загрузки: по нему save() замечает перенос
+        instance._loaded_parent_id = instance.__dict__.get('parent_id')
+        return instance
+    
+    def save(self, *args, **kwargs):
+        loaded_parent_id = getattr(self, '_loaded_parent_id', self.parent_id)
+        parent_changed = self.pk is not None and self.parent_id != loaded_parent_id
+        old_path = self.path
+        if not self.path or parent_changed:
+            self.path = self.build_path()
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'path'}
+        super().save(*args, **kwargs)
+        if parent_changed and old_path and old_path != self.path:
+            # Потомки переезжают вместе с узлом: один UPDATE по префиксу
+            from mlm.services.ancestry import rewrite_subtree_paths
+            rewrite_subtree_paths(old_path, self.path)
+            rewrite_subtree_paths(old_path, self.path, model=MLMOpenSlot)
+        self._loaded_parent_id = self.parent_id
+    
     class Meta:
         verbose_name = 'MLM структура'
         verbose_name_plural = 'MLM структуры'
         ordering = ['level', 'position']
+        constraints = [
+            models.UniqueConstraint(fields=['parent', 'position'], name='mlm_structure_unique_parent_position'),
+        ]
+        indexes = [
+            # Префиксный поиск поддерева (LIKE 'path%'); opclass учитывается в PostgreSQL
+            models.Index(fields=['path'], name='mlm_structure_path_prefix_idx', opclasses=['text_pattern_ops']),
+        ]
+
+
+class MLMOpenSlot(models.Model):
+    """Узел структуры со свободными позициями (фронт spillover-размещения)"""
+    
+    structure = models.OneToOneField(MLMStructure, on_delete=models.CASCADE, related_name='open_slot')
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='open_slot')
+    # Копии полей узла, чтобы выбор родителя был одним индексным запросом
+    path = models.TextField()
+    level = models.IntegerField(default=0)
+    children_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField()
+    
+    def __str__(self):
+        return f"{self.user.username} - занято {self.children_count}"
+    
+    class Meta:
+        verbose_name = 'Свободная позиция MLM'
+        verbose_name_plural = 'Свободные позиции MLM'
+        ordering = ['children_count', 'created_at', 'level']
+        indexes = [
+            models.Index(fields=['children_count', 'created_at', 'level'], name='mlm_open_slot_order_idx'),
+            models.Index(fields=['path'], name='mlm_open_slot_path_prefix_idx', opclasses=['text_pattern_ops']),
+        ]
 
 
 class Payment(models.Model):
@@ -50,7 +138,7 @@ class Payment(models.Model):
     
     # Платежные данные
     payment_method = models.CharField(max_length=50, blank=True)
-    transaction_id = models.CharField(max_length=100, blank=True)
+    transaction_id = models.CharField(max_length=100, blank=True, db_index=True)
     
     # Даты
     created_at = models.DateTimeField(default=timezone.now)
@@ -99,6 +187,28 @@ class Bonus(models.Model):
         ordering = ['-created_at']
 
 
+class BonusRollup(models.Model):
+    """Сводка бонусов пользователя, ведется при начислении и выплате"""
+    
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='bonus_rollup')
+    
+    total_count = models.PositiveIntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    green_count = models.PositiveIntegerField(default=0)
+    green_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    red_count = models.PositiveIntegerField(default=0)
+    red_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    unpaid_count = models.PositiveIntegerField(default=0)
+    unpaid_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    
+    def __str__(self):
+        return f"{self.user_id}: {self.total_count} бонусов на {self.total_amount}"
+    
+    class Meta:
+        verbose_name = 'Сводка бонусов'
+        verbose_name_plural = 'Сводки бонусов'
+
+
 class RankUpgrade(models.Model):
     """Модель для отслеживания повышений ранга"""
     
@@ -117,6 +227,36 @@ class RankUpgrade(models.Model):
         ordering = ['-upgrade_date']
 
 
+class RegistrationJob(models.Model):
+    """Фоновая задача завершения регистрации: размещение и бонусы по платежу"""
+    
+    STATUS_CHOICES = [
+        ('pending', 'Ожидает'),
+        ('processing', 'Обрабатывается'),
+        ('completed', 'Завершена'),
+        ('failed', 'Ошибка'),
+    ]
+    
+    # Один платеж — одна задача: повторная постановка не начислит бонусы дважды
+    payment = models.OneToOneField(Payment, on_delete=models.CASCADE, related_name='registration_job')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', db_index=True)
+    attempts = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    
+    created_at = models.DateTimeField(default=timezone.now)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    # Упавшая задача не берется повторно раньше этого времени (экспоненциальная пауза)
+    next_attempt_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    
+    def __str__(self):
+        return f"Платеж #{self.payment_id} ({self.get_status_display()})"
+    
+    class Meta:
+        verbose_name = 'Задача завершения регистрации'
+        verbose_name_plural = 'Задачи завершения регистрации'
+        ordering = ['created_at']
+
+
 class MLMSettings(models.Model):
     """Настройки MLM системы"""
     
@@ -130,6 +270,16 @@ class MLMSettings(models.Model):
     red_bonus_second_partner = models.DecimalField(max_digits=10, decimal_places=2, default=50.00)
     red_bonus_third_partner = models.DecimalField(max_digits=10, decimal_places=2, default=100.00)
     
+    # Многоуровневые начисления: проценты по уровням аплайна, от ближайшего предка
+    spillover_percentages = models.JSONField(
+        default=list, blank=True,
+        help_text="Проценты от платежа предкам плательщика по уровням, например [5, 3, 2]"
+    )
+    matching_percentages = models.JSONField(
+        default=list, blank=True,
+        help_text="Проценты от зеленых/красных бонусов предкам получателя по уровням"
+    )
+    
     # Настройки системы
     max_partners_per_level = models.IntegerField(default=3)
     is_active = models.BooleanField(default=True)
@@ -193,6 +343,7 @@ class Withdrawal(models.Model):
     # Административные поля
     admin_notes = models.TextField(blank=True)
     processed_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='processed_withdrawals')
+    payout_batch = models.ForeignKey('PayoutBatch', on_delete=models.SET_NULL, null=True, blank=True, related_name='withdrawals')
     
     created_at = models.DateTimeField(default=timezone.now)
     processed_at = models.DateTimeField(null=True, blank=True)
@@ -204,3 +355,99 @@ class Withdrawal(models.Model):
         verbose_name = 'Вывод средств'
         verbose_name_plural = 'Выводы средств'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='mlm_withdrawal_status_idx'),
+        ]
+
+
+class PayoutBatch(models.Model):
+    """Пакет выплат: выводы, отобранные по фильтру и обрабатываемые вместе"""
+    
+    STATUS_CHOICES = [
+        ('open', 'Сформирован'),
+        ('completed', 'Выплачен'),
+        ('rejected', 'Отклонен'),
+    ]
+    
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='open')
+    filters = models.JSONField(default=dict, blank=True)  # Фильтр, по которому отобраны выводы
+    withdrawals_count = models.PositiveIntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='created_payout_batches')
+    processed_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='processed_payout_batches')
+    admin_notes = models.TextField(blank=True)
+    
+    created_at = models.DateTimeField(default=timezone.now)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return f"Пакет выплат #{self.id}: {self.withdrawals_count} на {self.total_amount} ({self.get_status_display()})"
+    
+    class Meta:
+        verbose_name = 'Пакет выплат'
+        verbose_name_plural = 'Пакеты выплат'
+        ordering = ['-created_at']
+
+
+class LedgerEntry(models.Model):
+    """Проводка по балансу пользователя (журнал только дополняется)"""
+    
+    ENTRY_TYPE_CHOICES = [
+        ('credit', 'Зачисление'),
+        ('debit', 'Списание'),
+    ]
+    
+    REASON_CHOICES = [
+        ('bonus', 'Бонус'),
+        ('withdrawal', 'Вывод средств'),
+        ('withdrawal_refund', 'Возврат вывода'),
+        ('payment', 'Платеж'),
+        ('adjustment', 'Корректировка'),
+        ('opening', 'Начальный остаток'),
+    ]
+    
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='ledger_entries')
+    entry_type = models.CharField(max_length=10, choices=ENTRY_TYPE_CHOICES)
+    reason = models.CharField(max_length=20, choices=REASON_CHOICES)
+    amount = models.DecimalField(max_digits=12, decimal_places=2)  # Всегда положительная
+    description = models.TextField(blank=True)
+    
+    # Основание проводки
+    bonus = models.ForeignKey(Bonus, on_delete=models.SET_NULL, null=True, blank=True, related_name='ledger_entries')
+    payment = models.ForeignKey(Payment, on_delete=models.SET_NULL, null=True, blank=True, related_name='ledger_entries')
+    withdrawal = models.ForeignKey(Withdrawal, on_delete=models.SET_NULL, null=True, blank=True, related_name='ledger_entries')
+    
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    def __str__(self):
+        sign = '+' if self.entry_type == 'credit' else '-'
+        return f"{self.user.username}: {sign}{self.amount} ({self.get_reason_display()})"
+    
+    class Meta:
+        verbose_name = 'Проводка'
+        verbose_name_plural = 'Проводки'
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['user', 'id'], name='mlm_ledger_user_idx'),
+        ]
+
+
+class BalanceSnapshot(models.Model):
+    """Остаток пользователя по журналу на момент проводки last_entry_id"""
+    
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='balance_snapshots')
+    balance = models.DecimalField(max_digits=12, decimal_places=2)
+    last_entry_id = models.BigIntegerField(db_index=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    def __str__(self):
+        return f"{self.user.username}: {self.balance} (до проводки #{self.last_entry_id})"
+    
+    class Meta:
+        verbose_name = 'Снимок баланса'
+        verbose_name_plural = 'Снимки балансов'
+        ordering = ['-last_entry_id']
+        indexes = [
+            models.Index(fields=['user', '-last_entry_id'], name='mlm_snapshot_user_idx'),
+        ]
@@ -2,20 +2,81 @@
 Service layer helpers for MLM domain logic.
 """
 
+from .ancestry import (
+    get_ancestors_queryset,
+    get_descendant_ids,
+    get_subtree_queryset,
+    refresh_structure_path,
+)
+from .settings_cache import get_active_settings, invalidate_settings_cache
+from .counters import apply_subtree_move, register_bulk_counters, verify_counters
+from .frontier import register_placement, sync_moved_subtree, sync_open_slots
 from .placement import (
     find_placement_parent,
     get_next_position,
+    get_placement_strategy,
     place_user_in_structure,
+    place_users_in_structure,
 )
-from .bonuses import calculate_bonuses, upgrade_user_rank
+from .bonuses import calculate_bonuses, calculate_bonuses_batch, upgrade_user_rank
+from .commissions import calculate_level_bonuses
+from .dashboard import get_dashboard_counters, invalidate_dashboard_counters
+from .jobs import enqueue_registration_batch, enqueue_registration_completed, process_registration_job
+from .ledger import post_bulk_credits, post_credit, post_debit, take_balance_snapshots, verify_balances
+from .moves import StructureMoveError, move_subtree
+from .payouts import approve_payout_batch, create_payout_batch, reject_payout_batch, stream_payout_file
+from .ranks import promote_eligible_users, verify_partner_counts
+from .replay import replay_bonuses
+from .rollups import mark_bonuses_paid, register_bonuses, verify_bonus_rollups
 from .statistics import get_bonus_summary, get_structure_statistics
+from .structure_version import get_structure_snapshot, invalidate_structure_snapshots
 
 __all__ = [
+    "StructureMoveError",
+    "apply_subtree_move",
+    "approve_payout_batch",
     "calculate_bonuses",
+    "calculate_bonuses_batch",
+    "calculate_level_bonuses",
+    "create_payout_batch",
+    "enqueue_registration_batch",
+    "enqueue_registration_completed",
     "find_placement_parent",
+    "get_active_settings",
+    "get_ancestors_queryset",
     "get_bonus_summary",
+    "get_dashboard_counters",
+    "get_descendant_ids",
+    "get_structure_snapshot",
     "get_structure_statistics",
     "get_next_position",
+    "get_placement_strategy",
+    "get_subtree_queryset",
+    "move_subtree",
+    "invalidate_dashboard_counters",
+    "invalidate_settings_cache",
+    "invalidate_structure_snapshots",
+    "mark_bonuses_paid",
     "place_user_in_structure",
+    "place_users_in_structure",
+    "post_bulk_credits",
+    "post_credit",
+    "post_debit",
+    "promote_eligible_users",
+    "process_registration_job",
+    "refresh_structure_path",
+    "register_bonuses",
+    "register_bulk_counters",
+    "register_placement",
+    "reject_payout_batch",
+    "replay_bonuses",
+    "sync_moved_subtree",
+    "stream_payout_file",
+    "sync_open_slots",
+    "take_balance_snapshots",
     "upgrade_user_rank",
+    "verify_balances",
+    "verify_bonus_rollups",
+    "verify_counters",
+    "verify_partner_counts",
 ]
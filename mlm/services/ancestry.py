@@ -0,0 +1,73 @@
+from typing import List, Optional
+
+from django.db.models import F, Value
+from django.db.models.functions import Concat, Substr
+
+from mlm.models import MLMStructure
+from users.models import User
+
+
+def get_subtree_prefix(user: User) -> str:
+    """
+    Возвращает префикс материализованного пути для поддерева пользователя.
+    """
+    path = (
+        MLMStructure.objects.filter(user=user).values_list("path", flat=True).first()
+    )
+    # Пользователь без узла может быть только корнем своей ветки.
+    return path or MLMStructure.path_segment(user.id)
+
+
+def get_subtree_queryset(user: User, include_self: bool = False):
+    """
+    Узлы поддерева пользователя одним индексным запросом по префиксу пути.
+    """
+    queryset = MLMStructure.objects.filter(path__startswith=get_subtree_prefix(user))
+    if not include_self:
+        queryset = queryset.exclude(user=user)
+    return queryset
+
+
+def get_descendant_ids(user: User) -> List[int]:
+    """
+    Возвращает идентификаторы всех потомков пользователя.
+    """
+    return list(get_subtree_queryset(user).values_list("user_id", flat=True))
+
+
+def get_ancestors_queryset(structure: MLMStructure):
+    """
+    Узлы предков по материализованному пути (от корня к родителю).
+    """
+    return MLMStructure.objects.filter(
+        user_id__in=structure.get_ancestor_ids()
+    ).order_by("level")
+
+
+def rewrite_subtree_paths(old_prefix: str, new_prefix: str, model=MLMStructure) -> int:
+    """
+    Переносит поддерево на новый префикс пути одним UPDATE
+    (model — MLMStructure или MLMOpenSlot, у которого тот же путь).
+    """
+    if old_prefix == new_prefix:
+        return 0
+    return model.objects.filter(path__startswith=old_prefix).update(
+        path=Concat(
+            Value(new_prefix),
+            Substr(F("path"), len(old_prefix) + 1),
+        )
+    )
+
+
+def refresh_structure_path(structure: MLMStructure, old_path: Optional[str] = None) -> str:
+    """
+    Пересчитывает путь узла после смены родителя и обновляет его поддерево.
+    """
+    old_path = old_path or structure.path
+    new_path = structure.build_path()
+    if old_path:
+        rewrite_subtree_paths(old_path, new_path)
+    else:
+        MLMStructure.objects.filter(pk=structure.pk).update(path=new_path)
+    structure.path = new_path
+    return new_path
@@ -1,38 +1,26 @@
+from collections import defaultdict
 from decimal import Decimal
-from typing import Optional
+from typing import Iterable, List, Optional
 
 from django.db import transaction
 from django.utils import timezone
 
-from mlm.models import Bonus, MLMSettings, MLMStructure, RankUpgrade
+from mlm.models import Bonus, MLMStructure, Payment, RankUpgrade
 from users.models import User
 
-
-def _get_active_settings() -> MLMSettings:
-    """
-    Возвращает активные настройки MLM либо создает значения по умолчанию.
-    """
-    settings = MLMSettings.objects.filter(is_active=True).first()
-    if not settings:
-        settings = MLMSettings.objects.create(
-            registration_fee=Decimal("100.00"),
-            green_bonus_first=Decimal("100.00"),
-            green_bonus_second=Decimal("50.00"),
-            red_bonus_second_partner=Decimal("50.00"),
-            red_bonus_third_partner=Decimal("100.00"),
-            max_partners_per_level=3,
-            is_active=True,
-        )
-    return settings
+from .commissions import calculate_level_bonuses, write_bonuses
+from .ledger import post_credit
+from .ranks import promote_eligible_users
+from .settings_cache import get_active_settings
 
 
-def _credit_user(user: User, amount: Decimal) -> None:
+def _credit_user(user: User, amount: Decimal, bonus: Bonus) -> None:
     """
-    Пополняет баланс пользователя и обновляет суммарный доход.
+    Зачисляет бонус проводкой журнала: баланс и суммарный доход
+    растут атомарно в БД, объект user в памяти не пересохраняется.
     """
-    user.balance = (user.balance or Decimal("0.00")) + amount
-    user.total_earned = (user.total_earned or Decimal("0.00")) + amount
-    user.save(update_fields=["balance", "total_earned"])
+    if amount > 0:
+        post_credit(user, amount, "bonus", bonus=bonus, description=bonus.description)
 
 
 def _create_bonus(
@@ -58,9 +46,10 @@ def _create_bonus(
 
 def calculate_bonuses(user: User, payment) -> None:
     """
-    Начисляет бонусы пригласителю и их структуре в момент оплаты.
+    Начисляет бонусы пригласителю и их структуре в момент оплаты,
+    затем многоуровневые спилловер и матчинг по настройкам.
     """
-    settings = _get_active_settings()
+    settings = get_active_settings()
 
     try:
         mlm_structure = user.mlm_structure
@@ -79,9 +68,10 @@ def calculate_bonuses(user: User, payment) -> None:
     partners_count = children_qs.count()
 
     level = mlm_structure.level
+    created = []
 
     if partners_count == 1:
-        _create_bonus(
+        bonus = _create_bonus(
             parent,
             settings.green_bonus_first,
             "green",
@@ -89,10 +79,11 @@ def calculate_bonuses(user: User, payment) -> None:
             user,
             level,
         )
-        _credit_user(parent, settings.green_bonus_first)
+        _credit_user(parent, settings.green_bonus_first, bonus)
+        created.append(bonus)
 
     elif partners_count == 2:
-        _create_bonus(
+        bonus = _create_bonus(
             parent,
             settings.green_bonus_second,
             "green",
@@ -100,11 +91,12 @@ def calculate_bonuses(user: User, payment) -> None:
             user,
             level,
         )
-        _credit_user(parent, settings.green_bonus_second)
+        _credit_user(parent, settings.green_bonus_second, bonus)
+        created.append(bonus)
 
         first_partner = children_qs.first()
         if first_partner:
-            _create_bonus(
+            bonus = _create_bonus(
                 first_partner.user,
                 settings.red_bonus_second_partner,
                 "red",
@@ -112,12 +104,13 @@ def calculate_bonuses(user: User, payment) -> None:
                 user,
                 level,
             )
-            _credit_user(first_partner.user, settings.red_bonus_second_partner)
+            _credit_user(first_partner.user, settings.red_bonus_second_partner, bonus)
+            created.append(bonus)
 
     elif partners_count == 3:
         first_partner = children_qs.first()
         if first_partner:
-            _create_bonus(
+            bonus = _create_bonus(
                 first_partner.user,
                 settings.red_bonus_third_partner,
                 "red",
@@ -125,10 +118,98 @@ def calculate_bonuses(user: User, payment) -> None:
                 user,
                 level,
             )
-            _credit_user(first_partner.user, settings.red_bonus_third_partner)
+            _credit_user(first_partner.user, settings.red_bonus_third_partner, bonus)
+            created.append(bonus)
+
+    if payment is not None:
+        calculate_level_bonuses([payment], created)
 
     if parent.can_upgrade_rank():
-        upgrade_user_rank(parent)
+        promote_eligible_users([parent.id])
+
+
+def calculate_bonuses_batch(payments: Iterable[Payment]) -> List[Bonus]:
+    """
+    Пакетное начисление бонусов по регистрационным платежам.
+    Узлы плательщиков и дети их родителей читаются двумя запросами, бонусы
+    считаются в памяти и пишутся одним bulk_create, балансы — через
+    post_bulk_credits. Порядковый номер плательщика среди детей родителя в
+    порядке размещения (created_at, id) равен partners_count, который
+    calculate_bonuses увидел бы сразу после его размещения, — так пакет
+    повторяет поштучные начисления. Для прочих платежей такого соответствия
+    нет, их пропускаем: они идут через calculate_bonuses с живым счетчиком.
+    Спилловер и матчинг начисляются по тем же платежам одним проходом.
+    Ранг родителя повышается не более одного раза за пакет.
+    """
+    payments = [payment for payment in payments if payment.payment_type == "registration"]
+    if not payments:
+        return []
+
+    settings = get_active_settings()
+    nodes = {
+        user_id: (parent_id, level, username)
+        for user_id, parent_id, level, username in MLMStructure.objects.filter(
+            user_id__in={payment.user_id for payment in payments},
+            parent__isnull=False,
+        ).values_list("user_id", "parent_id", "level", "user__username")
+    }
+    if not nodes:
+        return []
+
+    # Дети в порядке размещения и первый партнер — как children_qs.first()
+    siblings = defaultdict(list)
+    first_partner = {}
+    for parent_id, user_id, position in (
+        MLMStructure.objects.filter(parent_id__in={node[0] for node in nodes.values()})
+        .order_by("parent_id", "created_at", "id")
+        .values_list("parent_id", "user_id", "position")
+    ):
+        siblings[parent_id].append(user_id)
+        if parent_id not in first_partner or position < first_partner[parent_id][0]:
+            first_partner[parent_id] = (position, user_id)
+
+    bonuses = []
+    parent_ids = set()
+    for payment in payments:
+        node = nodes.get(payment.user_id)
+        if node is None:
+            continue
+        parent_id, level, username = node
+        parent_ids.add(parent_id)
+        children = siblings[parent_id]
+        ordinal = children.index(payment.user_id) + 1
+
+        def add(recipient_id, amount, bonus_type, description):
+            bonuses.append(
+                Bonus(
+                    user_id=recipient_id,
+                    amount=amount,
+                    bonus_type=bonus_type,
+                    description=description,
+                    from_user_id=payment.user_id,
+                    level=level,
+                )
+            )
+
+        if ordinal == 1:
+            add(parent_id, settings.green_bonus_first, "green",
+                f"Зеленый бонус за первого партнера: {username}")
+        elif ordinal == 2:
+            add(parent_id, settings.green_bonus_second, "green",
+                f"Зеленый бонус за второго партнера: {username}")
+            add(first_partner[parent_id][1], settings.red_bonus_second_partner, "red",
+                f"Красный бонус от партнера {username}")
+        elif ordinal == 3:
+            add(first_partner[parent_id][1], settings.red_bonus_third_partner, "red",
+                f"Красный бонус за третьего партнера: {username}")
+
+    with transaction.atomic():
+        write_bonuses(bonuses)
+        calculate_level_bonuses(
+            [payment for payment in payments if payment.user_id in nodes], bonuses
+        )
+        promote_eligible_users(parent_ids)
+    return bonuses
 
 
 def upgrade_user_rank(user: User) -> None:
@@ -0,0 +1,126 @@
+"""
+Многоуровневые начисления: спилловер и матчинг.
+Аплайн берется из материализованного пути: пути всех плательщиков и
+получателей читаются одним запросом, статусы предков — вторым. Проценты
+по уровням задаются в настройках (spillover_percentages,
+matching_percentages, от ближайшего предка). Все бонусы пишутся одним
+bulk_create, балансы — через post_bulk_credits.
+"""
+
+from decimal import Decimal
+from typing import Dict, Iterable, List, Sequence
+
+from django.db import transaction
+
+from mlm.models import Bonus, LedgerEntry, MLMStructure, Payment
+from users.models import User
+
+from .ledger import post_bulk_credits
+from .rollups import register_bonuses
+from .settings_cache import get_active_settings
+
+MATCHED_BONUS_TYPES = ("green", "red")
+CENT = Decimal("0.01")
+
+
+def get_level_percentages(values) -> List[Decimal]:
+    """Проценты по уровням из настроек; некорректные значения считаются нулем."""
+    percentages = []
+    for value in values or []:
+        try:
+            percentages.append(max(Decimal(str(value)), Decimal("0")))
+        except ArithmeticError:
+            percentages.append(Decimal("0"))
+    return percentages
+
+
+def get_uplines(user_ids: Iterable[int], depth: int) -> Dict[int, List[int]]:
+    """
+    Предки пользователей от ближайшего к корню, не глубже depth уровней.
+    Один запрос на все пути; пользователи без узла в результат не попадают.
+    """
+    uplines = {}
+    rows = MLMStructure.objects.filter(user_id__in=set(user_ids)).order_by().values_list("user_id", "path")
+    for user_id, path in rows:
+        ancestors = [int(part) for part in path.split(MLMStructure.PATH_SEPARATOR) if part][:-1]
+        uplines[user_id] = ancestors[::-1][:depth]
+    return uplines
+
+
+def write_bonuses(bonuses: Sequence[Bonus]) -> None:
+    """Пишет бонусы одним bulk_create, обновляет сводки и зачисляет суммы."""
+    with transaction.atomic(savepoint=False):
+        Bonus.objects.bulk_create(bonuses, batch_size=1000)
+        register_bonuses(bonuses)
+        post_bulk_credits(
+            LedgerEntry(
+                user_id=bonus.user_id,
+                reason="bonus",
+                amount=bonus.amount,
+                bonus=bonus,
+                description=bonus.description,
+            )
+            for bonus in bonuses
+            if bonus.amount > 0
+        )
+
+
+def calculate_level_bonuses(
+    payments: Iterable[Payment], base_bonuses: Iterable[Bonus] = ()
+) -> List[Bonus]:
+    """
+    Начисляет спилловер предкам плательщиков (процент от суммы платежа) и
+    матчинг предкам получателей base_bonuses (процент от зеленого/красного
+    бонуса). Получают только активные партнеры; уровень бонуса — расстояние
+    до источника. Без настроенных процентов запросов не выполняет.
+    """
+    settings = get_active_settings()
+    spillover = get_level_percentages(settings.spillover_percentages)
+    matching = get_level_percentages(settings.matching_percentages)
+    payments = [payment for payment in payments if spillover and payment.amount]
+    base_bonuses = [
+        bonus for bonus in base_bonuses
+        if matching and bonus.bonus_type in MATCHED_BONUS_TYPES and bonus.amount > 0
+    ]
+    if not payments and not base_bonuses:
+        return []
+
+    uplines = get_uplines(
+        [payment.user_id for payment in payments] + [bonus.user_id for bonus in base_bonuses],
+        max(len(spillover), len(matching)),
+    )
+    eligible = set(
+        User.objects.filter(
+            id__in={ancestor for upline in uplines.values() for ancestor in upline},
+            status="partner",
+            is_active=True,
+        ).values_list("id", flat=True)
+    )
+
+    bonuses = []
+
+    def add(percentages, source_id, base_amount, bonus_type, description):
+        for level, ancestor_id in enumerate(uplines.get(source_id, ())[:len(percentages)], start=1):
+            amount = (base_amount * percentages[level - 1] / 100).quantize(CENT)
+            if amount > 0 and ancestor_id in eligible:
+                bonuses.append(
+                    Bonus(
+                        user_id=ancestor_id,
+                        amount=amount,
+                        bonus_type=bonus_type,
+                        description=f"{description}, уровень {level}",
+                        from_user_id=source_id,
+                        level=level,
+                    )
+                )
+
+    for payment in payments:
+        add(spillover, payment.user_id, payment.amount, "spillover",
+            f"Спилловер с платежа #{payment.id}")
+    for bonus in base_bonuses:
+        add(matching, bonus.user_id, bonus.amount, "matching",
+            f"Матчинг бонус ({bonus.get_bonus_type_display()})")
+
+    if bonuses:
+        write_bonuses(bonuses)
+    return bonuses
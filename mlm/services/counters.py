@@ -0,0 +1,296 @@
+"""
+Денормализованные счетчики поддерева на MLMStructure.
+Вставка, перенос и удаление узла меняют счетчики только вдоль пути предков
+(одним UPDATE); полный пересчет нужен лишь для сверки.
+
+Конкуренция: цепочка предков любого узла заканчивается корнем, поэтому
+каждое размещение в дереве обновляет строку корня и держит ее блокировку
+до коммита — параллельные размещения в одном дереве фактически идут по
+очереди на этой строке. Приращения применяются от корня вниз (первым идет
+UPDATE, содержащий корень), так что транзакции ждут друг друга на корне,
+а не блокируют друг друга крест-накрест. Транзакцию размещения держим
+короткой — бонусы и прочее выполняются задачами после коммита, — а при
+потоке регистраций пользуемся пакетным размещением: register_bulk_counters
+обновляет корень один раз на весь пакет.
+"""
+
+from collections import defaultdict, deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.db.models import Case, F, IntegerField, Value, When
+from django.db.models.functions import Greatest
+
+from mlm.models import MLMStructure
+from users.models import User
+
+COUNTER_FIELDS = (
+    "children_count",
+    "descendants_count",
+    "partners_count",
+    "participants_count",
+    "max_depth",
+)
+
+UPDATE_CHUNK_SIZE = 500
+
+# Вклад поддерева в предков: [дети, потомки, партнеры, участники, глубочайший уровень]
+Delta = List[int]
+
+
+def _status_counts(status: str) -> Tuple[int, int]:
+    return int(status == "partner"), int(status == "participant")
+
+
+def _subtree_delta(structure: MLMStructure, status: str, sign: int) -> Tuple[int, int, int, int]:
+    partners, participants = _status_counts(status)
+    return (
+        sign * (1 + structure.descendants_count),
+        sign * (structure.partners_count + partners),
+        sign * (structure.participants_count + participants),
+        structure.level + structure.max_depth,
+    )
+
+
+def _add_delta(
+    deltas: Dict[int, Delta],
+    ancestor_ids: Iterable[int],
+    parent_id: Optional[int],
+    subtree: Tuple[int, int, int, int],
+) -> None:
+    descendants, partners, participants, reach = subtree
+    sign = 1 if descendants >= 0 else -1
+    for ancestor_id in ancestor_ids:
+        delta = deltas.setdefault(ancestor_id, [0, 0, 0, 0, -1])
+        delta[1] += descendants
+        delta[2] += partners
+        delta[3] += participants
+        if sign > 0:
+            delta[4] = max(delta[4], reach)
+    if parent_id and parent_id in deltas:
+        deltas[parent_id][0] += sign
+
+
+def _apply_deltas(deltas: Dict[int, Delta]) -> None:
+    """
+    Применяет приращения через F(): параллельные вставки не теряют обновлений.
+    Узлы с одинаковым приращением обновляются одним UPDATE — у одиночной
+    вставки это все предки, кроме родителя. Группы идут в порядке вставки
+    в deltas, то есть от корня вниз (см. docstring модуля). Глубина только
+    растет; уменьшение считает _refresh_max_depth.
+    """
+    groups = defaultdict(list)
+    for user_id, delta in deltas.items():
+        if any(delta[:4]) or delta[4] >= 0:
+            groups[tuple(delta)].append(user_id)
+
+    for (children, descendants, partners, participants, reach), user_ids in groups.items():
+        updates = {
+            "children_count": F("children_count") + children,
+            "descendants_count": F("descendants_count") + descendants,
+            "partners_count": F("partners_count") + partners,
+            "participants_count": F("participants_count") + participants,
+        }
+        if reach >= 0:
+            updates["max_depth"] = Greatest(F("max_depth"), Value(reach) - F("level"))
+        for start in range(0, len(user_ids), UPDATE_CHUNK_SIZE):
+            MLMStructure.objects.filter(user_id__in=user_ids[start:start + UPDATE_CHUNK_SIZE]).update(**updates)
+
+
+def _refresh_max_depth(ancestor_ids: List[int]) -> None:
+    """
+    Пересчитывает глубину цепочки предков снизу вверх по их детям.
+    """
+    if not ancestor_ids:
+        return
+    children = defaultdict(dict)
+    for parent_id, user_id, max_depth in MLMStructure.objects.filter(
+        parent_id__in=ancestor_ids
+    ).values_list("parent_id", "user_id", "max_depth"):
+        children[parent_id][user_id] = max_depth
+
+    computed = {}
+    for ancestor_id in reversed(ancestor_ids):
+        depths = children.get(ancestor_id, {})
+        for child_id in depths.keys() & computed.keys():
+            depths[child_id] = computed[child_id]
+        computed[ancestor_id] = max((depth + 1 for depth in depths.values()), default=0)
+
+    # Обновляем только изменившиеся узлы.
+    changed = [
+        user_id
+        for user_id, max_depth in MLMStructure.objects.filter(user_id__in=ancestor_ids).values_list(
+            "user_id", "max_depth"
+        )
+        if computed[user_id] != max_depth
+    ]
+    for start in range(0, len(changed), UPDATE_CHUNK_SIZE):
+        chunk = changed[start:start + UPDATE_CHUNK_SIZE]
+        MLMStructure.objects.filter(user_id__in=chunk).update(
+            max_depth=Case(
+                *[When(user_id=user_id, then=Value(computed[user_id])) for user_id in chunk],
+                output_field=IntegerField(),
+            )
+        )
+
+
+def _ancestor_ids(path: str) -> List[int]:
+    return [int(part) for part in path.split(MLMStructure.PATH_SEPARATOR) if part][:-1]
+
+
+def register_node_counters(structure: MLMStructure) -> None:
+    """
+    Учитывает новый узел во всех предках.
+    """
+    deltas: Dict[int, Delta] = {}
+    _add_delta(
+        deltas,
+        structure.get_ancestor_ids(),
+        structure.parent_id,
+        _subtree_delta(structure, structure.user.status, 1),
+    )
+    _apply_deltas(deltas)
+
+
+def register_bulk_counters(structures: Iterable[MLMStructure]) -> None:
+    """
+    Учитывает пакет новых листьев (например, после bulk_create) суммарными приращениями.
+    Узлы пакета могут быть предками друг друга.
+    """
+    structures = list(structures)
+    statuses = dict(
+        User.objects.filter(id__in=[structure.user_id for structure in structures]).values_list("id", "status")
+    )
+    deltas: Dict[int, Delta] = {}
+    for structure in structures:
+        _add_delta(
+            deltas,
+            structure.get_ancestor_ids(),
+            structure.parent_id,
+            _subtree_delta(structure, statuses.get(structure.user_id, ""), 1),
+        )
+    _apply_deltas(deltas)
+
+
+def unregister_node_counters(structure: MLMStructure, status: str) -> None:
+    """
+    Вычитает поддерево удаленного узла из предков. Если родительского узла уже
+    нет (каскадное удаление), поддерево было вычтено вместе с ним.
+    """
+    ancestor_ids = _ancestor_ids(structure.path)
+    if not ancestor_ids or not MLMStructure.objects.filter(user_id=structure.parent_id).exists():
+        return
+    deltas: Dict[int, Delta] = {}
+    _add_delta(deltas, ancestor_ids, structure.parent_id, _subtree_delta(structure, status, -1))
+    _apply_deltas(deltas)
+    _refresh_max_depth(ancestor_ids)
+
+
+def apply_subtree_move(structure: MLMStructure, old_path: str) -> None:
+    """
+    Переносит вклад поддерева со старой цепочки предков на новую.
+    Вызывается после обновления пути, уровней и родителя узла.
+    """
+    structure.refresh_from_db(fields=[*COUNTER_FIELDS, "level", "path", "parent"])
+    status = User.objects.filter(id=structure.user_id).values_list("status", flat=True).first() or ""
+    old_ancestor_ids = _ancestor_ids(old_path)
+    new_ancestor_ids = structure.get_ancestor_ids()
+
+    deltas: Dict[int, Delta] = {}
+    _add_delta(
+        deltas,
+        old_ancestor_ids,
+        old_ancestor_ids[-1] if old_ancestor_ids else None,
+        _subtree_delta(structure, status, -1),
+    )
+    _apply_deltas(deltas)
+    _refresh_max_depth(old_ancestor_ids)
+
+    deltas = {}
+    _add_delta(deltas, new_ancestor_ids, structure.parent_id, _subtree_delta(structure, status, 1))
+    _apply_deltas(deltas)
+
+
+def apply_status_change(user: User, old_status: str) -> None:
+    """
+    Переносит пользователя между счетчиками партнеров и участников у предков.
+    """
+    path = MLMStructure.objects.filter(user=user).values_list("path", flat=True).first()
+    if not path:
+        return
+    old_partners, old_participants = _status_counts(old_status)
+    new_partners, new_participants = _status_counts(user.status)
+    ancestor_ids = _ancestor_ids(path)
+    if not ancestor_ids or (old_partners, old_participants) == (new_partners, new_participants):
+        return
+    deltas = {
+        ancestor_id: [0, 0, new_partners - old_partners, new_participants - old_participants, -1]
+        for ancestor_id in ancestor_ids
+    }
+    _apply_deltas(deltas)
+
+
+def compute_counters() -> Dict[int, Tuple[int, int, int, int, int]]:
+    """
+    Считает счетчики всех узлов с нуля по связям parent (в порядке COUNTER_FIELDS).
+    """
+    statuses = {}
+    children = defaultdict(list)
+    for user_id, parent_id, status in MLMStructure.objects.values_list(
+        "user_id", "parent_id", "user__status"
+    ).iterator(chunk_size=5000):
+        statuses[user_id] = status
+        children[parent_id].append(user_id)
+
+    # Корни — узлы, у родителя которых нет собственного узла.
+    order = []
+    queue = deque(
+        user_id
+        for parent_id, child_ids in children.items()
+        if parent_id is None or parent_id not in statuses
+        for user_id in child_ids
+    )
+    visited = set()
+    while queue:
+        user_id = queue.popleft()
+        if user_id in visited:
+            continue
+        visited.add(user_id)
+        order.append(user_id)
+        queue.extend(children.get(user_id, ()))
+
+    counters = {}
+    for user_id in reversed(order):
+        child_ids = children.get(user_id, ())
+        descendants = partners = participants = max_depth = 0
+        for child_id in child_ids:
+            child_children, child_descendants, child_partners, child_participants, child_depth = counters[child_id]
+            child_partner, child_participant = _status_counts(statuses[child_id])
+            descendants += 1 + child_descendants
+            partners += child_partners + child_partner
+            participants += child_participants + child_participant
+            max_depth = max(max_depth, child_depth + 1)
+        counters[user_id] = (len(child_ids), descendants, partners, participants, max_depth)
+    return counters
+
+
+def verify_counters(fix: bool = False) -> List[Tuple[int, Tuple, Tuple]]:
+    """
+    Сверяет сохраненные счетчики с полным пересчетом и возвращает расхождения
+    (user_id, сохранено, ожидается). С fix=True исправляет их.
+    """
+    expected = compute_counters()
+    drift = []
+    for user_id, *stored in MLMStructure.objects.values_list("user_id", *COUNTER_FIELDS).iterator(chunk_size=5000):
+        stored = tuple(stored)
+        if user_id in expected and expected[user_id] != stored:
+            drift.append((user_id, stored, expected[user_id]))
+
+    if fix and drift:
+        fixed = []
+        ids = {user_id: values for user_id, _, values in drift}
+        for structure in MLMStructure.objects.filter(user_id__in=ids).only("id", "user_id"):
+            for field, value in zip(COUNTER_FIELDS, ids[structure.user_id]):
+                setattr(structure, field, value)
+            fixed.append(structure)
+        MLMStructure.objects.bulk_update(fixed, COUNTER_FIELDS, batch_size=1000)
+    return drift
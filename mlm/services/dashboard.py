@@ -0,0 +1,75 @@
+"""
+Счетчики дашборда админки.
+Все показатели считаются условной агрегацией — один запрос на таблицу —
+и кладутся в кэш с коротким TTL. Сигналы сохранения и удаления
+пользователей, платежей, бонусов и выводов сбрасывают кэш; пакетные
+UPDATE сигналов не шлют, их догоняет истечение TTL.
+"""
+
+from datetime import timedelta
+from decimal import Decimal
+from typing import Dict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, DecimalField, Q, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from mlm.models import Bonus, Payment, Withdrawal
+from users.models import User
+
+DASHBOARD_CACHE_KEY = "mlm:dashboard:counters"
+DEFAULT_DASHBOARD_TTL = 30
+
+ZERO = Decimal("0.00")
+
+
+def _money(field: str, condition=None):
+    return Coalesce(
+        Sum(field, filter=condition),
+        Value(ZERO),
+        output_field=DecimalField(max_digits=15, decimal_places=2),
+    )
+
+
+def compute_dashboard_counters() -> Dict:
+    """Все показатели дашборда: по одному агрегирующему запросу на таблицу."""
+    week_ago = timezone.now() - timedelta(days=7)
+    counters = User.objects.aggregate(
+        total_users=Count("id"),
+        active_users=Count("id", filter=Q(is_active_mlm=True)),
+        participants=Count("id", filter=Q(status="participant")),
+        partners=Count("id", filter=Q(status="partner")),
+        new_users_week=Count("id", filter=Q(date_joined__gte=week_ago)),
+        total_balance=_money("balance"),
+    )
+    counters.update(Payment.objects.aggregate(
+        total_payments=_money("amount", Q(status="completed")),
+        pending_payments=Count("id", filter=Q(status="pending")),
+    ))
+    counters.update(Bonus.objects.aggregate(total_bonuses=_money("amount")))
+    counters.update(Withdrawal.objects.aggregate(
+        pending_withdrawals=Count("id", filter=Q(status="pending")),
+    ))
+    return counters
+
+
+def get_dashboard_counters() -> Dict:
+    """Показатели из кэша; при промахе — пересчет и сохранение на TTL."""
+    counters = cache.get(DASHBOARD_CACHE_KEY)
+    if counters is None:
+        counters = compute_dashboard_counters()
+        cache.set(
+            DASHBOARD_CACHE_KEY,
+            counters,
+            getattr(settings, "DASHBOARD_COUNTERS_TTL", DEFAULT_DASHBOARD_TTL),
+        )
+    return counters
+
+
+def invalidate_dashboard_counters() -> None:
+    """Сбрасывает кэш сразу и после коммита, чтобы не закэшировать незафиксированные данные."""
+    cache.delete(DASHBOARD_CACHE_KEY)
+    transaction.on_commit(lambda: cache.delete(DASHBOARD_CACHE_KEY))
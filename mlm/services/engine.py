@@ -0,0 +1,135 @@
+"""
+Движок размещения: стратегии выбора родителя поверх компактного снимка дерева.
+Модуль не обращается к БД — снимок строится из строк, загруженных одним запросом.
+"""
+
+import calendar
+from array import array
+from collections import defaultdict, deque
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Tuple
+
+
+def _to_micros(value: Optional[datetime]) -> int:
+    if value is None:
+        return 0
+    return calendar.timegm(value.utctimetuple()) * 1_000_000 + value.microsecond
+
+
+class TreeSnapshot:
+    """
+    Поддерево в порядке обхода в ширину: узел с индексом i описывают
+    элементы параллельных массивов user_ids, levels, child_counts, created.
+    """
+
+    __slots__ = ("user_ids", "levels", "child_counts", "created")
+
+    def __init__(self):
+        self.user_ids = array("q")
+        self.levels = array("l")
+        self.child_counts = array("l")
+        self.created = array("q")
+
+    def __len__(self) -> int:
+        return len(self.user_ids)
+
+    @classmethod
+    def build(
+        cls, root_id: int, rows: Iterable[Tuple[int, Optional[int], Optional[datetime]]]
+    ) -> "TreeSnapshot":
+        """
+        Строит снимок из строк (user_id, parent_id, created_at).
+        Порядок строк задает порядок детей у каждого родителя.
+        """
+        children: Dict[int, list] = defaultdict(list)
+        created: Dict[int, int] = {}
+        for user_id, parent_id, created_at in rows:
+            created[user_id] = _to_micros(created_at)
+            if parent_id is not None and user_id != root_id:
+                children[parent_id].append(user_id)
+
+        snapshot = cls()
+        visited = set()
+        queue = deque([(root_id, 0)])
+        while queue:
+            user_id, level = queue.popleft()
+            if user_id in visited:
+                continue
+            visited.add(user_id)
+            child_ids = children.get(user_id, ())
+            snapshot.user_ids.append(user_id)
+            snapshot.levels.append(level)
+            snapshot.child_counts.append(len(child_ids))
+            snapshot.created.append(created.get(user_id, 0))
+            queue.extend((child_id, level + 1) for child_id in child_ids)
+        return snapshot
+
+
+class PlacementStrategy:
+    """Базовая стратегия: выбирает индекс узла снимка со свободной позицией."""
+
+    name = ""
+
+    def select(self, snapshot: TreeSnapshot, max_partners: int) -> Optional[int]:
+        raise NotImplementedError
+
+    def select_parent_id(self, snapshot: TreeSnapshot, max_partners: int) -> Optional[int]:
+        index = self.select(snapshot, max_partners)
+        return snapshot.user_ids[index] if index is not None else None
+
+
+class LeastFilledStrategy(PlacementStrategy):
+    """Узел с минимумом партнеров; при равенстве — созданный раньше, затем левее."""
+
+    name = "least_filled"
+
+    def select(self, snapshot, max_partners):
+        best_index = None
+        best_key = None
+        for index, count in enumerate(snapshot.child_counts):
+            if count >= max_partners:
+                continue
+            key = (count, snapshot.created[index])
+            if best_key is None or key < best_key:
+                best_index, best_key = index, key
+        return best_index
+
+
+class FirstFitStrategy(PlacementStrategy):
+    """Первый незаполненный узел при обходе в ширину."""
+
+    name = "first_fit"
+
+    def select(self, snapshot, max_partners):
+        for index, count in enumerate(snapshot.child_counts):
+            if count < max_partners:
+                return index
+        return None
+
+
+class LeftmostDeepestStrategy(PlacementStrategy):
+    """Самый левый незаполненный узел на наибольшей глубине."""
+
+    name = "leftmost_deepest"
+
+    def select(self, snapshot, max_partners):
+        best_index = None
+        for index, count in enumerate(snapshot.child_counts):
+            if count < max_partners and (
+                best_index is None or snapshot.levels[index] > snapshot.levels[best_index]
+            ):
+                best_index = index
+        return best_index
+
+
+PLACEMENT_STRATEGIES = {
+    strategy.name: strategy
+    for strategy in (LeastFilledStrategy, FirstFitStrategy, LeftmostDeepestStrategy)
+}
+
+
+def get_strategy(name: str) -> PlacementStrategy:
+    try:
+        return PLACEMENT_STRATEGIES[name]()
+    except KeyError:
+        raise ValueError(f"Unknown placement strategy: {name}") from None
@@ -0,0 +1,104 @@
+from typing import Iterable, Optional
+
+from django.db.models import Count, F
+
+from mlm.models import MLMOpenSlot, MLMStructure
+
+from .settings_cache import get_active_settings
+
+
+def get_max_partners() -> int:
+    """
+    Возвращает лимит партнеров на узел из активных настроек.
+    """
+    return get_active_settings().max_partners_per_level or 3
+
+
+def find_open_slot_user_id(prefix: str, max_partners: int) -> Optional[int]:
+    """
+    Выбирает родителя из фронта свободных позиций внутри поддерева.
+    Порядок совпадает с обходом: меньше партнеров, раньше создан, выше уровень.
+    """
+    return (
+        MLMOpenSlot.objects.filter(
+            path__startswith=prefix, children_count__lt=max_partners
+        )
+        .order_by("children_count", "created_at", "level")
+        .values_list("user_id", flat=True)
+        .first()
+    )
+
+
+def register_placement(structure: MLMStructure, max_partners: Optional[int] = None) -> None:
+    """
+    Добавляет новый узел во фронт и занимает позицию у его родителя.
+    """
+    max_partners = max_partners or get_max_partners()
+    children_count = MLMStructure.objects.filter(parent_id=structure.user_id).count()
+    if children_count < max_partners:
+        MLMOpenSlot.objects.update_or_create(
+            structure=structure,
+            defaults={
+                "user_id": structure.user_id,
+                "path": structure.path,
+                "level": structure.level,
+                "children_count": children_count,
+                "created_at": structure.created_at,
+            },
+        )
+
+    if structure.parent_id:
+        parent_slots = MLMOpenSlot.objects.filter(user_id=structure.parent_id)
+        parent_slots.update(children_count=F("children_count") + 1)
+        parent_slots.filter(children_count__gte=max_partners).delete()
+
+
+def sync_open_slots(
+    user_ids: Optional[Iterable[int]] = None, max_partners: Optional[int] = None
+) -> int:
+    """
+    Пересчитывает фронт для указанных пользователей (или целиком) по структуре.
+    """
+    max_partners = max_partners or get_max_partners()
+    structures = MLMStructure.objects.all()
+    slots = MLMOpenSlot.objects.all()
+    if user_ids is not None:
+        user_ids = [user_id for user_id in set(user_ids) if user_id]
+        structures = structures.filter(user_id__in=user_ids)
+        slots = slots.filter(user_id__in=user_ids)
+
+    children_counts = dict(
+        MLMStructure.objects.filter(parent_id__in=structures.values("user_id"))
+        .values("parent_id")
+        .annotate(total=Count("id"))
+        .values_list("parent_id", "total")
+    )
+
+    new_slots = []
+    for structure in structures.only("id", "user_id", "path", "level", "created_at"):
+        children_count = children_counts.get(structure.user_id, 0)
+        if children_count < max_partners:
+            new_slots.append(
+                MLMOpenSlot(
+                    structure_id=structure.id,
+                    user_id=structure.user_id,
+                    path=structure.path,
+                    level=structure.level,
+                    children_count=children_count,
+                    created_at=structure.created_at,
+                )
+            )
+
+    slots.delete()
+    MLMOpenSlot.objects.bulk_create(new_slots, batch_size=1000)
+    return len(new_slots)
+
+
+def sync_moved_subtree(structure: MLMStructure, *parent_ids: int) -> int:
+    """
+    Обновляет фронт после переноса ветки: сама ветка и затронутые родители.
+    """
+    subtree_ids = MLMStructure.objects.filter(
+        path__startswith=structure.path
+    ).values_list("user_id", flat=True)
+    return sync_open_slots([*subtree_ids, *parent_ids])
@@ -0,0 +1,209 @@
+"""
+Очередь задач завершения регистрации.
+Запрос лишь фиксирует платеж и ставит задачу; размещение и бонусы
+выполняются после коммита — в процессе (eager), в Celery или командой
+process_registration_jobs (deferred).
+
+Упавшая задача получает паузу next_attempt_at и повторяется очередным
+проходом process_pending_registration_jobs: в celery его запускает beat
+(CELERY_BEAT_SCHEDULE), в режимах eager и deferred — cron или воркер:
+    * * * * * python manage.py process_registration_jobs
+"""
+
+import logging
+from datetime import timedelta
+from functools import partial
+
+from django.conf import settings as django_settings
+from typing import Iterable, List
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from mlm.models import MLMStructure, Payment, RegistrationJob
+
+from .bonuses import calculate_bonuses, calculate_bonuses_batch
+from .placement import place_user_in_structure, place_users_in_structure
+
+logger = logging.getLogger(__name__)
+
+JOB_MODE_EAGER = "eager"
+JOB_MODE_CELERY = "celery"
+JOB_MODE_DEFERRED = "deferred"
+
+MAX_JOB_ATTEMPTS = 5
+# Пауза перед повтором: 30 с, 1 мин, 2 мин, ...
+JOB_RETRY_BACKOFF = timedelta(seconds=30)
+
+
+def get_job_mode() -> str:
+    return getattr(django_settings, "MLM_JOBS_MODE", JOB_MODE_EAGER)
+
+
+def enqueue_registration_completed(payment: Payment) -> RegistrationJob:
+    """
+    Ставит задачу для завершенного платежа. Ключ идемпотентности — сам платеж:
+    повторный вызов вернет существующую задачу и не продублирует бонусы.
+    """
+    job, _ = RegistrationJob.objects.get_or_create(payment=payment)
+    if job.status != "completed":
+        transaction.on_commit(partial(dispatch_registration_job, job.id))
+    return job
+
+
+def enqueue_registration_batch(payments: Iterable[Payment]) -> List[RegistrationJob]:
+    """
+    Пакетный вариант enqueue_registration_completed: задачи создаются одним
+    INSERT (существующие не дублируются), а после коммита обрабатываются пачкой.
+    """
+    payments = list(payments)
+    if not payments:
+        return []
+    RegistrationJob.objects.bulk_create(
+        [RegistrationJob(payment=payment) for payment in payments], ignore_conflicts=True
+    )
+    jobs = list(RegistrationJob.objects.filter(payment__in=payments).order_by("id"))
+    pending_ids = [job.id for job in jobs if job.status != "completed"]
+    if pending_ids:
+        transaction.on_commit(partial(dispatch_registration_jobs, pending_ids))
+    return jobs
+
+
+def dispatch_registration_jobs(job_ids: List[int]) -> None:
+    mode = get_job_mode()
+    if mode == JOB_MODE_CELERY:
+        from mlm.tasks import process_registration_jobs_batch_task
+
+        if process_registration_jobs_batch_task is not None:
+            process_registration_jobs_batch_task.delay(job_ids)
+        else:
+            logger.warning("Celery недоступен, %s задач ждут process_registration_jobs", len(job_ids))
+    elif mode == JOB_MODE_EAGER:
+        process_registration_jobs_batch(job_ids)
+
+
+def dispatch_registration_job(job_id: int) -> None:
+    mode = get_job_mode()
+    if mode == JOB_MODE_CELERY:
+        from mlm.tasks import process_registration_job_task
+
+        if process_registration_job_task is not None:
+            process_registration_job_task.delay(job_id)
+        else:
+            logger.warning("Celery недоступен, задача %s ждет process_registration_jobs", job_id)
+    elif mode == JOB_MODE_EAGER:
+        process_registration_job(job_id)
+
+
+def _complete_registration(payment: Payment) -> None:
+    user = payment.user
+    if (
+        payment.payment_type == "registration"
+        and user.invited_by_id
+        and not MLMStructure.objects.filter(user=user).exists()
+    ):
+        place_user_in_structure(user, user.invited_by)
+    calculate_bonuses(user, payment)
+
+
+def get_retry_delay(attempts: int) -> timedelta:
+    return JOB_RETRY_BACKOFF * 2 ** max(attempts - 1, 0)
+
+
+def process_registration_job(job_id: int) -> RegistrationJob:
+    """
+    Выполняет размещение и начисление бонусов по задаче.
+    Строка задачи блокируется, поэтому параллельные воркеры не обработают её дважды.
+    Ошибка не пробрасывается: задача помечается failed и повторяется после паузы.
+    Задача на паузе или исчерпавшая попытки не выполняется — повтор остается
+    за process_pending_registration_jobs.
+    """
+    with transaction.atomic():
+        job = (
+            RegistrationJob.objects.select_for_update()
+            .select_related("payment__user__invited_by")
+            .get(id=job_id)
+        )
+        if job.status == "completed" or job.attempts >= MAX_JOB_ATTEMPTS:
+            return job
+        if job.next_attempt_at and job.next_attempt_at > timezone.now():
+            return job
+
+        job.attempts += 1
+        try:
+            with transaction.atomic():
+                _complete_registration(job.payment)
+        except Exception as exc:
+            logger.exception("Задача завершения регистрации %s завершилась ошибкой", job_id)
+            job.status = "failed"
+            job.last_error = str(exc)
+            job.next_attempt_at = timezone.now() + get_retry_delay(job.attempts)
+        else:
+            job.status = "completed"
+            job.last_error = ""
+            job.processed_at = timezone.now()
+            job.next_attempt_at = None
+        job.save(update_fields=["status", "attempts", "last_error", "processed_at", "next_attempt_at"])
+    return job
+
+
+def process_registration_jobs_batch(job_ids: List[int]) -> int:
+    """
+    Обрабатывает пачку задач целиком: пакетное размещение и пакетные бонусы,
+    статусы — одним UPDATE. Если пакет падает, задачи проходят поштучно
+    через process_registration_job, чтобы ошибка досталась только своей задаче.
+    """
+    with transaction.atomic():
+        jobs = list(
+            RegistrationJob.objects.select_for_update()
+            .select_related("payment__user__invited_by")
+            .filter(id__in=job_ids)
+            .exclude(status="completed")
+            .order_by("id")
+        )
+        if not jobs:
+            return 0
+
+        payments = [job.payment for job in jobs]
+        registrations = [payment for payment in payments if payment.payment_type == "registration"]
+        try:
+            with transaction.atomic():
+                place_users_in_structure(
+                    payment.user for payment in registrations if payment.user.invited_by_id
+                )
+                # Пакет считает бонусы по порядку размещения — только для регистраций
+                calculate_bonuses_batch(registrations)
+                for payment in payments:
+                    if payment.payment_type != "registration":
+                        calculate_bonuses(payment.user, payment)
+        except Exception:
+            logger.exception("Пакет задач завершения регистрации не прошел, обрабатываем поштучно")
+            for job in jobs:
+                process_registration_job(job.id)
+        else:
+            RegistrationJob.objects.filter(id__in=[job.id for job in jobs]).update(
+                status="completed",
+                attempts=F("attempts") + 1,
+                last_error="",
+                processed_at=timezone.now(),
+                next_attempt_at=None,
+            )
+    return len(jobs)
+
+
+def process_pending_registration_jobs(limit: int = 100) -> int:
+    """
+    Обрабатывает ожидающие задачи и упавшие, у которых истекла пауза,
+    одной пачкой; возвращает число обработанных.
+    """
+    job_ids = list(
+        RegistrationJob.objects.filter(
+            Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=timezone.now()),
+            status__in=["pending", "failed"],
+            attempts__lt=MAX_JOB_ATTEMPTS,
+        ).order_by("id").values_list("id", flat=True)[:limit]
+    )
+    if not job_ids:
+        return 0
+    return process_registration_jobs_batch(job_ids)
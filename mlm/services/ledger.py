@@ -0,0 +1,252 @@
+"""
+Журнал проводок по балансам пользователей.
+Каждое движение средств — новая строка LedgerEntry; User.balance и
+User.total_earned меняются атомарным UPDATE через F(), поэтому параллельные
+начисления не теряют друг друга и чтение баланса остается O(1).
+"""
+
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import (
+    DecimalField,
+    F,
+    Max,
+    OuterRef,
+    Q,
+    Subquery,
+    Sum,
+    Value,
+)
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from mlm.models import BalanceSnapshot, LedgerEntry
+from users.models import User
+
+ZERO = Decimal("0.00")
+# Сколько секунд проводка должна пролежать, чтобы попасть в снимок
+DEFAULT_SNAPSHOT_LAG = 300
+
+
+class InsufficientBalance(ValueError):
+    """На балансе недостаточно средств для списания."""
+
+
+def _signed_sum(prefix: str = ""):
+    """Сумма проводок со знаком: зачисления минус списания."""
+    output = DecimalField(max_digits=14, decimal_places=2)
+    credits = Coalesce(
+        Sum(f"{prefix}amount", filter=Q(**{f"{prefix}entry_type": "credit"})),
+        Value(ZERO),
+        output_field=output,
+    )
+    debits = Coalesce(
+        Sum(f"{prefix}amount", filter=Q(**{f"{prefix}entry_type": "debit"})),
+        Value(ZERO),
+        output_field=output,
+    )
+    return credits - debits
+
+
+def _to_amount(amount) -> Decimal:
+    amount = Decimal(str(amount)).quantize(Decimal("0.01"))
+    if amount <= 0:
+        raise ValueError("Сумма проводки должна быть больше 0")
+    return amount
+
+
+def post_credit(
+    user: User,
+    amount,
+    reason: str,
+    *,
+    bonus=None,
+    payment=None,
+    withdrawal=None,
+    description: str = "",
+    earned: bool = True,
+) -> LedgerEntry:
+    """
+    Зачисляет сумму на баланс. При earned=True растет и total_earned
+    (бонусы), возвраты и корректировки передают earned=False.
+    """
+    amount = _to_amount(amount)
+    updates = {"balance": F("balance") + amount}
+    if earned:
+        updates["total_earned"] = F("total_earned") + amount
+
+    with transaction.atomic():
+        entry = LedgerEntry.objects.create(
+            user=user,
+            entry_type="credit",
+            reason=reason,
+            amount=amount,
+            bonus=bonus,
+            payment=payment,
+            withdrawal=withdrawal,
+            description=description,
+        )
+        User.objects.filter(pk=user.pk).update(**updates)
+    return entry
+
+
+def post_bulk_credits(entries: Iterable[LedgerEntry], *, earned: bool = True) -> List[LedgerEntry]:
+    """
+    Пакетное зачисление: проводки пишутся одним bulk_create, а балансы —
+    одним UPDATE на каждую различную итоговую сумму (получатели с равной
+    суммой обновляются вместе). Число запросов не зависит от числа проводок.
+    """
+    entries = list(entries)
+    totals = defaultdict(Decimal)
+    for entry in entries:
+        entry.entry_type = "credit"
+        entry.amount = _to_amount(entry.amount)
+        totals[entry.user_id] += entry.amount
+    if not entries:
+        return entries
+
+    users_by_total = defaultdict(list)
+    for user_id, total in totals.items():
+        users_by_total[total].append(user_id)
+
+    with transaction.atomic():
+        # Время проводки — момент вставки: по нему снимки выбирают границу окна
+        created_at = timezone.now()
+        for entry in entries:
+            entry.created_at = created_at
+        LedgerEntry.objects.bulk_create(entries, batch_size=1000)
+        for total, user_ids in users_by_total.items():
+            updates = {"balance": F("balance") + total}
+            if earned:
+                updates["total_earned"] = F("total_earned") + total
+            User.objects.filter(pk__in=user_ids).update(**updates)
+    return entries
+
+
+def post_debit(
+    user: User,
+    amount,
+    reason: str,
+    *,
+    bonus=None,
+    payment=None,
+    withdrawal=None,
+    description: str = "",
+    allow_negative: bool = False,
+) -> LedgerEntry:
+    """
+    Списывает сумму с баланса. Проверка остатка входит в условие UPDATE,
+    поэтому два параллельных списания не уведут баланс в минус.
+    """
+    amount = _to_amount(amount)
+
+    with transaction.atomic():
+        users = User.objects.filter(pk=user.pk)
+        if not allow_negative:
+            users = users.filter(balance__gte=amount)
+        if not users.update(balance=F("balance") - amount):
+            raise InsufficientBalance("Недостаточно средств на балансе")
+
+        return LedgerEntry.objects.create(
+            user=user,
+            entry_type="debit",
+            reason=reason,
+            amount=amount,
+            bonus=bonus,
+            payment=payment,
+            withdrawal=withdrawal,
+            description=description,
+        )
+
+
+def get_ledger_balance(user: User) -> Decimal:
+    """
+    Остаток пользователя по журналу: последний снимок плюс хвост проводок после него.
+    """
+    snapshot = (
+        BalanceSnapshot.objects.filter(user=user)
+        .order_by("-last_entry_id")
+        .values_list("balance", "last_entry_id")
+        .first()
+    )
+    balance, last_entry_id = snapshot or (ZERO, 0)
+    tail = LedgerEntry.objects.filter(user=user, id__gt=last_entry_id).aggregate(
+        total=_signed_sum()
+    )["total"]
+    return balance + tail
+
+
+def take_balance_snapshots(lag: Optional[timedelta] = None) -> int:
+    """
+    Фиксирует остатки пользователей, у которых были проводки после
+    предыдущего снимка. Окно агрегируется одним GROUP BY, предыдущий
+    снимок подтягивается подзапросом. Возвращает число созданных снимков.
+
+    Верхняя граница окна отстает от текущего момента на lag
+    (LEDGER_SNAPSHOT_LAG, по умолчанию 300 с): id проводки выдается при
+    вставке, а фиксируется она при коммите, поэтому проводка с меньшим id
+    может стать видимой позже соседей. Граница берется по последней
+    проводке старше lag — все проводки до нее уже закоммичены, если
+    транзакции короче lag, и ни одна не окажется ниже водяного знака.
+    """
+    if lag is None:
+        lag = timedelta(seconds=getattr(settings, "LEDGER_SNAPSHOT_LAG", DEFAULT_SNAPSHOT_LAG))
+    watermark = BalanceSnapshot.objects.aggregate(last=Max("last_entry_id"))["last"] or 0
+    upper = (
+        LedgerEntry.objects.filter(created_at__lte=timezone.now() - lag)
+        .order_by("-id")
+        .values_list("id", flat=True)
+        .first()
+    )
+    if not upper or upper <= watermark:
+        return 0
+
+    previous = (
+        BalanceSnapshot.objects.filter(user=OuterRef("user_id"))
+        .order_by("-last_entry_id")
+        .values("balance")[:1]
+    )
+    window = (
+        LedgerEntry.objects.filter(id__gt=watermark, id__lte=upper)
+        .order_by()
+        .values("user_id")
+        .annotate(delta=_signed_sum(), previous=Subquery(previous))
+    )
+
+    snapshots = [
+        BalanceSnapshot(
+            user_id=row["user_id"],
+            balance=(row["previous"] or ZERO) + row["delta"],
+            last_entry_id=upper,
+        )
+        for row in window.iterator()
+    ]
+    BalanceSnapshot.objects.bulk_create(snapshots, batch_size=1000)
+    return len(snapshots)
+
+
+def verify_balances() -> List[Dict]:
+    """
+    Сверяет User.balance с суммой проводок журнала.
+    Возвращает список расхождений (пустой — балансы сходятся).
+    """
+    rows = (
+        User.objects.annotate(ledger_balance=_signed_sum("ledger_entries__"))
+        .exclude(balance=F("ledger_balance"))
+        .values("id", "username", "balance", "ledger_balance")
+    )
+    return [
+        {
+            "user_id": row["id"],
+            "username": row["username"],
+            "balance": row["balance"],
+            "ledger_balance": row["ledger_balance"],
+        }
+        for row in rows
+    ]
+
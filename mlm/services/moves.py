@@ -0,0 +1,94 @@
+from typing import Optional
+
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Concat, Substr
+
+from mlm.models import MLMOpenSlot, MLMStructure
+from users.models import User
+
+from .counters import apply_subtree_move
+from .frontier import sync_open_slots
+from .placement import get_next_position
+from .structure_version import invalidate_structure_snapshots
+
+
+class StructureMoveError(ValueError):
+    """Перенос нарушил бы структуру (цикл, перенос под самого себя или к заполненному родителю)."""
+
+
+def _shift_subtree(model, old_prefix: str, new_prefix: str, level_delta: int) -> int:
+    """
+    Одним UPDATE меняет префикс пути и сдвигает уровни всех узлов ветки.
+    """
+    return model.objects.filter(path__startswith=old_prefix).update(
+        path=Concat(Value(new_prefix), Substr(F("path"), len(old_prefix) + 1)),
+        level=F("level") + level_delta,
+    )
+
+
+def _normalize_positions(parent_id: int) -> None:
+    """
+    Приводит позиции партнеров к последовательному виду (не больше max_partners строк).
+    """
+    siblings = MLMStructure.objects.filter(parent_id=parent_id).order_by("position", "created_at")
+    for index, sibling in enumerate(siblings, start=1):
+        if sibling.position != index:
+            MLMStructure.objects.filter(pk=sibling.pk).update(position=index)
+
+
+def move_subtree(structure: MLMStructure, new_parent: Optional[User]) -> MLMStructure:
+    """
+    Переносит узел со всем поддеревом под нового родителя (None — в корень).
+    Число запросов не зависит от размера ветки: путь и уровни поддерева
+    переписываются одним UPDATE по префиксу пути, а проверка на цикл —
+    это выборка узла нового родителя, путь которого не должен начинаться
+    с пути переносимого узла. Родитель блокируется, и перенос к родителю
+    с max_partners_per_level партнерами отклоняется.
+    """
+    with transaction.atomic():
+        structure = MLMStructure.objects.select_for_update().get(pk=structure.pk)
+        old_parent_id = structure.parent_id
+        old_path = structure.path or structure.build_path()
+
+        if new_parent is not None:
+            if new_parent.id == structure.user_id:
+                raise StructureMoveError("Нельзя разместить пользователя под самим собой")
+            parent_node = (
+                MLMStructure.objects.select_for_update()
+                .filter(user=new_parent)
+                .values("path", "level")
+                .first()
+            )
+            if parent_node and parent_node["path"].startswith(old_path):
+                raise StructureMoveError("Нельзя разместить пользователя внутри его собственной ветки")
+            if parent_node is None:
+                # У родителя нет узла — сериализуем по строке пользователя.
+                User.objects.select_for_update().filter(id=new_parent.id).exists()
+            new_position = get_next_position(new_parent, exclude=structure)
+            if new_position is None:
+                raise StructureMoveError("У нового родителя заняты все позиции")
+            parent_path = parent_node["path"] if parent_node else MLMStructure.path_segment(new_parent.id)
+            new_path = parent_path + MLMStructure.path_segment(structure.user_id)
+            new_level = (parent_node["level"] + 1) if parent_node else 1
+        else:
+            new_path = MLMStructure.path_segment(structure.user_id)
+            new_level = 0
+            new_position = 0
+
+        MLMStructure.objects.filter(pk=structure.pk).update(
+            parent=new_parent, position=new_position
+        )
+        level_delta = new_level - structure.level
+        _shift_subtree(MLMStructure, old_path, new_path, level_delta)
+        _shift_subtree(MLMOpenSlot, old_path, new_path, level_delta)
+
+        parent_ids = [parent_id for parent_id in {old_parent_id, new_parent and new_parent.id} if parent_id]
+        for parent_id in parent_ids:
+            _normalize_positions(parent_id)
+        sync_open_slots(parent_ids)
+
+        structure.refresh_from_db()
+        apply_subtree_move(structure, old_path)
+        invalidate_structure_snapshots()
+    return structure
@@ -0,0 +1,210 @@
+"""
+Пакетные выплаты по запросам на вывод.
+Пакет формируется одним UPDATE по фильтру: ожидающие выводы получают
+ссылку на пакет и статус processing, поэтому параллельная ручная обработка
+их уже не возьмет. Одобрение и отклонение пакета — тоже общие UPDATE,
+возвраты пишутся пачками через post_bulk_credits. Файл выплат отдается
+потоково: строки читаются через iterator() и сразу сериализуются.
+"""
+
+import csv
+import json
+from decimal import Decimal
+from typing import Iterator, List, Mapping, Optional
+
+from django.db import transaction
+from django.db.models import Count, DecimalField, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from mlm.models import LedgerEntry, PayoutBatch, Withdrawal
+
+from .ledger import post_bulk_credits
+
+PAYOUT_CHUNK_SIZE = 1000
+PAYOUT_FORMATS = ("csv", "jsonl")
+PAYOUT_COLUMNS = (
+    "withdrawal_id",
+    "user_id",
+    "username",
+    "email",
+    "amount",
+    "payment_method",
+    "payment_details",
+    "created_at",
+)
+
+ZERO = Decimal("0.00")
+
+
+class PayoutBatchError(ValueError):
+    """Пакет уже обработан или операция с ним невозможна."""
+
+
+def filter_pending_withdrawals(filters: Mapping):
+    """
+    Ожидающие выводы без пакета, отобранные по фильтру:
+    payment_method, min_amount, max_amount, created_before, created_after, user_ids.
+    """
+    withdrawals = Withdrawal.objects.filter(status="pending", payout_batch__isnull=True)
+    if filters.get("payment_method"):
+        withdrawals = withdrawals.filter(payment_method=filters["payment_method"])
+    if filters.get("min_amount") is not None:
+        withdrawals = withdrawals.filter(amount__gte=Decimal(str(filters["min_amount"])))
+    if filters.get("max_amount") is not None:
+        withdrawals = withdrawals.filter(amount__lte=Decimal(str(filters["max_amount"])))
+    if filters.get("created_after"):
+        withdrawals = withdrawals.filter(created_at__gte=filters["created_after"])
+    if filters.get("created_before"):
+        withdrawals = withdrawals.filter(created_at__lt=filters["created_before"])
+    if filters.get("user_ids"):
+        withdrawals = withdrawals.filter(user_id__in=list(filters["user_ids"]))
+    return withdrawals
+
+
+def _json_value(value):
+    if isinstance(value, (list, tuple, set)):
+        return list(value)
+    return value if isinstance(value, (int, str)) else str(value)
+
+
+def _batch_totals(batch: PayoutBatch) -> Mapping:
+    return batch.withdrawals.aggregate(
+        count=Count("id"),
+        total=Coalesce(
+            Sum("amount"), Value(ZERO), output_field=DecimalField(max_digits=14, decimal_places=2)
+        ),
+    )
+
+
+def create_payout_batch(filters: Optional[Mapping] = None, created_by=None) -> PayoutBatch:
+    """
+    Создает пакет из ожидающих выводов по фильтру. Отбор и перевод в
+    processing — один UPDATE: повторная проверка status='pending' в нем
+    не дает взять вывод, который параллельно обработали вручную.
+    """
+    filters = dict(filters or {})
+    with transaction.atomic():
+        batch = PayoutBatch.objects.create(
+            created_by=created_by,
+            filters={key: _json_value(value) for key, value in filters.items() if value not in (None, "")},
+        )
+        filter_pending_withdrawals(filters).update(payout_batch=batch, status="processing")
+
+        totals = _batch_totals(batch)
+        batch.withdrawals_count = totals["count"]
+        batch.total_amount = totals["total"]
+        batch.save(update_fields=["withdrawals_count", "total_amount"])
+    return batch
+
+
+def _lock_open_batch(batch_id: int) -> PayoutBatch:
+    batch = PayoutBatch.objects.select_for_update().get(pk=batch_id)
+    if batch.status != "open":
+        raise PayoutBatchError(f"Пакет #{batch.id} уже обработан ({batch.get_status_display()})")
+    return batch
+
+
+def approve_payout_batch(batch: PayoutBatch, processed_by=None) -> int:
+    """Отмечает все выводы пакета выплаченными одним UPDATE. Возвращает их число."""
+    now = timezone.now()
+    with transaction.atomic():
+        batch = _lock_open_batch(batch.pk)
+        updated = batch.withdrawals.filter(status="processing").update(
+            status="completed", processed_at=now, processed_by=processed_by
+        )
+        batch.status = "completed"
+        batch.processed_by = processed_by
+        batch.processed_at = now
+        batch.save(update_fields=["status", "processed_by", "processed_at"])
+    return updated
+
+
+def reject_payout_batch(batch: PayoutBatch, processed_by=None, admin_notes: str = "") -> int:
+    """
+    Отклоняет выводы пакета и возвращает средства на балансы.
+    Проводки по возвратам создаются пачками по PAYOUT_CHUNK_SIZE,
+    балансы сдвигаются одним UPDATE на каждую различную сумму.
+    """
+    now = timezone.now()
+    rejected = 0
+    with transaction.atomic():
+        batch = _lock_open_batch(batch.pk)
+        rows = (
+            batch.withdrawals.filter(status="processing")
+            .order_by("id")
+            .values_list("id", "user_id", "amount")
+            .iterator(chunk_size=PAYOUT_CHUNK_SIZE)
+        )
+        chunk: List[LedgerEntry] = []
+        for withdrawal_id, user_id, amount in rows:
+            chunk.append(
+                LedgerEntry(
+                    user_id=user_id,
+                    reason="withdrawal_refund",
+                    amount=amount,
+                    withdrawal_id=withdrawal_id,
+                    description=f"Возврат по отклоненному выводу #{withdrawal_id} (пакет #{batch.id})",
+                )
+            )
+            if len(chunk) >= PAYOUT_CHUNK_SIZE:
+                rejected += len(post_bulk_credits(chunk, earned=False))
+                chunk = []
+        if chunk:
+            rejected += len(post_bulk_credits(chunk, earned=False))
+
+        batch.withdrawals.filter(status="processing").update(
+            status="rejected", processed_at=now, processed_by=processed_by, admin_notes=admin_notes
+        )
+        batch.status = "rejected"
+        batch.processed_by = processed_by
+        batch.processed_at = now
+        batch.admin_notes = admin_notes
+        batch.save(update_fields=["status", "processed_by", "processed_at", "admin_notes"])
+    return rejected
+
+
+class _Echo:
+    """Псевдобуфер для csv.writer: возвращает строку вместо записи."""
+
+    def write(self, value):
+        return value
+
+
+def iter_payout_rows(batch: PayoutBatch) -> Iterator[tuple]:
+    """Строки файла выплат в порядке id без загрузки пакета в память."""
+    return (
+        batch.withdrawals.exclude(status="rejected")
+        .order_by("id")
+        .values_list(
+            "id",
+            "user_id",
+            "user__username",
+            "user__email",
+            "amount",
+            "payment_method",
+            "payment_details",
+            "created_at",
+        )
+        .iterator(chunk_size=PAYOUT_CHUNK_SIZE)
+    )
+
+
+def stream_payout_file(batch: PayoutBatch, fmt: str = "csv") -> Iterator[str]:
+    """Генератор строк файла выплат для платежного провайдера (CSV или JSON lines)."""
+    if fmt not in PAYOUT_FORMATS:
+        raise ValueError(f"Неизвестный формат файла выплат: {fmt}")
+
+    if fmt == "csv":
+        writer = csv.writer(_Echo())
+        yield writer.writerow(PAYOUT_COLUMNS)
+        for row in iter_payout_rows(batch):
+            yield writer.writerow([*row[:-1], row[-1].isoformat()])
+        return
+
+    for row in iter_payout_rows(batch):
+        record = dict(zip(PAYOUT_COLUMNS, row))
+        record["amount"] = str(record["amount"])
+        record["created_at"] = record["created_at"].isoformat()
+        yield json.dumps(record, ensure_ascii=False) + "\n"
+
@@ -1,132 +1,385 @@
-from collections import deque
-from decimal import Decimal
-from typing import Optional
+import heapq
+import random
+import time
+from collections import defaultdict, deque
+from datetime import timedelta
+from typing import Iterable, List, Optional
 
-from django.db import transaction
+from django.conf import settings as django_settings
+from django.db import IntegrityError, OperationalError, transaction
+from django.db.models import Q
 from django.utils import timezone
 
-from mlm.models import MLMSettings, MLMStructure
+from mlm.models import MLMStructure
 from users.models import User
 
+from .ancestry import get_subtree_prefix, get_subtree_queryset
+from .counters import register_bulk_counters
+from .engine import LeastFilledStrategy, PlacementStrategy, TreeSnapshot, get_strategy
+from .frontier import find_open_slot_user_id, sync_open_slots
+from .settings_cache import get_active_settings
+from .structure_version import invalidate_structure_snapshots
 
-def _get_active_settings() -> MLMSettings:
+PLACEMENT_ATTEMPTS = 5
+PLACEMENT_RETRY_DELAY = 0.05
+
+
+class PlacementConflict(Exception):
+    """Выбранный родитель заполнен параллельным размещением."""
+
+    def __init__(self, parent_id: int):
+        super().__init__(f"Parent {parent_id} is already full")
+        self.parent_id = parent_id
+
+
+def get_placement_strategy() -> PlacementStrategy:
     """
-    Возвращает активные настройки MLM либо создает значения по умолчанию.
+    Возвращает стратегию размещения из настроек проекта (по умолчанию least_filled).
     """
-    settings = MLMSettings.objects.filter(is_active=True).first()
-    if not settings:
-        settings = MLMSettings.objects.create(
-            registration_fee=Decimal("100.00"),
-            green_bonus_first=Decimal("100.00"),
-            green_bonus_second=Decimal("50.00"),
-            red_bonus_second_partner=Decimal("50.00"),
-            red_bonus_third_partner=Decimal("100.00"),
-            max_partners_per_level=3,
-            is_active=True,
-        )
-    return settings
+    return get_strategy(getattr(django_settings, "MLM_PLACEMENT_STRATEGY", LeastFilledStrategy.name))
+
+
+def load_subtree_snapshot(start_user: User) -> TreeSnapshot:
+    """
+    Загружает поддерево пользователя одним запросом по материализованному пути.
+    """
+    rows = (
+        get_subtree_queryset(start_user, include_self=True)
+        .order_by("position", "created_at")
+        .values_list("user_id", "parent_id", "created_at")
+    )
+    return TreeSnapshot.build(start_user.id, rows)
 
 
 def find_placement_parent(start_user: User) -> Optional[User]:
     """
-    Поиск лучшего родителя для нового пользователя.
-    Стратегия: обходим структуру в ширину, выбираем кандидата с минимальным
-    количеством партнеров, сохраняя очередность слева направо.
+    Поиск лучшего родителя для нового пользователя по стратегии из настроек.
+    Для least_filled сначала используется фронт свободных позиций.
     """
-    settings = _get_active_settings()
+    settings = get_active_settings()
     max_partners = settings.max_partners_per_level or 3
 
     # Если у пригласителя ещё нет структуры — он становится корнем.
     if not hasattr(start_user, "mlm_structure"):
         return start_user
 
-    visited = set()
-    queue = deque([start_user])
-    best_candidate = None
-    best_children_count = None
-
-    while queue:
-        current_user = queue.popleft()
-        if current_user.id in visited:
-            continue
-        visited.add(current_user.id)
-
-        # Получаем структуру текущего пользователя, пропускаем если её нет.
-        try:
-            current_structure = current_user.mlm_structure
-        except MLMStructure.DoesNotExist:
-            continue
-
-        children_qs = (
-            MLMStructure.objects.filter(parent=current_user)
-            .select_related("user")
-            .order_by("position", "created_at")
-        )
-        children_count = children_qs.count()
-
-        if children_count < max_partners:
-            if (
-                best_candidate is None
-                or children_count < best_children_count
-                or (
-                    children_count == best_children_count
-                    and current_structure.created_at < best_candidate.mlm_structure.created_at
-                )
-            ):
-                best_candidate = current_user
-                best_children_count = children_count
-
-        # Добавляем детей в очередь для обхода следующего уровня.
-        for child_structure in children_qs:
-            queue.append(child_structure.user)
+    strategy = get_placement_strategy()
+    parent_id = None
+    if isinstance(strategy, LeastFilledStrategy):
+        parent_id = find_open_slot_user_id(get_subtree_prefix(start_user), max_partners)
+    if parent_id is None:
+        # Фронт не подходит стратегии или ещё не заполнен — считаем по снимку.
+        parent_id = strategy.select_parent_id(load_subtree_snapshot(start_user), max_partners)
 
-    return best_candidate or start_user
+    if parent_id is None or parent_id == start_user.id:
+        return start_user
+    return User.objects.get(id=parent_id)
 
 
 # Обратная совместимость со старым названием.
 find_placement_position = find_placement_parent
 
 
-def get_next_position(parent_user: User) -> int:
+def get_next_position(parent_user: User, exclude: Optional[MLMStructure] = None) -> Optional[int]:
     """
-    Возвращает следующую позицию (1..max_partners) для дочернего элемента.
+    Возвращает следующую позицию (1..max_partners) для дочернего элемента
+    или None, если все позиции родителя заняты. exclude — узел, который
+    не считается (переносимый под того же родителя).
     """
-    settings = _get_active_settings()
+    settings = get_active_settings()
     max_partners = settings.max_partners_per_level or 3
-    existing_positions = set(
-        MLMStructure.objects.filter(parent=parent_user).values_list("position", flat=True)
+    children = MLMStructure.objects.filter(parent=parent_user)
+    if exclude is not None:
+        children = children.exclude(pk=exclude.pk)
+    existing_positions = list(children.values_list("position", flat=True))
+    if len(existing_positions) >= max_partners:
+        return None
+    return _next_free_position(set(existing_positions), max_partners)
+
+
+def _lock_parent(parent_user: User) -> Optional[MLMStructure]:
+    """
+    Блокирует строку родителя до конца транзакции и возвращает его узел.
+    """
+    parent_structure = (
+        MLMStructure.objects.select_for_update().filter(user=parent_user).first()
     )
+    if parent_structure is None:
+        # У родителя нет узла — сериализуем размещения по строке пользователя.
+        User.objects.select_for_update().filter(id=parent_user.id).exists()
+    return parent_structure
 
-    for position in range(1, max_partners + 1):
-        if position not in existing_positions:
-            return position
 
-    return max(1, max_partners)
+def _place_locked(new_user: User, inviter: User) -> MLMStructure:
+    parent_user = find_placement_parent(inviter) or inviter
+    parent_structure = _lock_parent(parent_user)
+
+    settings = get_active_settings()
+    max_partners = settings.max_partners_per_level or 3
+    occupied = set(
+        MLMStructure.objects.filter(parent=parent_user).values_list("position", flat=True)
+    )
+    if parent_structure and len(occupied) >= max_partners:
+        # Пока ждали блокировку, родителя заполнил параллельный запрос.
+        raise PlacementConflict(parent_user.id)
+
+    return MLMStructure.objects.create(
+        user=new_user,
+        parent=parent_user,
+        position=_next_free_position(occupied, max_partners),
+        level=(parent_structure.level + 1) if parent_structure else 1,
+        created_at=timezone.now(),
+    )
 
 
 def place_user_in_structure(new_user: User, inviter: Optional[User]) -> MLMStructure:
     """
     Размещает нового пользователя в структуре согласно правилам spillover.
+    Родитель блокируется на время вставки; при конфликте с параллельным
+    размещением выбор родителя повторяется.
     """
     if not inviter:
         raise ValueError("Inviter is required for structure placement")
 
-    with transaction.atomic():
-        parent_user = find_placement_parent(inviter) or inviter
-
+    for attempt in range(1, PLACEMENT_ATTEMPTS + 1):
         try:
-            parent_structure = parent_user.mlm_structure
-        except MLMStructure.DoesNotExist:
-            parent_structure = None
-
-        level = (parent_structure.level + 1) if parent_structure else 1
-
-        placement = MLMStructure.objects.create(
-            user=new_user,
-            parent=parent_user,
-            position=get_next_position(parent_user),
-            level=level,
-            created_at=timezone.now(),
+            with transaction.atomic():
+                return _place_locked(new_user, inviter)
+        except (PlacementConflict, IntegrityError, OperationalError) as exc:
+            if attempt == PLACEMENT_ATTEMPTS or MLMStructure.objects.filter(user=new_user).exists():
+                raise
+            if isinstance(exc, PlacementConflict):
+                # Фронт мог отстать от структуры — сверяем запись родителя.
+                sync_open_slots([exc.parent_id])
+            time.sleep(random.uniform(0, PLACEMENT_RETRY_DELAY * attempt))
+
+
+def _next_free_position(occupied: set, max_partners: int) -> int:
+    for position in range(1, max_partners + 1):
+        if position not in occupied:
+            return position
+    # Переполнение возможно только у родителя без собственного узла.
+    return max(occupied, default=0) + 1
+
+
+def _inviter_first(users: List[User]) -> List[User]:
+    """
+    Устойчивая топологическая сортировка пакета: участник откладывается,
+    только если его пригласитель стоит в пакете дальше, и выходит сразу
+    после пригласителя. Список, где пригласители уже идут раньше (например,
+    очередь в порядке регистрации), не меняется.
+    """
+    batch_ids = {user.id for user in users}
+    emitted = set()
+    waiting = defaultdict(list)
+    ordered = []
+    for user in users:
+        inviter_id = user.invited_by_id
+        if inviter_id in batch_ids and inviter_id != user.id and inviter_id not in emitted:
+            waiting[inviter_id].append(user)
+            continue
+        release = deque([user])
+        while release:
+            current = release.popleft()
+            ordered.append(current)
+            emitted.add(current.id)
+            release.extend(waiting.pop(current.id, ()))
+    # Цикл приглашений — только при испорченных данных; такие идут в конце.
+    for users_left in waiting.values():
+        ordered.extend(users_left)
+    return ordered
+
+
+def _plan_batch(pending: List[User], max_partners: int) -> List[MLMStructure]:
+    """
+    Рассчитывает узлы пакета в памяти по правилам least_filled: поддеревья
+    пригласителей читаются одним запросом, для каждого пригласителя ведется
+    куча узлов со свободными позициями.
+    """
+    inviter_ids = {user.invited_by_id for user in pending}
+    inviter_paths = dict(
+        MLMStructure.objects.filter(user_id__in=inviter_ids).values_list("user_id", "path")
+    )
+    prefixes = {
+        inviter_paths.get(inviter_id) or MLMStructure.path_segment(inviter_id)
+        for inviter_id in inviter_ids
+    }
+    subtree_filter = Q()
+    for prefix in prefixes:
+        subtree_filter |= Q(path__startswith=prefix)
+
+    nodes = {}
+    positions = defaultdict(set)
+    for user_id, parent_id, path, level, position, created_at in MLMStructure.objects.filter(
+        subtree_filter
+    ).values_list("user_id", "parent_id", "path", "level", "position", "created_at"):
+        nodes[user_id] = {"path": path, "level": level, "created_at": created_at}
+        if parent_id:
+            positions[parent_id].add(position)
+
+    def _sort_key(user_id):
+        node = nodes[user_id]
+        return (len(positions[user_id]), node["created_at"], node["level"], user_id)
+
+    # Куча узлов со свободными позициями для каждого пригласителя-владельца ветки.
+    heaps = {}
+
+    def _heap_for(inviter_id):
+        if inviter_id not in heaps:
+            prefix = nodes[inviter_id]["path"]
+            heap = [
+                _sort_key(user_id)
+                for user_id, node in nodes.items()
+                if node["path"].startswith(prefix) and len(positions[user_id]) < max_partners
+            ]
+            heapq.heapify(heap)
+            heaps[inviter_id] = heap
+        return heaps[inviter_id]
+
+    def _push(user_id):
+        if len(positions[user_id]) >= max_partners:
+            return
+        key = _sort_key(user_id)
+        # Узел входит в кучи тех пригласителей, что лежат на его пути.
+        for part in nodes[user_id]["path"].split(MLMStructure.PATH_SEPARATOR):
+            heap = heaps.get(int(part)) if part else None
+            if heap is not None:
+                heapq.heappush(heap, key)
+
+    def _pick_parent(inviter_id):
+        if inviter_id not in nodes:
+            return inviter_id
+        heap = _heap_for(inviter_id)
+        while heap:
+            children_count, _, _, user_id = heap[0]
+            # Ключи с устаревшим числом партнеров отбрасываем лениво.
+            if children_count == len(positions[user_id]) and children_count < max_partners:
+                return user_id
+            heapq.heappop(heap)
+        return inviter_id
+
+    started_at = timezone.now()
+    placements = []
+    for index, user in enumerate(pending):
+        parent_id = _pick_parent(user.invited_by_id)
+        parent_node = nodes.get(parent_id)
+        parent_path = parent_node["path"] if parent_node else MLMStructure.path_segment(parent_id)
+        position = _next_free_position(positions[parent_id], max_partners)
+        placement = MLMStructure(
+            user=user,
+            parent_id=parent_id,
+            position=position,
+            level=(parent_node["level"] + 1) if parent_node else 1,
+            path=parent_path + MLMStructure.path_segment(user.id),
+            created_at=started_at + timedelta(microseconds=index),
         )
+        placements.append(placement)
+
+        positions[parent_id].add(position)
+        nodes[user.id] = {
+            "path": placement.path,
+            "level": placement.level,
+            "created_at": placement.created_at,
+        }
+        if parent_node:
+            _push(parent_id)
+        _push(user.id)
+    return placements
 
-        return placement
+
+def _lock_batch_parents(placements: List[MLMStructure], max_partners: int) -> None:
+    """
+    Блокирует выбранных родителей (в порядке id, чтобы не ловить взаимных
+    блокировок) и сверяет их занятость с расчетом. Если параллельное
+    размещение успело занять позицию, бросает PlacementConflict.
+    """
+    parent_ids = sorted({placement.parent_id for placement in placements})
+    with_nodes = set(
+        MLMStructure.objects.select_for_update()
+        .filter(user_id__in=parent_ids)
+        .order_by("user_id")
+        .values_list("user_id", flat=True)
+    )
+    # Родители без узла сериализуются по строке пользователя, как в _lock_parent.
+    nodeless = [parent_id for parent_id in parent_ids if parent_id not in with_nodes]
+    if nodeless:
+        list(User.objects.select_for_update().filter(id__in=nodeless).order_by("id").values_list("id"))
+
+    occupied = defaultdict(set)
+    for parent_id, position in MLMStructure.objects.filter(parent_id__in=parent_ids).values_list(
+        "parent_id", "position"
+    ):
+        occupied[parent_id].add(position)
+    planned = defaultdict(int)
+    for placement in placements:
+        planned[placement.parent_id] += 1
+        if placement.position in occupied[placement.parent_id]:
+            raise PlacementConflict(placement.parent_id)
+    for parent_id in with_nodes:
+        if len(occupied[parent_id]) + planned[parent_id] > max_partners:
+            raise PlacementConflict(parent_id)
+
+
+def place_users_in_structure(users: Iterable[User]) -> List[MLMStructure]:
+    """
+    Пакетно размещает пользователей (по их пригласителям) в порядке списка;
+    пригласитель из того же пакета размещается раньше своих приглашенных.
+    Поддеревья пригласителей загружаются один раз, размещение считается в
+    памяти по тем же правилам, что и place_user_in_structure, затем
+    выбранные родители блокируются и сверяются, а узлы записываются одним
+    bulk_create. При конфликте с параллельным размещением расчет
+    повторяется. Уже размещенные пользователи пропускаются.
+    """
+    users = list(users)
+    if any(not user.invited_by_id for user in users):
+        raise ValueError("Inviter is required for structure placement")
+
+    settings = get_active_settings()
+    max_partners = settings.max_partners_per_level or 3
+    users = _inviter_first(users)
+
+    if not isinstance(get_placement_strategy(), LeastFilledStrategy):
+        # Пакетный расчет в памяти реализует только least_filled.
+        with transaction.atomic():
+            placed_ids = set(
+                MLMStructure.objects.filter(user__in=users).values_list("user_id", flat=True)
+            )
+            return [
+                place_user_in_structure(user, user.invited_by)
+                for user in users
+                if user.id not in placed_ids
+            ]
+
+    for attempt in range(1, PLACEMENT_ATTEMPTS + 1):
+        try:
+            with transaction.atomic():
+                placed_ids = set(
+                    MLMStructure.objects.filter(user__in=users).values_list("user_id", flat=True)
+                )
+                pending = []
+                for user in users:
+                    if user.id not in placed_ids:
+                        placed_ids.add(user.id)
+                        pending.append(user)
+                if not pending:
+                    return []
+
+                placements = _plan_batch(pending, max_partners)
+                _lock_batch_parents(placements, max_partners)
+                MLMStructure.objects.bulk_create(placements, batch_size=1000)
+                register_bulk_counters(placements)
+                # bulk_create не шлет post_save — версию структуры меняем сами
+                invalidate_structure_snapshots()
+                sync_open_slots(
+                    [placement.user_id for placement in placements]
+                    + [placement.parent_id for placement in placements],
+                    max_partners=max_partners,
+                )
+                return placements
+        except (PlacementConflict, IntegrityError, OperationalError) as exc:
+            if attempt == PLACEMENT_ATTEMPTS:
+                raise
+            if isinstance(exc, PlacementConflict):
+                # Фронт мог отстать от структуры — сверяем запись родителя.
+                sync_open_slots([exc.parent_id])
+            time.sleep(random.uniform(0, PLACEMENT_RETRY_DELAY * attempt))
@@ -0,0 +1,107 @@
+"""
+Повышение рангов по счетчику партнеров первой линии.
+User.direct_partners_count поддерживается сигналами при смене статуса или
+пригласителя, поэтому проверка условия не требует запросов, а всех
+подходящих пользователей находит один запрос по индексу.
+"""
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from mlm.models import RankUpgrade
+from users.models import User
+
+RANK_UPGRADE_PARTNERS = 3
+MAX_RANK = max(rank for rank, _ in User.RANK_CHOICES)
+UPDATE_CHUNK_SIZE = 500
+
+
+def apply_referral_change(
+    old_inviter_id: Optional[int],
+    old_status: Optional[str],
+    new_inviter_id: Optional[int],
+    new_status: Optional[str],
+) -> None:
+    """
+    Переносит вклад пользователя между счетчиками пригласителей:
+    снимает прежний (пригласитель, статус) и добавляет новый.
+    """
+    was_partner = bool(old_inviter_id) and old_status == "partner"
+    is_partner = bool(new_inviter_id) and new_status == "partner"
+    if (was_partner, old_inviter_id) == (is_partner, new_inviter_id):
+        return
+    if was_partner:
+        User.objects.filter(pk=old_inviter_id, direct_partners_count__gt=0).update(
+            direct_partners_count=F("direct_partners_count") - 1
+        )
+    if is_partner:
+        User.objects.filter(pk=new_inviter_id).update(
+            direct_partners_count=F("direct_partners_count") + 1
+        )
+
+
+def get_eligible_users(user_ids: Optional[Iterable[int]] = None):
+    """Пользователи, проходящие условие can_upgrade_rank и не достигшие высшего ранга."""
+    eligible = User.objects.filter(
+        status="partner",
+        direct_partners_count__gte=RANK_UPGRADE_PARTNERS,
+        rank__lt=MAX_RANK,
+    )
+    if user_ids is not None:
+        eligible = eligible.filter(id__in=list(user_ids))
+    return eligible
+
+
+def promote_eligible_users(user_ids: Optional[Iterable[int]] = None) -> int:
+    """
+    Повышает на один ранг всех подходящих пользователей (или только из user_ids):
+    отбор одним запросом, UPDATE и bulk_create истории — пачками.
+    Возвращает число повышенных.
+    """
+    eligible: List[Tuple[int, int]] = list(
+        get_eligible_users(user_ids).order_by("id").values_list("id", "rank")
+    )
+    if not eligible:
+        return 0
+
+    now = timezone.now()
+    with transaction.atomic():
+        for start in range(0, len(eligible), UPDATE_CHUNK_SIZE):
+            chunk = eligible[start:start + UPDATE_CHUNK_SIZE]
+            User.objects.filter(id__in=[user_id for user_id, _ in chunk]).update(rank=F("rank") + 1)
+        RankUpgrade.objects.bulk_create(
+            (
+                RankUpgrade(user_id=user_id, from_rank=rank, to_rank=rank + 1, upgrade_date=now)
+                for user_id, rank in eligible
+            ),
+            batch_size=UPDATE_CHUNK_SIZE,
+        )
+    return len(eligible)
+
+
+def verify_partner_counts(fix: bool = False) -> List[Tuple[int, int, int]]:
+    """
+    Пересчитывает партнеров первой линии одним GROUP BY и сравнивает со счетчиками.
+    Возвращает [(user_id, сохранено, ожидается)]; при fix=True исправляет их.
+    """
+    drift = list(
+        User.objects.annotate(
+            expected=Count("referrals", filter=Q(referrals__status="partner"))
+        )
+        .exclude(direct_partners_count=F("expected"))
+        .values_list("id", "direct_partners_count", "expected")
+    )
+    if fix and drift:
+        by_value: Dict[int, List[int]] = {}
+        for user_id, _, expected in drift:
+            by_value.setdefault(expected, []).append(user_id)
+        with transaction.atomic():
+            for expected, user_ids in by_value.items():
+                for start in range(0, len(user_ids), UPDATE_CHUNK_SIZE):
+                    User.objects.filter(id__in=user_ids[start:start + UPDATE_CHUNK_SIZE]).update(
+                        direct_partners_count=expected
+                    )
+    return drift
@@ -0,0 +1,212 @@
+"""
+Сводки бонусов по пользователям (BonusRollup).
+Начисление, удаление и выплата бонусов сдвигают счетчики сводки через F(),
+поэтому get_bonus_summary читает одну строку. Запасной путь — тот же
+расчет одним запросом с условной агрегацией.
+"""
+
+from collections import defaultdict
+from decimal import Decimal
+from typing import Dict, Iterable, List, Tuple
+
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, Q, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from mlm.models import Bonus, BonusRollup
+
+ROLLUP_FIELDS = (
+    "total_count",
+    "total_amount",
+    "green_count",
+    "green_amount",
+    "red_count",
+    "red_amount",
+    "unpaid_count",
+    "unpaid_amount",
+)
+
+# Поля сводки -> ключи словаря get_bonus_summary
+SUMMARY_KEYS = {
+    "total_count": "total_bonuses",
+    "total_amount": "total_amount",
+    "green_count": "green_bonuses",
+    "green_amount": "green_amount",
+    "red_count": "red_bonuses",
+    "red_amount": "red_amount",
+    "unpaid_count": "unpaid_bonuses",
+    "unpaid_amount": "unpaid_amount",
+}
+
+ZERO = Decimal("0.00")
+
+
+def _bonus_delta(bonus_type: str, amount: Decimal, is_paid: bool, sign: int) -> List:
+    amount = amount * sign
+    green = bonus_type == "green"
+    red = bonus_type == "red"
+    unpaid = not is_paid
+    return [
+        sign, amount,
+        sign * green, amount if green else ZERO,
+        sign * red, amount if red else ZERO,
+        sign * unpaid, amount if unpaid else ZERO,
+    ]
+
+
+def _apply_rollup_deltas(deltas: Dict[int, List], create: bool = True) -> None:
+    """
+    Сдвигает счетчики сводок: пользователи с одинаковой дельтой обновляются
+    одним UPDATE. Недостающие строки создаются только при create=True —
+    при каскадном удалении пользователя его сводку воссоздавать нельзя.
+    """
+    deltas = {user_id: delta for user_id, delta in deltas.items() if any(delta)}
+    if not deltas:
+        return
+
+    groups = defaultdict(list)
+    for user_id, delta in deltas.items():
+        groups[tuple(delta)].append(user_id)
+
+    with transaction.atomic(savepoint=False):
+        if create:
+            BonusRollup.objects.bulk_create(
+                [BonusRollup(user_id=user_id) for user_id in deltas], ignore_conflicts=True
+            )
+        for delta, user_ids in groups.items():
+            BonusRollup.objects.filter(user_id__in=user_ids).update(
+                **{field: F(field) + value for field, value in zip(ROLLUP_FIELDS, delta) if value}
+            )
+
+
+def _collect(bonuses: Iterable[Tuple[int, str, Decimal, bool]], sign: int) -> Dict[int, List]:
+    deltas: Dict[int, List] = {}
+    for user_id, bonus_type, amount, is_paid in bonuses:
+        delta = _bonus_delta(bonus_type, amount, is_paid, sign)
+        current = deltas.get(user_id)
+        deltas[user_id] = delta if current is None else [a + b for a, b in zip(current, delta)]
+    return deltas
+
+
+def register_bonuses(bonuses: Iterable[Bonus]) -> None:
+    """Добавляет начисленные бонусы в сводки получателей."""
+    _apply_rollup_deltas(
+        _collect(((b.user_id, b.bonus_type, b.amount, b.is_paid) for b in bonuses), sign=1)
+    )
+
+
+def unregister_bonuses(bonuses: Iterable[Bonus]) -> None:
+    """Убирает удаленные бонусы из сводок."""
+    _apply_rollup_deltas(
+        _collect(((b.user_id, b.bonus_type, b.amount, b.is_paid) for b in bonuses), sign=-1),
+        create=False,
+    )
+
+
+def update_bonus_rollup(previous: Tuple[int, str, Decimal, bool], bonus: Bonus) -> None:
+    """Переносит измененный бонус: прежние значения вычитаются, новые прибавляются."""
+    current = (bonus.user_id, bonus.bonus_type, bonus.amount, bonus.is_paid)
+    if tuple(previous) == current:
+        return
+    deltas = _collect([previous], sign=-1)
+    for user_id, delta in _collect([current], sign=1).items():
+        existing = deltas.get(user_id)
+        deltas[user_id] = delta if existing is None else [a + b for a, b in zip(existing, delta)]
+    _apply_rollup_deltas(deltas)
+
+
+def mark_bonuses_paid(bonuses) -> int:
+    """
+    Отмечает бонусы выплаченными и уменьшает невыплаченные суммы в сводках.
+    Принимает queryset; уже выплаченные бонусы пропускаются.
+    """
+    with transaction.atomic():
+        unpaid = bonuses.filter(is_paid=False).select_for_update()
+        rows = list(unpaid.values_list("id", "user_id", "amount"))
+        if not rows:
+            return 0
+        Bonus.objects.filter(id__in=[row[0] for row in rows]).update(is_paid=True, paid_at=timezone.now())
+
+        deltas: Dict[int, List] = {}
+        for _, user_id, amount in rows:
+            delta = deltas.setdefault(user_id, [0] * len(ROLLUP_FIELDS))
+            delta[6] -= 1
+            delta[7] -= amount
+        _apply_rollup_deltas(deltas, create=False)
+    return len(rows)
+
+
+def _summary_aggregates() -> Dict:
+    """Условные агрегаты по бонусам для всех полей сводки."""
+    money = DecimalField(max_digits=14, decimal_places=2)
+
+    def _amount(condition=None):
+        return Coalesce(Sum("amount", filter=condition), Value(ZERO), output_field=money)
+
+    green = Q(bonus_type="green")
+    red = Q(bonus_type="red")
+    unpaid = Q(is_paid=False)
+    return {
+        "total_count": Count("id"),
+        "total_amount": _amount(),
+        "green_count": Count("id", filter=green),
+        "green_amount": _amount(green),
+        "red_count": Count("id", filter=red),
+        "red_amount": _amount(red),
+        "unpaid_count": Count("id", filter=unpaid),
+        "unpaid_amount": _amount(unpaid),
+    }
+
+
+def compute_bonus_summary(user) -> Dict:
+    """Запасной путь: сводка по бонусам пользователя одним запросом."""
+    values = Bonus.objects.filter(user=user).aggregate(**_summary_aggregates())
+    return {SUMMARY_KEYS[field]: values[field] for field in ROLLUP_FIELDS}
+
+
+def get_rollup_summary(user) -> Dict:
+    """Сводка из BonusRollup; без строки сводки — расчет условной агрегацией."""
+    values = BonusRollup.objects.filter(user=user).values(*ROLLUP_FIELDS).first()
+    if values is None:
+        return compute_bonus_summary(user)
+    return {SUMMARY_KEYS[field]: values[field] for field in ROLLUP_FIELDS}
+
+
+def verify_bonus_rollups(fix: bool = False) -> List[Tuple[int, Tuple, Tuple]]:
+    """
+    Сверяет сводки с пересчетом по таблице бонусов (один GROUP BY).
+    Возвращает [(user_id, сохранено, ожидается)]; при fix=True исправляет.
+    """
+    expected = {
+        row["user_id"]: tuple(row[field] for field in ROLLUP_FIELDS)
+        for row in Bonus.objects.order_by()
+        .values("user_id")
+        .annotate(**_summary_aggregates())
+        .iterator(chunk_size=5000)
+    }
+    stored = {
+        row[0]: tuple(row[1:])
+        for row in BonusRollup.objects.values_list("user_id", *ROLLUP_FIELDS).iterator(chunk_size=5000)
+    }
+    empty = (0, ZERO) * 4
+
+    drift = []
+    for user_id in stored.keys() | expected.keys():
+        wanted = expected.get(user_id, empty)
+        current = stored.get(user_id, empty)
+        if wanted != current:
+            drift.append((user_id, current, wanted))
+
+    if fix and drift:
+        with transaction.atomic():
+            BonusRollup.objects.filter(user_id__in=[user_id for user_id, _, _ in drift]).delete()
+            BonusRollup.objects.bulk_create(
+                [
+                    BonusRollup(user_id=user_id, **dict(zip(ROLLUP_FIELDS, values)))
+                    for user_id, _, values in drift
+                    if values != empty
+                ],
+                batch_size=1000,
+            )
+    return drift
@@ -0,0 +1,76 @@
+"""
+Кэш активных настроек MLM в памяти процесса.
+Актуальность сверяется со счетчиком версии в общем кэше Django: сохранение
+настроек увеличивает версию, и все воркеры перечитывают строку из БД.
+"""
+
+import time
+from decimal import Decimal
+from typing import Optional, Tuple
+
+from django.core.cache import cache
+from django.db import transaction
+
+from mlm.models import MLMSettings
+
+SETTINGS_VERSION_KEY = "mlm:settings:version"
+
+_cached: Optional[Tuple[int, MLMSettings]] = None
+
+
+def get_settings_version() -> int:
+    """
+    Возвращает текущую версию настроек. Начальное значение берется из часов,
+    чтобы после вытеснения ключа версия не совпала с уже закэшированной.
+    """
+    version = cache.get(SETTINGS_VERSION_KEY)
+    if version is None:
+        cache.add(SETTINGS_VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(SETTINGS_VERSION_KEY)
+    return version
+
+
+def bump_settings_version() -> None:
+    global _cached
+    _cached = None
+    try:
+        cache.incr(SETTINGS_VERSION_KEY)
+    except ValueError:
+        cache.add(SETTINGS_VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def invalidate_settings_cache() -> None:
+    """
+    Сбрасывает кэш сразу (для текущей транзакции) и повторно после коммита,
+    чтобы другие воркеры не успели закэшировать ещё не зафиксированную строку.
+    """
+    bump_settings_version()
+    transaction.on_commit(bump_settings_version)
+
+
+def get_active_settings() -> MLMSettings:
+    """
+    Возвращает активные настройки MLM либо создает значения по умолчанию.
+    Повторные вызовы в пределах одной версии не обращаются к БД.
+    """
+    global _cached
+    version = get_settings_version()
+    cached = _cached
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    settings = MLMSettings.objects.filter(is_active=True).first()
+    if not settings:
+        settings = MLMSettings.objects.create(
+            registration_fee=Decimal("100.00"),
+            green_bonus_first=Decimal("100.00"),
+            green_bonus_second=Decimal("50.00"),
+            red_bonus_second_partner=Decimal("50.00"),
+            red_bonus_third_partner=Decimal("100.00"),
+            max_partners_per_level=3,
+            is_active=True,
+        )
+        # Создание настроек сменило версию — кэшируем уже под новой.
+        version = get_settings_version()
+    _cached = (version, settings)
+    return settings
@@ -1,60 +1,49 @@
-from decimal import Decimal
+from django.db.models import Count, Q
 
-from mlm.models import Bonus, MLMStructure
+from mlm.models import MLMStructure
+
+from .ancestry import get_subtree_queryset
+from .rollups import get_rollup_summary
 
 
 def get_structure_statistics(user):
     """
     Возвращает статистику структуры пользователя.
+    Размеры берутся из счетчиков узла; поддерево сканируется, только если
+    оно глубже ограничения в пять уровней.
     """
-
-    def _count_recursive(current_user, level=0, max_depth=5):
-        if level >= max_depth:
-            return 0
-
-        children = MLMStructure.objects.filter(parent=current_user)
-        count = children.count()
-
-        for child in children:
-            count += _count_recursive(child.user, level + 1, max_depth)
-
-        return count
+    max_depth = 5
+    node = (
+        MLMStructure.objects.filter(user=user)
+        .values("level", "descendants_count", "max_depth")
+        .first()
+    )
+    first_line = MLMStructure.objects.filter(parent=user).aggregate(
+        total=Count("id"),
+        partners=Count("id", filter=Q(user__status="partner")),
+        participants=Count("id", filter=Q(user__status="participant")),
+    )
+
+    if node and node["max_depth"] <= max_depth:
+        total_structure = node["descendants_count"]
+    else:
+        # Глубину ограничиваем по уровню относительно текущего узла.
+        base_level = node["level"] if node else 0
+        total_structure = get_subtree_queryset(user).filter(
+            level__lte=base_level + max_depth
+        ).count()
 
     return {
-        "direct_referrals": MLMStructure.objects.filter(parent=user).count(),
-        "total_structure": _count_recursive(user),
-        "active_partners": MLMStructure.objects.filter(
-            parent=user, user__status="partner"
-        ).count(),
-        "participants": MLMStructure.objects.filter(
-            parent=user, user__status="participant"
-        ).count(),
+        "direct_referrals": first_line["total"],
+        "total_structure": total_structure,
+        "active_partners": first_line["partners"],
+        "participants": first_line["participants"],
     }
 
 
 def get_bonus_summary(user):
     """
     Возвращает агрегированные данные по бонусам пользователя.
+    Читается одна строка BonusRollup; без нее — один агрегирующий запрос.
     """
-    bonuses = Bonus.objects.filter(user=user)
-
-    def _sum(queryset):
-        total = Decimal("0.00")
-        for bonus in queryset:
-            total += bonus.amount
-        return total
-
-    green_bonuses = bonuses.filter(bonus_type="green")
-    red_bonuses = bonuses.filter(bonus_type="red")
-    unpaid_bonuses = bonuses.filter(is_paid=False)
-
-    return {
-        "total_bonuses": bonuses.count(),
-        "total_amount": _sum(bonuses),
-        "green_bonuses": green_bonuses.count(),
-        "green_amount": _sum(green_bonuses),
-        "red_bonuses": red_bonuses.count(),
-        "red_amount": _sum(red_bonuses),
-        "unpaid_bonuses": unpaid_bonuses.count(),
-        "unpaid_amount": _sum(unpaid_bonuses),
-    }
+    return get_rollup_summary(user)
@@ -0,0 +1,69 @@
+"""
+Версия структуры и кэш снимков визуализации.
+Размещение, перенос и удаление узлов увеличивают счетчик версии в общем
+кэше Django. Сериализованные снимки дерева кэшируются под текущей версией
+вместе с ETag, поэтому повторный запрос неизмененного дерева отвечает 304
+без обращения к БД. Суммы бонусов в карточках версию не меняют — их
+догоняет истечение TTL снимка.
+"""
+
+import hashlib
+import json
+import time
+from typing import Any, Callable, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+STRUCTURE_VERSION_KEY = "mlm:structure:version"
+DEFAULT_SNAPSHOT_TTL = 300
+
+
+def get_structure_version() -> int:
+    """
+    Текущая версия структуры. Начальное значение берется из часов, чтобы
+    после вытеснения ключа версия не совпала с уже выданными ETag.
+    """
+    version = cache.get(STRUCTURE_VERSION_KEY)
+    if version is None:
+        cache.add(STRUCTURE_VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(STRUCTURE_VERSION_KEY)
+    return version
+
+
+def bump_structure_version() -> None:
+    try:
+        cache.incr(STRUCTURE_VERSION_KEY)
+    except ValueError:
+        cache.add(STRUCTURE_VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def invalidate_structure_snapshots() -> None:
+    """Меняет версию сразу и после коммита, чтобы не закэшировать незафиксированное дерево."""
+    bump_structure_version()
+    transaction.on_commit(bump_structure_version)
+
+
+def get_structure_snapshot(key: str, build: Callable[[], Any]) -> Tuple[Any, str]:
+    """
+    Снимок под текущей версией: из кэша или собранный build(). Возвращает
+    данные и ETag — версию плюс хэш содержимого, чтобы пересборка после
+    истечения TTL с обновленными суммами не совпала с прежним ETag.
+    """
+    version = get_structure_version()
+    cache_key = f"mlm:structure:snapshot:{version}:{key}"
+    snapshot = cache.get(cache_key)
+    if snapshot is None:
+        payload = build()
+        digest = hashlib.md5(
+            json.dumps(payload, cls=DjangoJSONEncoder, sort_keys=True).encode()
+        ).hexdigest()[:16]
+        snapshot = (payload, f'"{version}-{digest}"')
+        cache.set(
+            cache_key,
+            snapshot,
+            getattr(settings, "STRUCTURE_SNAPSHOT_TTL", DEFAULT_SNAPSHOT_TTL),
+        )
+    return snapshot
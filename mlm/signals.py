@@ -0,0 +1,151 @@
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from mlm.models import Bonus, MLMPartner, MLMSettings, MLMStructure, Payment, Withdrawal
+from mlm.services.counters import (
+    apply_status_change,
+    register_node_counters,
+    unregister_node_counters,
+)
+from mlm.services.dashboard import invalidate_dashboard_counters
+from mlm.services.frontier import register_placement, sync_open_slots
+from mlm.services.ranks import apply_referral_change
+from mlm.services.rollups import register_bonuses, unregister_bonuses, update_bonus_rollup
+from mlm.services.settings_cache import invalidate_settings_cache
+from mlm.services.structure_version import invalidate_structure_snapshots
+from users.models import User
+
+
+# Сброс кэша подключен первым: пересборка фронта ниже читает уже новые настройки.
+@receiver(post_save, sender=MLMSettings)
+@receiver(post_delete, sender=MLMSettings)
+def reset_settings_cache(sender, **kwargs):
+    """Настройки изменились — остальные воркеры перечитают их по новой версии."""
+    invalidate_settings_cache()
+
+
+@receiver(post_save, sender=MLMStructure)
+def add_structure_to_frontier(sender, instance, created, raw=False, **kwargs):
+    """Новый узел попадает во фронт свободных позиций."""
+    if created and not raw:
+        register_placement(instance)
+        register_node_counters(instance)
+
+
+@receiver(pre_delete, sender=MLMStructure)
+def remember_deleted_status(sender, instance, **kwargs):
+    """Статус нужен счетчикам после удаления, когда пользователя может уже не быть."""
+    instance._counter_status = (
+        User.objects.filter(id=instance.user_id).values_list("status", flat=True).first() or ""
+    )
+
+
+@receiver(post_delete, sender=MLMStructure)
+def release_parent_slot(sender, instance, **kwargs):
+    """Освобождает позицию у родителя удаленного узла и вычитает его поддерево."""
+    if instance.parent_id:
+        sync_open_slots([instance.parent_id])
+        unregister_node_counters(instance, getattr(instance, "_counter_status", ""))
+
+
+@receiver(pre_save, sender=Bonus)
+def remember_previous_bonus(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Запоминает прежние получателя, тип, сумму и выплату, если сохранение может их изменить."""
+    if raw or not instance.pk:
+        return
+    if update_fields is not None and not {"user", "user_id", "bonus_type", "amount", "is_paid"} & set(update_fields):
+        return
+    instance._previous_rollup = (
+        Bonus.objects.filter(pk=instance.pk)
+        .values_list("user_id", "bonus_type", "amount", "is_paid")
+        .first()
+    )
+
+
+@receiver(post_save, sender=Bonus)
+def add_bonus_to_rollup(sender, instance, created, raw=False, **kwargs):
+    """
+    Новый бонус попадает в сводку получателя (bulk_create вызывает
+    register_bonuses сам), измененный — переносится на разницу значений.
+    """
+    previous = instance.__dict__.pop("_previous_rollup", None)
+    if raw:
+        return
+    if created:
+        register_bonuses([instance])
+    elif previous is not None:
+        update_bonus_rollup(previous, instance)
+
+
+@receiver(post_delete, sender=Bonus)
+def remove_bonus_from_rollup(sender, instance, **kwargs):
+    """Удаленный бонус вычитается из сводки получателя."""
+    unregister_bonuses([instance])
+
+
+@receiver(pre_save, sender=User)
+def remember_previous_status(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Запоминает прежние статус и пригласителя, если сохранение может их изменить."""
+    if raw or not instance.pk:
+        return
+    # Частичное сохранение без статуса и пригласителя не тратит лишний SELECT
+    if update_fields is not None and not {"status", "invited_by", "invited_by_id"} & set(update_fields):
+        return
+    previous = User.objects.filter(pk=instance.pk).values_list("status", "invited_by_id").first()
+    if previous:
+        instance._previous_status, instance._previous_inviter_id = previous
+
+
+@receiver(post_save, sender=User)
+def move_status_between_counters(sender, instance, created, raw=False, **kwargs):
+    """Смена статуса переносит пользователя между счетчиками предков и пригласителей."""
+    previous_status = instance.__dict__.pop("_previous_status", None)
+    previous_inviter_id = instance.__dict__.pop("_previous_inviter_id", None)
+    if raw:
+        return
+    if created:
+        apply_referral_change(None, None, instance.invited_by_id, instance.status)
+        return
+    if previous_status is None:
+        return
+    if previous_status != instance.status:
+        apply_status_change(instance, previous_status)
+        invalidate_structure_snapshots()
+    apply_referral_change(previous_inviter_id, previous_status, instance.invited_by_id, instance.status)
+
+
+@receiver(post_delete, sender=User)
+def release_inviter_partner(sender, instance, **kwargs):
+    """Удаленный партнер больше не считается у пригласителя."""
+    apply_referral_change(instance.invited_by_id, instance.status, None, None)
+
+
+@receiver(post_save, sender=MLMSettings)
+def rebuild_frontier_on_settings_change(sender, instance, raw=False, **kwargs):
+    """Лимит партнеров мог измениться — пересобираем фронт целиком."""
+    if not raw:
+        sync_open_slots()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+@receiver(post_save, sender=Payment)
+@receiver(post_delete, sender=Payment)
+@receiver(post_save, sender=Bonus)
+@receiver(post_delete, sender=Bonus)
+@receiver(post_save, sender=Withdrawal)
+@receiver(post_delete, sender=Withdrawal)
+def reset_dashboard_counters(sender, raw=False, **kwargs):
+    """Изменились данные дашборда — счетчики пересчитаются при следующем открытии."""
+    if not raw:
+        invalidate_dashboard_counters()
+
+
+@receiver(post_save, sender=MLMStructure)
+@receiver(post_delete, sender=MLMStructure)
+@receiver(post_save, sender=MLMPartner)
+@receiver(post_delete, sender=MLMPartner)
+def reset_structure_snapshots(sender, raw=False, **kwargs):
+    """Дерево изменилось — снимки визуализации пересоберутся под новой версией."""
+    if not raw:
+        invalidate_structure_snapshots()
@@ -0,0 +1,320 @@
+"""
+Симулятор плана вознаграждений «что если».
+Дерево хранится массивами NumPy (родитель, порядковый номер у родителя,
+глубина, ранг, статус партнера), правила calculate_bonuses и
+calculate_level_bonuses применяются ко всем регистрациям сразу масками,
+суммы ведутся в центах целыми числами. Сеть из 1M участников считается
+за секунды; БД читается только при снимке реального дерева.
+"""
+
+import time
+from dataclasses import dataclass, field, fields, replace
+from decimal import Decimal
+from typing import Dict, Mapping, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from mlm.models import MLMStructure
+from mlm.services.commissions import get_level_percentages
+from mlm.services.settings_cache import get_active_settings
+
+MONEY_FIELDS = (
+    "registration_fee",
+    "green_bonus_first",
+    "green_bonus_second",
+    "red_bonus_second_partner",
+    "red_bonus_third_partner",
+)
+PERCENTAGE_FIELDS = ("spillover_percentages", "matching_percentages")
+BONUS_TYPES = ("green", "red", "spillover", "matching")
+SNAPSHOT_CHUNK_SIZE = 20_000
+
+
+def _require_numpy() -> None:
+    if np is None:
+        raise ImportError("Для симулятора нужен numpy (pip install numpy)")
+
+
+def _to_cents(amount) -> int:
+    return int((Decimal(str(amount)) * 100).quantize(Decimal("1")))
+
+
+def _from_cents(cents) -> Decimal:
+    return (Decimal(int(round(cents))) / 100).quantize(Decimal("0.01"))
+
+
+@dataclass(frozen=True)
+class PlanParameters:
+    """Суммы и проценты плана; по умолчанию берутся из активных MLMSettings."""
+
+    registration_fee: Decimal = Decimal("100.00")
+    green_bonus_first: Decimal = Decimal("100.00")
+    green_bonus_second: Decimal = Decimal("50.00")
+    red_bonus_second_partner: Decimal = Decimal("50.00")
+    red_bonus_third_partner: Decimal = Decimal("100.00")
+    spillover_percentages: Tuple[Decimal, ...] = ()
+    matching_percentages: Tuple[Decimal, ...] = ()
+
+    @classmethod
+    def from_settings(cls, settings=None) -> "PlanParameters":
+        settings = settings or get_active_settings()
+        return cls(
+            **{name: Decimal(str(getattr(settings, name))) for name in MONEY_FIELDS},
+            **{name: tuple(get_level_percentages(getattr(settings, name))) for name in PERCENTAGE_FIELDS},
+        )
+
+    def with_overrides(self, overrides: Mapping[str, str]) -> "PlanParameters":
+        """
+        Копия с измененными значениями. Проценты передаются строкой
+        через запятую: {"spillover_percentages": "5,3,1"}.
+        """
+        known = {item.name for item in fields(self)}
+        changes = {}
+        for name, value in overrides.items():
+            if name not in known:
+                raise ValueError(f"Неизвестный параметр плана: {name}")
+            if name in PERCENTAGE_FIELDS:
+                parts = [part for part in str(value).split(",") if part.strip()]
+                changes[name] = tuple(get_level_percentages(parts))
+            else:
+                changes[name] = Decimal(str(value))
+        return replace(self, **changes)
+
+
+@dataclass
+class SimulationTree:
+    """
+    Дерево в порядке регистрации: parent[i] — индекс родителя (-1 у корня),
+    ordinal[i] — номер среди детей родителя, first_child[i] — индекс
+    первого ребенка (-1, если детей нет).
+    """
+
+    parent: "np.ndarray"
+    ordinal: "np.ndarray"
+    first_child: "np.ndarray"
+    depth: "np.ndarray"
+    rank: "np.ndarray"
+    is_partner: "np.ndarray"
+
+    @property
+    def size(self) -> int:
+        return len(self.parent)
+
+
+@dataclass
+class SimulationResult:
+    """Итог прогона: суммы по типам бонусов, уровням и рангам получателей."""
+
+    members: int
+    registrations: int
+    total: Decimal
+    by_type: Dict[str, Decimal] = field(default_factory=dict)
+    by_level: Dict[int, Decimal] = field(default_factory=dict)
+    by_rank: Dict[int, Decimal] = field(default_factory=dict)
+    wall_time: float = 0.0
+
+
+def _compute_depths(parent: "np.ndarray") -> "np.ndarray":
+    """Глубины удвоением указателей: O(N log D) без обхода по узлам."""
+    depth = (parent >= 0).astype(np.int32)
+    jump = parent.copy()
+    while True:
+        mask = jump >= 0
+        if not mask.any():
+            return depth
+        target = jump[mask]
+        depth[mask] += depth[target]
+        next_jump = np.full_like(jump, -1)
+        next_jump[mask] = jump[target]
+        jump = next_jump
+
+
+def _order_siblings(parent: "np.ndarray", sort_key: "np.ndarray") -> Tuple["np.ndarray", "np.ndarray"]:
+    """Номер узла среди детей родителя по sort_key и первый ребенок каждого узла."""
+    size = len(parent)
+    order = np.lexsort((np.arange(size), sort_key, parent))
+    sorted_parent = parent[order]
+    starts = np.ones(size, dtype=bool)
+    starts[1:] = sorted_parent[1:] != sorted_parent[:-1]
+    positions = np.arange(size)
+    group_start = np.maximum.accumulate(np.where(starts, positions, 0))
+
+    ordinal = np.empty(size, dtype=np.int64)
+    ordinal[order] = positions - group_start + 1
+    first_child = np.full(size, -1, dtype=np.int64)
+    heads = starts & (sorted_parent >= 0)
+    first_child[sorted_parent[heads]] = order[heads]
+    return ordinal, first_child
+
+
+def synthetic_tree(
+    size: int,
+    max_partners: int = 3,
+    fill: float = 1.0,
+    partner_ratio: float = 1.0,
+    seed: Optional[int] = None,
+) -> SimulationTree:
+    """
+    Синтетический рост сети по уровням: у каждого узла уровня
+    Binomial(max_partners, fill) детей, регистрации идут в порядке BFS.
+    Ранг 1 получает узел с полной первой линией (как promote_eligible_users).
+    """
+    _require_numpy()
+    rng = np.random.default_rng(seed)
+    parents = [np.array([-1], dtype=np.int64)]
+    level_start, level_end, total = 0, 1, 1
+    while total < size:
+        level_nodes = np.arange(level_start, level_end, dtype=np.int64)
+        counts = rng.binomial(max_partners, fill, len(level_nodes)) if fill < 1 else \
+            np.full(len(level_nodes), max_partners)
+        if not counts.any():
+            counts[0] = 1
+        children = np.repeat(level_nodes, counts)[:size - total]
+        parents.append(children)
+        level_start, level_end = level_end, level_end + len(children)
+        total += len(children)
+
+    parent = np.concatenate(parents)
+    ordinal, first_child = _order_siblings(parent, np.zeros(size, dtype=np.int64))
+    children_count = np.bincount(parent[parent >= 0], minlength=size)
+    is_partner = rng.random(size) < partner_ratio
+    is_partner[0] = True
+    return SimulationTree(
+        parent=parent,
+        ordinal=ordinal,
+        first_child=first_child,
+        depth=_compute_depths(parent),
+        rank=(children_count >= max_partners).astype(np.int16),
+        is_partner=is_partner,
+    )
+
+
+def snapshot_tree() -> SimulationTree:
+    """Снимок реальной структуры: один потоковый запрос, порядок — по created_at."""
+    _require_numpy()
+    rows = (
+        MLMStructure.objects.order_by("created_at", "id")
+        .values_list("user_id", "parent_id", "position", "user__rank", "user__status")
+        .iterator(chunk_size=SNAPSHOT_CHUNK_SIZE)
+    )
+    user_ids, parent_ids, positions, ranks, partners = [], [], [], [], []
+    for user_id, parent_id, position, rank, status in rows:
+        user_ids.append(user_id)
+        parent_ids.append(parent_id or 0)
+        positions.append(position)
+        ranks.append(rank)
+        partners.append(status == "partner")
+
+    if not user_ids:
+        raise ValueError("Структура пуста: снимать нечего")
+
+    user_ids = np.array(user_ids, dtype=np.int64)
+    parent_ids = np.array(parent_ids, dtype=np.int64)
+    by_id = np.argsort(user_ids)
+    found = by_id[np.minimum(np.searchsorted(user_ids, parent_ids, sorter=by_id), len(user_ids) - 1)]
+    # Родитель без собственного узла считается корнем ветки
+    parent = np.where(user_ids[found] == parent_ids, found, -1)
+
+    ordinal, first_child = _order_siblings(parent, np.array(positions, dtype=np.int64))
+    return SimulationTree(
+        parent=parent,
+        ordinal=ordinal,
+        first_child=first_child,
+        depth=_compute_depths(parent),
+        rank=np.array(ranks, dtype=np.int16),
+        is_partner=np.array(partners, dtype=bool),
+    )
+
+
+def _upline_payouts(tree: SimulationTree, sources, base_cents, percentages):
+    """Проценты по уровням аплайна источников: (получатели, суммы в центах)."""
+    recipients, amounts = [], []
+    ancestor = tree.parent[sources]
+    for percent in percentages:
+        alive = ancestor >= 0
+        if not alive.any():
+            break
+        cents = np.rint(base_cents * float(percent) / 100).astype(np.int64)
+        paid = alive & tree.is_partner[np.maximum(ancestor, 0)] & (cents > 0)
+        recipients.append(ancestor[paid])
+        amounts.append(cents[paid] if np.ndim(cents) else np.full(paid.sum(), cents, dtype=np.int64))
+        ancestor = np.where(alive, tree.parent[np.maximum(ancestor, 0)], -1)
+    if not recipients:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    return np.concatenate(recipients), np.concatenate(amounts)
+
+
+def simulate_payouts(tree: SimulationTree, params: PlanParameters) -> SimulationResult:
+    """Прогоняет все регистрации дерева по правилам плана и сводит выплаты."""
+    _require_numpy()
+    started = time.perf_counter()
+    payers = np.flatnonzero(tree.parent >= 0)
+    parent = tree.parent[payers]
+    ordinal = tree.ordinal[payers]
+    first_child = tree.first_child[parent]
+
+    rules = (
+        ("green", ordinal == 1, parent, params.green_bonus_first),
+        ("green", ordinal == 2, parent, params.green_bonus_second),
+        ("red", ordinal == 2, first_child, params.red_bonus_second_partner),
+        ("red", ordinal == 3, first_child, params.red_bonus_third_partner),
+    )
+    payouts = {bonus_type: ([], []) for bonus_type in BONUS_TYPES}
+    for bonus_type, mask, recipients, amount in rules:
+        cents = _to_cents(amount)
+        if cents > 0 and mask.any():
+            payouts[bonus_type][0].append(recipients[mask])
+            payouts[bonus_type][1].append(np.full(mask.sum(), cents, dtype=np.int64))
+
+    if params.spillover_percentages:
+        recipients, amounts = _upline_payouts(
+            tree, payers, _to_cents(params.registration_fee), params.spillover_percentages
+        )
+        payouts["spillover"][0].append(recipients)
+        payouts["spillover"][1].append(amounts)
+
+    if params.matching_percentages:
+        base = [
+            (np.concatenate(payouts[bonus_type][0]), np.concatenate(payouts[bonus_type][1]))
+            for bonus_type in ("green", "red")
+            if payouts[bonus_type][0]
+        ]
+        if base:
+            recipients, amounts = _upline_payouts(
+                tree,
+                np.concatenate([item[0] for item in base]),
+                np.concatenate([item[1] for item in base]),
+                params.matching_percentages,
+            )
+            payouts["matching"][0].append(recipients)
+            payouts["matching"][1].append(amounts)
+
+    all_recipients = [np.concatenate(parts[0]) for parts in payouts.values() if parts[0]]
+    all_amounts = [np.concatenate(parts[1]) for parts in payouts.values() if parts[1]]
+    recipients = np.concatenate(all_recipients) if all_recipients else np.array([], dtype=np.int64)
+    amounts = np.concatenate(all_amounts) if all_amounts else np.array([], dtype=np.int64)
+
+    by_level = np.bincount(tree.depth[recipients], weights=amounts) if len(recipients) else []
+    by_rank = np.bincount(tree.rank[recipients], weights=amounts) if len(recipients) else []
+    return SimulationResult(
+        members=tree.size,
+        registrations=len(payers),
+        total=_from_cents(amounts.sum()),
+        by_type={
+            bonus_type: _from_cents(sum(part.sum() for part in parts[1]))
+            for bonus_type, parts in payouts.items()
+        },
+        by_level={level: _from_cents(cents) for level, cents in enumerate(by_level) if cents},
+        by_rank={rank: _from_cents(cents) for rank, cents in enumerate(by_rank) if cents},
+        wall_time=time.perf_counter() - started,
+    )
+
+
+def compare_plans(
+    tree: SimulationTree, baseline: PlanParameters, scenario: PlanParameters
+) -> Tuple[SimulationResult, SimulationResult]:
+    """Прогон текущего и альтернативного плана на одном дереве."""
+    return simulate_payouts(tree, baseline), simulate_payouts(tree, scenario)
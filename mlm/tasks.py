@@ -0,0 +1,39 @@
+try:
+    from celery import shared_task
+except ImportError:
+    shared_task = None
+
+from mlm.services.jobs import (
+    process_pending_registration_jobs,
+    process_registration_job,
+    process_registration_jobs_batch,
+)
+
+process_registration_job_task = None
+process_registration_jobs_batch_task = None
+process_pending_registration_jobs_task = None
+
+if shared_task is not None:
+
+    @shared_task
+    def process_registration_job_task(job_id):
+        """
+        Размещение и бонусы по задаче. Упавшую задачу повторяет не celery, а
+        process_pending_registration_jobs_task после паузы next_attempt_at.
+        """
+        return process_registration_job(job_id).status
+
+    @shared_task
+    def process_registration_jobs_batch_task(job_ids):
+        """Пачка задач: упавшие внутри пачки уходят в failed и подберутся воркером очереди."""
+        return process_registration_jobs_batch(job_ids)
+
+    @shared_task
+    def process_pending_registration_jobs_task():
+        """Догон очереди по расписанию CELERY_BEAT_SCHEDULE: ожидающие и упавшие после паузы."""
+        total = 0
+        while True:
+            processed = process_pending_registration_jobs()
+            total += processed
+            if not processed:
+                return total
@@ -1,3 +1,752 @@
-from django.test import TestCase
+import random
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock, skipIf
 
-# Create your tests here.
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.db.models import Count, F, Sum
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from mlm import simulator
+from mlm.benchmarks import run_structure_benchmarks
+from mlm.tree_metrics import compute_tree_metrics
+
+from mlm.models import (
+    Bonus,
+    MLMOpenSlot,
+    MLMSettings,
+    MLMStructure,
+    Payment,
+    RankUpgrade,
+    RegistrationJob,
+    Withdrawal,
+)
+from mlm.services import (
+    StructureMoveError,
+    apply_subtree_move,
+    calculate_level_bonuses,
+    create_payout_batch,
+    enqueue_registration_completed,
+    get_active_settings,
+    get_bonus_summary,
+    get_dashboard_counters,
+    get_subtree_queryset,
+    mark_bonuses_paid,
+    move_subtree,
+    place_user_in_structure,
+    place_users_in_structure,
+    post_credit,
+    post_debit,
+    promote_eligible_users,
+    refresh_structure_path,
+    reject_payout_batch,
+    replay_bonuses,
+    stream_payout_file,
+    sync_open_slots,
+    take_balance_snapshots,
+    verify_balances,
+    verify_bonus_rollups,
+    verify_counters,
+    verify_partner_counts,
+)
+from mlm.services.jobs import process_pending_registration_jobs, process_registration_job
+from mlm.services.ledger import InsufficientBalance, get_ledger_balance
+from mlm.services.rollups import compute_bonus_summary
+from users.models import User
+
+
+def _sqlite_without_write_locks():
+    # SQLite в режиме DEFERRED взаимно блокирует писателей без ожидания,
+    # поэтому как замена Postgres годится только с transaction_mode=IMMEDIATE.
+    return (
+        connection.vendor == 'sqlite'
+        and connection.settings_dict.get('OPTIONS', {}).get('transaction_mode') != 'IMMEDIATE'
+    )
+
+
+@skipIf(_sqlite_without_write_locks(), 'SQLite needs transaction_mode=IMMEDIATE for concurrent writers')
+class ConcurrentLedgerTests(TransactionTestCase):
+    """Параллельные начисления по устаревшим объектам не теряют записей."""
+
+    CREDITS = 200
+    THREADS = 8
+
+    def _credit_chunk(self, count):
+        try:
+            stale_user = User(pk=self.user.pk)
+            for _ in range(count):
+                post_credit(stale_user, '1.50', 'bonus')
+        finally:
+            connection.close()
+
+    def test_parallel_credits_are_not_lost(self):
+        self.user = User.objects.create(username='earner', email='earner@example.com', referral_code='EARN0000')
+        chunks = [self.CREDITS // self.THREADS] * self.THREADS
+        with ThreadPoolExecutor(max_workers=self.THREADS) as pool:
+            list(pool.map(self._credit_chunk, chunks))
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, Decimal('1.50') * self.CREDITS)
+        self.assertEqual(self.user.total_earned, Decimal('1.50') * self.CREDITS)
+        self.assertEqual(verify_balances(), [])
+
+
+@skipIf(_sqlite_without_write_locks(), 'SQLite needs transaction_mode=IMMEDIATE for concurrent writers')
+class ConcurrentPlacementTests(TransactionTestCase):
+    """Параллельное размещение не должно ломать структуру."""
+
+    USERS_COUNT = 1000
+    THREADS = 8
+
+    def setUp(self):
+        self.root = User.objects.create(username='root', email='root@example.com', referral_code='ROOT0000')
+        MLMStructure.objects.create(user=self.root, level=0)
+        User.objects.bulk_create(
+            User(
+                username=f'stress_{index}',
+                email=f'stress_{index}@example.com',
+                referral_code=f'S{index:07d}',
+                invited_by=self.root,
+            )
+            for index in range(self.USERS_COUNT)
+        )
+
+    def _place_chunk(self, user_ids):
+        try:
+            for user in User.objects.filter(id__in=user_ids).order_by('id'):
+                place_user_in_structure(user, self.root)
+        finally:
+            connection.close()
+
+    def test_parallel_placement_keeps_structure_consistent(self):
+        user_ids = list(
+            User.objects.filter(invited_by=self.root).order_by('id').values_list('id', flat=True)
+        )
+        chunks = [user_ids[index::self.THREADS] for index in range(self.THREADS)]
+        with ThreadPoolExecutor(max_workers=self.THREADS) as pool:
+            list(pool.map(self._place_chunk, chunks))
+
+        self.assertEqual(MLMStructure.objects.count(), self.USERS_COUNT + 1)
+        self.assertFalse(
+            MLMStructure.objects.exclude(parent=None)
+            .values('parent', 'position')
+            .annotate(total=Count('id'))
+            .filter(total__gt=1)
+            .exists()
+        )
+        self.assertFalse(
+            MLMStructure.objects.exclude(parent=None)
+            .values('parent')
+            .annotate(total=Count('id'))
+            .filter(total__gt=3)
+            .exists()
+        )
+        for structure in MLMStructure.objects.all():
+            self.assertEqual(structure.path, structure.build_path())
+
+        frontier = sorted(MLMOpenSlot.objects.values_list('user_id', 'children_count'))
+        sync_open_slots()
+        self.assertEqual(frontier, sorted(MLMOpenSlot.objects.values_list('user_id', 'children_count')))
+        self.assertEqual(verify_counters(), [])
+
+
+class StructureBenchmarkTests(TestCase):
+    """Число запросов горячих путей не должно зависеть от глубины дерева."""
+
+    QUERY_BUDGETS = {
+        'find_placement_parent': 6,
+        'place_user_in_structure': 26,
+        'calculate_bonuses': 12,
+        'calculate_bonuses_batch': 19,
+        'get_structure_statistics': 8,
+        'build_structure_dataset': 4,
+    }
+
+    def setUp(self):
+        MLMSettings.objects.create(max_partners_per_level=3, is_active=True)
+
+    def test_query_budgets_on_thousand_nodes(self):
+        results = {result.operation: result for result in run_structure_benchmarks(1000)}
+
+        self.assertEqual(set(results), set(self.QUERY_BUDGETS))
+        for operation, budget in self.QUERY_BUDGETS.items():
+            with self.subTest(operation=operation):
+                self.assertLessEqual(results[operation].queries, budget)
+        self.assertFalse(User.objects.filter(username__startswith='bench_').exists())
+
+
+class ActiveSettingsCacheTests(TestCase):
+    """Настройки читаются из кэша процесса до их изменения."""
+
+    def test_settings_cached_until_saved(self):
+        settings = MLMSettings.objects.create(max_partners_per_level=3, is_active=True)
+        self.assertEqual(get_active_settings().pk, settings.pk)
+        with self.assertNumQueries(0):
+            get_active_settings()
+
+        settings.max_partners_per_level = 5
+        settings.save()
+        self.assertEqual(get_active_settings().max_partners_per_level, 5)
+
+
+class RegistrationJobTests(TestCase):
+    """Задача по платежу размещает пользователя и начисляет бонусы ровно один раз."""
+
+    def setUp(self):
+        MLMSettings.objects.create(max_partners_per_level=3, is_active=True)
+        self.inviter = User.objects.create(username='inviter', email='inviter@example.com')
+        MLMStructure.objects.create(user=self.inviter, level=0)
+        self.user = User.objects.create(username='newcomer', email='newcomer@example.com', invited_by=self.inviter)
+        self.payment = Payment.objects.create(
+            user=self.user, amount=100, payment_type='registration', status='completed'
+        )
+
+    def test_eager_job_is_idempotent_per_payment(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            job = enqueue_registration_completed(self.payment)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(enqueue_registration_completed(self.payment).id, job.id)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'completed')
+        self.assertEqual(job.attempts, 1)
+        self.assertEqual(self.user.mlm_structure.parent, self.inviter)
+        self.assertEqual(Bonus.objects.filter(user=self.inviter).count(), 1)
+
+    @override_settings(MLM_JOBS_MODE='deferred')
+    def test_deferred_job_waits_for_worker(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            job = enqueue_registration_completed(self.payment)
+
+        self.assertEqual(RegistrationJob.objects.get(id=job.id).status, 'pending')
+        self.assertFalse(MLMStructure.objects.filter(user=self.user).exists())
+
+    def test_failed_eager_job_is_retried_after_backoff(self):
+        with mock.patch('mlm.services.jobs.calculate_bonuses', side_effect=RuntimeError('boom')):
+            with self.captureOnCommitCallbacks(execute=True):
+                job = enqueue_registration_completed(self.payment)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.last_error), ('failed', 'boom'))
+        self.assertGreater(job.next_attempt_at, timezone.now())
+
+        # До истечения паузы ни проход очереди, ни прямой вызов задачу не выполняют
+        self.assertEqual(process_pending_registration_jobs(), 0)
+        self.assertEqual(process_registration_job(job.id).attempts, 1)
+        RegistrationJob.objects.filter(id=job.id).update(next_attempt_at=timezone.now())
+        self.assertEqual(process_pending_registration_jobs(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.next_attempt_at), ('completed', 2, None))
+        self.assertEqual(Bonus.objects.filter(user=self.inviter).count(), 1)
+
+    def _balances(self):
+        return dict(User.objects.values_list('username', 'balance'))
+
+    @override_settings(MLM_PLACEMENT_STRATEGY='first_fit')
+    def test_batch_drain_matches_sequential_bonuses(self):
+        payments = [self.payment]
+        for index in range(4):
+            user = User.objects.create(
+                username=f'batch_{index}', email=f'batch_{index}@example.com', invited_by=self.inviter
+            )
+            payments.append(Payment.objects.create(
+                user=user, amount=100, payment_type='registration', status='completed'
+            ))
+        # Не регистрационный платеж считается по живому счетчику, а не порядку в пакете
+        payments.append(Payment.objects.create(
+            user=self.user, amount=50, payment_type='upgrade', status='completed'
+        ))
+
+        with transaction.atomic():
+            with self.captureOnCommitCallbacks(execute=True):
+                for payment in payments:
+                    enqueue_registration_completed(payment)
+            sequential = self._balances()
+            sequential_bonuses = Bonus.objects.count()
+            transaction.set_rollback(True)
+
+        with override_settings(MLM_JOBS_MODE='deferred'):
+            with self.captureOnCommitCallbacks(execute=True):
+                for payment in payments:
+                    enqueue_registration_completed(payment)
+        self.assertEqual(process_pending_registration_jobs(), len(payments))
+
+        self.assertFalse(RegistrationJob.objects.exclude(status='completed').exists())
+        self.assertEqual(self._balances(), sequential)
+        self.assertEqual(Bonus.objects.count(), sequential_bonuses)
+        self.assertEqual(verify_balances(), [])
+
+    @override_settings(MLM_PLACEMENT_STRATEGY='first_fit')
+    def test_replay_reports_missing_bonus(self):
+        for index in range(3):
+            user = User.objects.create(
+                username=f'replay_{index}', email=f'replay_{index}@example.com', invited_by=self.inviter
+            )
+            Payment.objects.create(user=user, amount=100, payment_type='registration', status='completed')
+        with self.captureOnCommitCallbacks(execute=True):
+            for payment in Payment.objects.order_by('id'):
+                enqueue_registration_completed(payment)
+
+        self.assertEqual(Bonus.objects.filter(bonus_type='red').count(), 2)
+        self.assertEqual(list(replay_bonuses(chunk_size=2)), [])
+
+        Bonus.objects.order_by('id').last().delete()
+        self.assertEqual([diff.kind for diff in replay_bonuses(chunk_size=2)], ['missing'])
+
+        # Доход сверяется пачками пользователей с поправкой на расхождения
+        User.objects.filter(pk=self.inviter.pk).update(total_earned=F('total_earned') + 1)
+        drift = [diff for diff in replay_bonuses(chunk_size=2) if diff.kind == 'earned_drift']
+        self.assertEqual([diff.user_id for diff in drift], [self.inviter.pk])
+
+
+class LevelBonusTests(TestCase):
+    """Спилловер и матчинг начисляются по аплайну из пути без обхода родителей."""
+
+    def setUp(self):
+        MLMSettings.objects.create(
+            spillover_percentages=[10, 5, 2],
+            matching_percentages=[20],
+            is_active=True,
+        )
+        self.chain = []
+        parent = None
+        for index in range(4):
+            user = User.objects.create(username=f'level_{index}', email=f'level_{index}@example.com', status='partner')
+            MLMStructure.objects.create(user=user, parent=parent, level=index)
+            self.chain.append(user)
+            parent = user
+        User.objects.filter(pk=self.chain[0].pk).update(status='registered')
+
+    def test_upline_bonuses_written_in_bulk(self):
+        payer = self.chain[3]
+        payment = Payment.objects.create(user=payer, amount=100, payment_type='registration', status='completed')
+        base = Bonus.objects.create(user=self.chain[2], amount=50, bonus_type='green', from_user=payer)
+
+        with self.assertNumQueries(11):
+            bonuses = calculate_level_bonuses([payment], [base])
+
+        # Корень не партнер: спилловер третьего уровня ему не начисляется
+        self.assertEqual(
+            sorted((b.bonus_type, b.user.username, b.level, b.amount) for b in bonuses),
+            [
+                ('matching', 'level_1', 1, Decimal('10.00')),
+                ('spillover', 'level_1', 2, Decimal('5.00')),
+                ('spillover', 'level_2', 1, Decimal('10.00')),
+            ],
+        )
+        self.chain[1].refresh_from_db()
+        self.assertEqual(self.chain[1].balance, Decimal('15.00'))
+        self.assertEqual(verify_balances(), [])
+        self.assertEqual(verify_bonus_rollups(), [])
+
+
+@skipIf(simulator.np is None, 'numpy не установлен')
+class PlanSimulatorTests(TestCase):
+    """Векторный прогон по снимку дерева совпадает с реально начисленными бонусами."""
+
+    def test_snapshot_matches_recorded_bonuses(self):
+        MLMSettings.objects.create(spillover_percentages=[10, 5], matching_percentages=[20], is_active=True)
+        root = User.objects.create(username='sim_root', email='sim_root@example.com', status='partner')
+        MLMStructure.objects.create(user=root, level=0)
+        with self.captureOnCommitCallbacks(execute=True):
+            for index in range(12):
+                user = User.objects.create(
+                    username=f'sim_{index}', email=f'sim_{index}@example.com', invited_by=root, status='partner'
+                )
+                enqueue_registration_completed(Payment.objects.create(
+                    user=user, amount=100, payment_type='registration', status='completed'
+                ))
+
+        result = simulator.simulate_payouts(
+            simulator.snapshot_tree(), simulator.PlanParameters.from_settings()
+        )
+        recorded = dict(Bonus.objects.values_list('bonus_type').annotate(total=Sum('amount')))
+        self.assertEqual({k: v for k, v in result.by_type.items() if v}, recorded)
+        self.assertEqual(result.total, sum(recorded.values()))
+
+
+class TreeMetricsTests(TestCase):
+    """Метрики дерева считаются без рекурсии и совпадают с тринарным правилом."""
+
+    def test_deep_chain_and_trinary_level(self):
+        depth = 5000
+        chain = [(index, index - 1 or None) for index in range(1, depth + 1)]
+        # Три ветки по три листа поднимают узел 1 на второй уровень
+        extra = []
+        for branch in range(3):
+            branch_id = 10_000 + branch * 10
+            extra.append((branch_id, 1))
+            extra.extend((branch_id + leaf, branch_id) for leaf in range(1, 4))
+        metrics = compute_tree_metrics(chain + extra)
+
+        self.assertEqual(metrics.get(depth, 'depth'), depth - 1)
+        self.assertEqual(metrics.get(1, 'descendants'), len(chain) + len(extra) - 1)
+        self.assertEqual(metrics.get(10_000, 'computed_level'), 1)
+        self.assertEqual(metrics.get(1, 'computed_level'), 2)
+        self.assertEqual(metrics.level_histogram()[1], {'total': 3})
+
+
+class DashboardCountersTests(TestCase):
+    """Счетчики дашборда: четыре запроса при промахе, кэш до ближайшего изменения."""
+
+    def test_counters_cached_until_change(self):
+        user = User.objects.create(username='dash', email='dash@example.com', status='partner')
+        with self.assertNumQueries(4):
+            self.assertEqual(get_dashboard_counters()['partners'], 1)
+        with self.assertNumQueries(0):
+            get_dashboard_counters()
+
+        Payment.objects.create(user=user, amount=100, payment_type='registration', status='pending')
+        self.assertEqual(get_dashboard_counters()['pending_payments'], 1)
+
+
+class BalanceLedgerTests(TestCase):
+    """Баланс меняется только проводками и сходится со снимками журнала."""
+
+    def setUp(self):
+        self.user = User.objects.create(username='holder', email='holder@example.com')
+
+    def test_debit_checks_balance_atomically(self):
+        post_credit(self.user, 100, 'bonus')
+        post_debit(self.user, 60, 'withdrawal')
+        with self.assertRaises(InsufficientBalance):
+            post_debit(self.user, 60, 'withdrawal')
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, Decimal('40.00'))
+        self.assertEqual(self.user.total_earned, Decimal('100.00'))
+        self.assertEqual(self.user.ledger_entries.count(), 2)
+
+    def test_snapshots_roll_forward(self):
+        post_credit(self.user, 30, 'bonus')
+        # Свежая проводка еще может соседствовать с незакоммиченными — ждем lag
+        self.assertEqual(take_balance_snapshots(), 0)
+        self.assertEqual(take_balance_snapshots(lag=timedelta(0)), 1)
+        self.assertEqual(take_balance_snapshots(lag=timedelta(0)), 0)
+
+        post_debit(self.user, 10, 'withdrawal')
+        post_credit(self.user, 5, 'withdrawal_refund', earned=False)
+        self.assertEqual(take_balance_snapshots(lag=timedelta(0)), 1)
+        self.assertEqual(self.user.balance_snapshots.order_by('-last_entry_id')[0].balance, Decimal('25.00'))
+        self.assertEqual(get_ledger_balance(self.user), Decimal('25.00'))
+        self.assertEqual(verify_balances(), [])
+
+
+class PayoutBatchTests(TestCase):
+    """Пакет выплат отбирается по фильтру, отклоняется с возвратами и выгружается потоком."""
+
+    def setUp(self):
+        self.users = [
+            User.objects.create(username=f'payee{index}', email=f'payee{index}@example.com')
+            for index in range(3)
+        ]
+        for user in self.users:
+            post_credit(user, 100, 'bonus')
+            for amount, method in ((40, 'card'), (5, 'card'), (30, 'crypto')):
+                post_debit(user, amount, 'withdrawal')
+                Withdrawal.objects.create(user=user, amount=amount, payment_method=method, payment_details='{}')
+
+    def test_reject_refunds_and_export_streams(self):
+        batch = create_payout_batch({'payment_method': 'card', 'min_amount': 10})
+        self.assertEqual(batch.withdrawals_count, 3)
+        self.assertEqual(batch.total_amount, Decimal('120.00'))
+        # Повторный отбор не берет выводы, уже попавшие в пакет
+        self.assertEqual(create_payout_batch({'payment_method': 'card', 'min_amount': 10}).withdrawals_count, 0)
+
+        lines = list(stream_payout_file(batch, 'csv'))
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(lines[0].startswith('withdrawal_id,'))
+
+        with self.assertNumQueries(10):
+            self.assertEqual(reject_payout_batch(batch, admin_notes='bad details'), 3)
+        for user in self.users:
+            user.refresh_from_db()
+            self.assertEqual(user.balance, Decimal('65.00'))
+        self.assertEqual(Withdrawal.objects.filter(status='rejected').count(), 3)
+        self.assertEqual(Withdrawal.objects.filter(status='pending').count(), 6)
+        self.assertEqual(verify_balances(), [])
+
+
+class BonusRollupTests(TestCase):
+    """Сводка бонусов совпадает с агрегатом и читается одним запросом."""
+
+    def setUp(self):
+        self.user = User.objects.create(username='earner', email='earner@example.com')
+        for amount, bonus_type in ((50, 'green'), (25, 'red'), (10, 'red'), (5, 'spillover')):
+            Bonus.objects.create(user=self.user, amount=amount, bonus_type=bonus_type)
+
+    def test_summary_tracks_payout_and_deletion(self):
+        with self.assertNumQueries(1):
+            summary = get_bonus_summary(self.user)
+        self.assertEqual(summary, compute_bonus_summary(self.user))
+        self.assertEqual(summary['red_bonuses'], 2)
+        self.assertEqual(summary['total_amount'], Decimal('90.00'))
+
+        self.assertEqual(mark_bonuses_paid(Bonus.objects.filter(bonus_type='red')), 2)
+        Bonus.objects.filter(bonus_type='spillover').delete()
+        summary = get_bonus_summary(self.user)
+        self.assertEqual(summary, compute_bonus_summary(self.user))
+        self.assertEqual(summary['unpaid_amount'], Decimal('50.00'))
+        self.assertEqual(verify_bonus_rollups(), [])
+
+    def test_save_moves_changed_bonus(self):
+        bonus = Bonus.objects.get(bonus_type='green')
+        bonus.amount, bonus.bonus_type, bonus.is_paid = Decimal('70.00'), 'red', True
+        bonus.save()
+        other = User.objects.create(username='other-earner', email='other-earner@example.com')
+        bonus.user = other
+        bonus.save(update_fields=['user'])
+        bonus.paid_at = timezone.now()
+        with self.assertNumQueries(1):
+            bonus.save(update_fields=['paid_at'])
+        self.assertEqual(get_bonus_summary(self.user), compute_bonus_summary(self.user))
+        self.assertEqual(get_bonus_summary(other)['red_amount'], Decimal('70.00'))
+        self.assertEqual(verify_bonus_rollups(), [])
+
+
+class RankEvaluatorTests(TestCase):
+    """Счетчик партнеров первой линии ведется сигналами, повышение — пакетом."""
+
+    def setUp(self):
+        self.leader = User.objects.create(username='leader', email='leader@example.com', status='partner')
+        self.referrals = [
+            User.objects.create(username=f'ref_{index}', email=f'ref_{index}@example.com', invited_by=self.leader)
+            for index in range(3)
+        ]
+
+    def test_counter_follows_status_and_inviter(self):
+        for referral in self.referrals:
+            referral.status = 'partner'
+            referral.save(update_fields=['status'])
+        self.leader.refresh_from_db()
+        with self.assertNumQueries(0):
+            self.assertTrue(self.leader.can_upgrade_rank())
+
+        other = User.objects.create(username='other', email='other@example.com', status='partner')
+        moved = self.referrals[0]
+        moved.invited_by = other
+        moved.save()
+        self.assertEqual(User.objects.get(id=self.leader.id).direct_partners_count, 2)
+        self.assertEqual(User.objects.get(id=other.id).direct_partners_count, 1)
+
+        self.referrals[1].delete()
+        self.assertEqual(User.objects.get(id=self.leader.id).direct_partners_count, 1)
+        self.assertEqual(verify_partner_counts(), [])
+
+    def test_bulk_promotion_writes_history(self):
+        for referral in self.referrals:
+            referral.status = 'partner'
+            referral.save()
+
+        self.assertEqual(promote_eligible_users(), 1)
+        self.leader.refresh_from_db()
+        self.assertEqual(self.leader.rank, 1)
+        self.assertEqual(RankUpgrade.objects.get(user=self.leader).to_rank, 1)
+
+
+class SubtreeCounterTests(TestCase):
+    """Счетчики поддерева следуют за вставкой, сменой статуса и переносом."""
+
+    def setUp(self):
+        MLMSettings.objects.create(max_partners_per_level=3, is_active=True)
+        self.root = User.objects.create(username='root', email='root@example.com')
+        MLMStructure.objects.create(user=self.root, level=0)
+
+    def _node(self, name, parent_user, position):
+        user = User.objects.create(username=name, email=f'{name}@example.com', invited_by=parent_user)
+        parent_level = MLMStructure.objects.get(user=parent_user).level
+        return MLMStructure.objects.create(user=user, parent=parent_user, position=position, level=parent_level + 1)
+
+    def test_counters_follow_structure_changes(self):
+        first = self._node('first', self.root, 1)
+        second = self._node('second', self.root, 2)
+        grandchild = self._node('grandchild', first.user, 1)
+
+        root_node = MLMStructure.objects.get(user=self.root)
+        self.assertEqual(
+            (root_node.children_count, root_node.descendants_count, root_node.participants_count, root_node.max_depth),
+            (2, 3, 3, 2),
+        )
+
+        grandchild.user.status = 'partner'
+        grandchild.user.save(update_fields=['status'])
+        self.assertEqual(MLMStructure.objects.get(user=self.root).partners_count, 1)
+
+        # Сохранение без статуса и пригласителя не читает прежние значения
+        with self.assertNumQueries(1):
+            grandchild.user.save(update_fields=['first_name'])
+
+        old_path = grandchild.path
+        grandchild.parent = second.user
+        grandchild.position = 1
+        grandchild.save(update_fields=['parent', 'position'])
+        refresh_structure_path(grandchild, old_path)
+        apply_subtree_move(grandchild, old_path)
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.children_count, first.max_depth), (0, 0))
+        self.assertEqual((second.children_count, second.partners_count, second.max_depth), (1, 1, 1))
+        self.assertEqual(verify_counters(), [])
+
+
+class DeepSpilloverTests(TestCase):
+    """Spillover под одним пригласителем строит глубокую цепочку — путь не ограничен по длине."""
+
+    USERS_COUNT = 400
+
+    def test_deep_spillover_and_parent_change(self):
+        root = User.objects.create(username='root', email='root@example.com')
+        MLMStructure.objects.create(user=root, level=0)
+        users = User.objects.bulk_create(
+            User(
+                username=f'deep_{index}', email=f'deep_{index}@example.com',
+                referral_code=f'D{index:07d}', invited_by=root,
+            )
+            for index in range(self.USERS_COUNT)
+        )
+        for user in users:
+            place_user_in_structure(user, root)
+
+        self.assertEqual(MLMStructure.objects.count(), self.USERS_COUNT + 1)
+        deepest = MLMStructure.objects.order_by('-level').first()
+        self.assertGreater(len(deepest.path), 1024)
+        self.assertEqual(deepest.path, deepest.build_path())
+        self.assertEqual(get_subtree_queryset(root).count(), self.USERS_COUNT)
+
+        # Смена родителя обычным save() пересчитывает путь узла и его ветки
+        node = MLMStructure.objects.get(user=users[0])
+        node.parent = None
+        node.save()
+        for structure in MLMStructure.objects.filter(path__startswith=node.path):
+            self.assertEqual(structure.path, structure.build_path())
+
+
+class BatchPlacementTests(TestCase):
+    """Пакетное размещение сверяет родителей под блокировкой и ставит пригласителя первым."""
+
+    def test_inviter_later_in_batch_is_placed_first(self):
+        root = User.objects.create(username='root', email='root@example.com')
+        MLMStructure.objects.create(user=root, level=0)
+        inviter = User.objects.create(username='inviter', email='inviter@example.com', invited_by=root)
+        invitee = User.objects.create(
+            username='invitee', email='invitee@example.com', referral_code='INVITEE1', invited_by=inviter
+        )
+        # Ранее размещенный участник занимает позицию у корня
+        place_user_in_structure(
+            User.objects.create(
+                username='early', email='early@example.com', referral_code='EARLY001', invited_by=root
+            ),
+            root,
+        )
+
+        placements = place_users_in_structure([invitee, inviter])
+
+        self.assertEqual([placement.user_id for placement in placements], [inviter.id, invitee.id])
+        invitee_node = MLMStructure.objects.get(user=invitee)
+        self.assertEqual(invitee_node.parent_id, inviter.id)
+        self.assertEqual(invitee_node.path, invitee_node.build_path())
+        self.assertFalse(
+            MLMStructure.objects.exclude(parent=None)
+            .values('parent', 'position')
+            .annotate(total=Count('id'))
+            .filter(total__gt=1)
+            .exists()
+        )
+        self.assertEqual(verify_counters(), [])
+
+    def test_creation_ordered_batch_matches_sequential_placement(self):
+        def _queue(prefix):
+            pick = random.Random(3)
+            root = User.objects.create(username=f'{prefix}root', email=f'{prefix}root@example.com')
+            MLMStructure.objects.create(user=root, level=0)
+            users = [root]
+            for index in range(60):
+                users.append(
+                    User.objects.create(
+                        username=f'{prefix}{index}',
+                        email=f'{prefix}{index}@example.com',
+                        referral_code=f'{prefix.upper()}{index:06d}',
+                        invited_by=pick.choice(users),
+                    )
+                )
+            return users
+
+        def _shape(users):
+            index = {user.id: number for number, user in enumerate(users)}
+            return sorted(
+                (index[user_id], index[parent_id], position)
+                for user_id, parent_id, position in MLMStructure.objects.filter(
+                    user__in=users[1:]
+                ).values_list('user_id', 'parent_id', 'position')
+            )
+
+        sequential = _queue('s')
+        for user in sequential[1:]:
+            place_user_in_structure(user, user.invited_by)
+        batch = _queue('b')
+        place_users_in_structure(batch[1:])
+
+        self.assertEqual(_shape(batch), _shape(sequential))
+        self.assertEqual(verify_counters(), [])
+
+
+class SubtreeMoveTests(TestCase):
+    """Перенос ветки не зависит от её размера по числу запросов."""
+
+    def setUp(self):
+        MLMSettings.objects.create(max_partners_per_level=3, is_active=True)
+        self.root = User.objects.create(username='root', email='root@example.com')
+        MLMStructure.objects.create(user=self.root, level=0)
+
+    def _chain(self, prefix, parent_user, length, position=1):
+        nodes = []
+        for index in range(length):
+            user = User.objects.create(username=f'{prefix}{index}', email=f'{prefix}{index}@example.com')
+            parent_level = MLMStructure.objects.get(user=parent_user).level
+            nodes.append(
+                MLMStructure.objects.create(
+                    user=user, parent=parent_user, position=position if index == 0 else 1, level=parent_level + 1
+                )
+            )
+            parent_user = user
+        return nodes
+
+    def _move_queries(self, node, new_parent):
+        with CaptureQueriesContext(connection) as captured:
+            move_subtree(node, new_parent)
+        return len(captured)
+
+    def test_move_relevels_subtree_with_constant_queries(self):
+        left = self._chain('left', self.root, 2)
+        short_branch = self._chain('short', left[1].user, 3)
+        long_branch = self._chain('long', left[1].user, 30, position=2)
+        target = self._chain('target', self.root, 1, position=2)[0]
+
+        short_queries = self._move_queries(short_branch[0], target.user)
+        long_queries = self._move_queries(long_branch[0], target.user)
+
+        self.assertEqual(short_queries, long_queries)
+        for node in MLMStructure.objects.filter(user__username__startswith='long'):
+            self.assertEqual(node.path, node.build_path())
+        deepest = MLMStructure.objects.get(user__username='long29')
+        self.assertEqual(deepest.level, target.level + 30)
+        self.assertEqual(verify_counters(), [])
+
+        with self.assertRaises(StructureMoveError):
+            move_subtree(MLMStructure.objects.get(user=target.user), deepest.user)
+
+    def test_move_to_full_parent_is_rejected(self):
+        children = [self._chain(f'child{index}_', self.root, 1, position=index + 1)[0] for index in range(3)]
+        outsider = self._chain('outsider', children[0].user, 1)[0]
+
+        with self.assertRaises(StructureMoveError):
+            move_subtree(outsider, self.root)
+        self.assertEqual(MLMStructure.objects.get(pk=outsider.pk).parent, children[0].user)
+
+        # Перенос под текущего родителя не упирается в собственную позицию
+        moved = move_subtree(children[2], self.root)
+        self.assertEqual(moved.parent, self.root)
+        self.assertEqual(MLMStructure.objects.filter(parent=self.root).count(), 3)
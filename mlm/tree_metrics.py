@@ -0,0 +1,135 @@
+"""
+Метрики дерева структуры без рекурсии.
+Узлы раскладываются в компактные целочисленные массивы (array): индекс
+родителя, список детей в формате CSR и порядок обхода в ширину. Глубина
+считается прямым проходом по этому порядку, размеры поддеревьев и
+«вычисленный уровень» — обратным (дети раньше родителей), поэтому глубина
+цепочки не упирается в лимит рекурсии Python.
+
+Вычисленный уровень — тринарное правило: уровень узла равен k, если хотя бы
+у трех его детей уровень не ниже k - 1; узел меньше чем с тремя детьми
+имеет нулевой уровень.
+"""
+
+from array import array
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Сколько детей нужно для перехода на следующий вычисленный уровень
+LEVEL_WIDTH = 3
+
+
+@dataclass
+class TreeMetrics:
+    """Метрики по узлам; все массивы выровнены по ids."""
+
+    ids: array
+    index: Dict[int, int]
+    parent: array
+    depth: array
+    children: array
+    descendants: array
+    computed_level: array
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def get(self, user_id: int, metric: str, default: int = 0) -> int:
+        position = self.index.get(user_id)
+        return default if position is None else getattr(self, metric)[position]
+
+    def level_histogram(
+        self,
+        metric: str = "computed_level",
+        labels: Optional[Sequence[str]] = None,
+        positions: Optional[Iterable[int]] = None,
+    ) -> Dict[int, Dict[str, int]]:
+        """
+        Число узлов на каждом значении метрики (computed_level или depth);
+        с labels — еще и по категориям, например по статусам пользователей.
+        positions ограничивает подсчет частью узлов.
+        """
+        values = getattr(self, metric)
+        histogram: Dict[int, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        for position in range(len(values)) if positions is None else positions:
+            entry = histogram[values[position]]
+            entry["total"] += 1
+            if labels is not None:
+                entry[labels[position]] += 1
+        return {value: dict(entry) for value, entry in sorted(histogram.items())}
+
+
+def compute_tree_metrics(nodes: Iterable[Tuple[int, Optional[int]]]) -> TreeMetrics:
+    """
+    Метрики для пар (user_id, parent_id). Узел, чей родитель не входит в
+    выборку, считается корнем — так обрабатываются поддеревья и окна по
+    глубине. Узлы в цикле, не достижимые от корней, получают глубину -1.
+    """
+    ids = array("q")
+    parent_ids: List[Optional[int]] = []
+    for user_id, parent_id in nodes:
+        ids.append(user_id)
+        parent_ids.append(parent_id)
+    size = len(ids)
+    index = {user_id: position for position, user_id in enumerate(ids)}
+
+    parent = array("q", (index.get(parent_id, -1) for parent_id in parent_ids))
+    children = array("q", bytes(8 * size))
+    for position in range(size):
+        if parent[position] >= 0:
+            children[parent[position]] += 1
+
+    # CSR: дети узла i лежат в child_list[offsets[i]:offsets[i + 1]]
+    offsets = array("q", bytes(8 * (size + 1)))
+    for position in range(size):
+        offsets[position + 1] = offsets[position] + children[position]
+    fill = array("q", offsets[:size])
+    child_list = array("q", bytes(8 * size))
+    for position in range(size):
+        parent_position = parent[position]
+        if parent_position >= 0:
+            child_list[fill[parent_position]] = position
+            fill[parent_position] += 1
+
+    # Обход в ширину от корней; order растет по ходу цикла
+    depth = array("q", [-1]) * size
+    order = array("q")
+    for position in range(size):
+        if parent[position] < 0:
+            depth[position] = 0
+            order.append(position)
+    cursor = 0
+    while cursor < len(order):
+        position = order[cursor]
+        cursor += 1
+        for child in child_list[offsets[position]:offsets[position + 1]]:
+            depth[child] = depth[position] + 1
+            order.append(child)
+
+    # Обратный проход: к моменту обработки узла все его дети уже посчитаны.
+    # Для уровня достаточно трех наибольших уровней детей.
+    descendants = array("q", bytes(8 * size))
+    computed_level = array("q", bytes(8 * size))
+    top = [array("q", [-1]) * size for _ in range(LEVEL_WIDTH)]
+    for position in reversed(order):
+        if top[-1][position] >= 0:
+            computed_level[position] = top[-1][position] + 1
+        parent_position = parent[position]
+        if parent_position < 0:
+            continue
+        descendants[parent_position] += descendants[position] + 1
+        value = computed_level[position]
+        for rank in range(LEVEL_WIDTH):
+            if value > top[rank][parent_position]:
+                value, top[rank][parent_position] = top[rank][parent_position], value
+
+    return TreeMetrics(
+        ids=ids,
+        index=index,
+        parent=parent,
+        depth=depth,
+        children=children,
+        descendants=descendants,
+        computed_level=computed_level,
+    )
@@ -5,7 +5,8 @@ from django.http import JsonResponse
 from django.db import transaction
 from django.utils import timezone
 from .models import Bonus, Withdrawal, MLMSettings, RankUpgrade
-from mlm.services import get_bonus_summary, get_structure_statistics, upgrade_user_rank
+from mlm.services import get_bonus_summary, get_structure_statistics, post_debit, upgrade_user_rank
+from mlm.services.ledger import InsufficientBalance
 from users.models import User
 
 
@@ -92,13 +93,21 @@ def withdraw(request):
                     status='pending'
                 )
                 
-                # Резервируем средства (уменьшаем баланс)
-                user.balance -= amount
-                user.save()
+                # Резервируем средства проводкой (остаток проверяется в самом UPDATE)
+                post_debit(
+                    user,
+                    amount,
+                    'withdrawal',
+                    withdrawal=withdrawal,
+                    description=f'Запрос на вывод #{withdrawal.id}',
+                )
                 
                 messages.success(request, f'Запрос на вывод {amount}$ создан и отправлен на рассмотрение')
                 return redirect('mlm:withdraw')
                 
+        except InsufficientBalance:
+            messages.error(request, 'Недостаточно средств на балансе')
+            return render(request, 'mlm/withdraw.html')
         except Exception as e:
             messages.error(request, f'Ошибка при создании запроса на вывод: {str(e)}')
     
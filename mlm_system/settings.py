@@ -178,6 +178,37 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Custom user model
 AUTH_USER_MODEL = 'users.User'
 
+# Стратегия размещения в структуре: least_filled, first_fit или leftmost_deepest
+MLM_PLACEMENT_STRATEGY = config('MLM_PLACEMENT_STRATEGY', default='least_filled')
+
+# Фоновые задачи завершения регистрации: eager — в процессе после коммита,
+# celery — через брокер, deferred — командой process_registration_jobs
+CELERY_BROKER_URL = config('CELERY_BROKER_URL', default='')
+MLM_JOBS_MODE = config('MLM_JOBS_MODE', default='celery' if CELERY_BROKER_URL else 'eager')
+
+# Периодические задачи celery beat. Без celery то же запускает cron:
+# 5 * * * * python manage.py rollup_system_stats
+# * * * * * python manage.py process_registration_jobs
+# * * * * * python manage.py process_webhooks  (или постоянно: process_webhooks --loop)
+CELERY_BEAT_SCHEDULE = {
+    'rollup-system-stats': {
+        'task': 'admin_panel.tasks.rollup_system_stats_task',
+        'schedule': 60 * 60,
+    },
+    'process-registration-jobs': {
+        'task': 'mlm.tasks.process_pending_registration_jobs_task',
+        'schedule': 60,
+    },
+    'process-webhook-inbox': {
+        'task': 'payments.tasks.process_webhook_inbox_task',
+        'schedule': 60,
+    },
+}
+
+# Общий секрет платежного шлюза: callback принимается только с заголовком
+# X-Signature = HMAC-SHA256(тело запроса). Без секрета callback'и отклоняются
+PAYMENT_WEBHOOK_SECRET = config('PAYMENT_WEBHOOK_SECRET', default='')
+
 # Authentication settings
 LOGIN_URL = '/accounts/login/'
 LOGIN_REDIRECT_URL = '/admin-panel/'
@@ -207,13 +238,29 @@ SESSION_COOKIE_HTTPONLY = True
 SESSION_COOKIE_SECURE = False
 
 
-# Caching configuration for sessions
-CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        'LOCATION': 'unique-snowflake',
+# Caching configuration for sessions.
+# Версии кэшей (настройки MLM, снимки структуры) должны быть общими для всех
+# воркеров gunicorn и Celery, поэтому в проде кэш — Redis (REDIS_URL или
+# redis-брокер Celery). LocMem живет в одном процессе и годится только для
+# разработки; проверка mlm.W001 предупреждает о нем при DEBUG=False.
+REDIS_URL = config(
+    'REDIS_URL',
+    default=CELERY_BROKER_URL if CELERY_BROKER_URL.startswith(('redis://', 'rediss://')) else '',
+)
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'unique-snowflake',
+        }
     }
-}
 
 # Use cache for sessions
 SESSION_ENGINE = 'django.contrib.sessions.backends.cache'
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from payments.services import WEBHOOK_BATCH_SIZE, process_webhook_inbox
+
+
+class Command(BaseCommand):
+    help = 'Обрабатывает входящие события платежного шлюза пачками (вне режима celery или догон)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=WEBHOOK_BATCH_SIZE,
+            help='Сколько событий брать за один проход'
+        )
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Работать постоянно, опрашивая inbox'
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=1.0,
+            help='Пауза между проходами в режиме --loop (секунды)'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            processed = process_webhook_inbox(limit=options['limit'])
+            if processed:
+                self.stdout.write(f"✅ Обработано событий: {processed}")
+            if not processed:
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
@@ -0,0 +1,65 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from payments.models import WebhookEvent
+from payments.services import process_webhook_inbox, requeue_webhook_events
+
+
+class Command(BaseCommand):
+    help = 'Повторно обрабатывает сохраненные события платежного шлюза'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--ids',
+            type=int,
+            nargs='+',
+            help='Идентификаторы событий'
+        )
+        parser.add_argument(
+            '--transaction-id',
+            help='Все события по транзакции'
+        )
+        parser.add_argument(
+            '--since',
+            help='События, полученные начиная с даты (ISO 8601)'
+        )
+        parser.add_argument(
+            '--status',
+            default='failed',
+            choices=['failed', 'processed', 'all'],
+            help='Какие события переигрывать (по умолчанию failed)'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать, сколько событий будет переиграно'
+        )
+
+    def handle(self, *args, **options):
+        events = WebhookEvent.objects.all()
+        if options['status'] != 'all':
+            events = events.filter(status=options['status'])
+        if options['ids']:
+            events = events.filter(id__in=options['ids'])
+        if options['transaction_id']:
+            events = events.filter(transaction_id=options['transaction_id'])
+        if options['since']:
+            since = parse_datetime(options['since'])
+            if since is None:
+                raise CommandError('Неверный формат --since')
+            events = events.filter(received_at__gte=since)
+
+        if options['dry_run']:
+            self.stdout.write(f"👀 Будет переиграно событий: {events.count()}")
+            return
+
+        requeued = requeue_webhook_events(events)
+        processed = 0
+        while True:
+            batch = process_webhook_inbox()
+            if not batch:
+                break
+            processed += batch
+        self.stdout.write(self.style.SUCCESS(
+            f'🔁 Возвращено в очередь: {requeued}, обработано: {processed}'
+        ))
@@ -0,0 +1,150 @@
+import random
+import statistics
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from mlm.models import Payment, RegistrationJob
+from payments.models import WebhookEvent
+from payments.services import sign_webhook
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = 'Нагрузочный тест callback\'ов: создает платежи и отправляет на локальный сервер N callback\'ов с повторами (inbox разбирает celery или process_webhooks --loop)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url',
+            default='http://127.0.0.1:8000/payments/callback/',
+            help='Адрес callback\'а запущенного сервера'
+        )
+        parser.add_argument(
+            '--count',
+            type=int,
+            default=10_000,
+            help='Сколько callback\'ов отправить'
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=32,
+            help='Число параллельных отправителей'
+        )
+        parser.add_argument(
+            '--duplicate-rate',
+            type=float,
+            default=0.1,
+            help='Доля callback\'ов, повторяющих уже отправленный (ретраи шлюза)'
+        )
+        parser.add_argument(
+            '--wait',
+            type=float,
+            default=60.0,
+            help='Сколько секунд ждать обработки inbox перед проверкой'
+        )
+        parser.add_argument(
+            '--secret',
+            default=None,
+            help='Секрет подписи callback\'ов (по умолчанию PAYMENT_WEBHOOK_SECRET)'
+        )
+        parser.add_argument(
+            '--keep',
+            action='store_true',
+            help='Не удалять созданные платежи и события'
+        )
+
+    def handle(self, *args, **options):
+        run_id = uuid.uuid4().hex[:8]
+        count = options['count']
+        unique = max(1, int(count * (1 - options['duplicate_rate'])))
+        self.secret = options['secret'] or settings.PAYMENT_WEBHOOK_SECRET
+
+        user = User.objects.create(
+            username=f'webhook_load_{run_id}',
+            email=f'webhook_load_{run_id}@example.com',
+            password='!',
+        )
+        transaction_ids = [f'LT-{run_id}-{index:07d}' for index in range(unique)]
+        Payment.objects.bulk_create(
+            (
+                Payment(
+                    user=user,
+                    amount=Decimal('1.00'),
+                    payment_type='upgrade',
+                    status='pending',
+                    transaction_id=transaction_id,
+                )
+                for transaction_id in transaction_ids
+            ),
+            batch_size=1000,
+        )
+        callbacks = transaction_ids + random.choices(transaction_ids, k=count - unique)
+        random.shuffle(callbacks)
+        self.stdout.write(f"🚀 {count} callback'ов ({unique} уникальных) → {options['url']}")
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            results = list(pool.map(lambda tid: self._post(options['url'], tid), callbacks))
+        elapsed = time.perf_counter() - started
+
+        latencies = sorted(latency for _, latency in results)
+        errors = sum(1 for status, _ in results if status != 200)
+        self.stdout.write(
+            f"📨 {count / elapsed:.0f} запросов/с, ошибок: {errors}, "
+            f"p50 {self._percentile(latencies, 50):.1f} мс, "
+            f"p95 {self._percentile(latencies, 95):.1f} мс, "
+            f"p99 {self._percentile(latencies, 99):.1f} мс, "
+            f"среднее {statistics.mean(latencies):.1f} мс"
+        )
+
+        payments = Payment.objects.filter(transaction_id__in=transaction_ids)
+        deadline = time.monotonic() + options['wait']
+        while payments.exclude(status='completed').exists() and time.monotonic() < deadline:
+            time.sleep(0.5)
+
+        completed = payments.filter(status='completed').count()
+        events = WebhookEvent.objects.filter(transaction_id__startswith=f'LT-{run_id}-')
+        jobs = RegistrationJob.objects.filter(payment__in=payments).count()
+        self.stdout.write(
+            f"🧾 Событий в inbox: {events.count()}, платежей завершено: {completed}/{unique}, "
+            f"задач регистрации: {jobs}"
+        )
+        if events.count() == unique and completed == unique and jobs == unique:
+            self.stdout.write(self.style.SUCCESS('✅ Каждый платеж обработан ровно один раз'))
+        else:
+            self.stdout.write(self.style.WARNING('⚠️ Обработка не завершена или есть дубликаты'))
+
+        if not options['keep']:
+            events.delete()
+            user.delete()
+
+    def _post(self, url, transaction_id):
+        body = urlencode({'transaction_id': transaction_id, 'status': 'success', 'amount': '1.00'}).encode()
+        request = Request(url, data=body, headers={
+            'Content-Type': 'application/x-www-form-urlencoded',
+            'X-Signature': sign_webhook(body, self.secret),
+        })
+        started = time.perf_counter()
+        try:
+            with urlopen(request, timeout=30) as response:
+                status = response.status
+        except HTTPError as e:
+            status = e.code
+        except URLError:
+            status = 0
+        return status, (time.perf_counter() - started) * 1000
+
+    @staticmethod
+    def _percentile(values, percent):
+        if not values:
+            return 0.0
+        index = min(len(values) - 1, int(len(values) * percent / 100))
+        return values[index]
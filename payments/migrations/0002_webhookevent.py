@@ -0,0 +1,36 @@
+# Generated by Django 5.2.1 on 2026-10-18 19:09
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebhookEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_key', models.CharField(max_length=200, unique=True)),
+                ('transaction_id', models.CharField(db_index=True, max_length=100)),
+                ('payment_status', models.CharField(max_length=20)),
+                ('amount', models.CharField(blank=True, max_length=32)),
+                ('payload', models.JSONField(blank=True, default=dict)),
+                ('status', models.CharField(choices=[('pending', 'Ожидает'), ('processed', 'Обработан'), ('failed', 'Ошибка')], default='pending', max_length=20)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('received_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Событие платежного шлюза',
+                'verbose_name_plural': 'События платежного шлюза',
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['status', 'id'], name='payments_webhook_status_idx')],
+            },
+        ),
+    ]
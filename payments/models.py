@@ -48,4 +48,41 @@ class PaymentGateway(models.Model):
     
     class Meta:
         verbose_name = 'Платежный шлюз'
-        verbose_name_plural = 'Платежные шлюзы'
\ No newline at end of file
+        verbose_name_plural = 'Платежные шлюзы'
+
+
+class WebhookEvent(models.Model):
+    """Входящий callback платежного шлюза (inbox): сохраняется сразу, обрабатывается пачками"""
+    
+    STATUS_CHOICES = [
+        ('pending', 'Ожидает'),
+        ('processed', 'Обработан'),
+        ('failed', 'Ошибка'),
+    ]
+    
+    # Ключ идемпотентности: id события шлюза или transaction_id + статус
+    event_key = models.CharField(max_length=200, unique=True)
+    transaction_id = models.CharField(max_length=100, db_index=True)
+    payment_status = models.CharField(max_length=20)
+    amount = models.CharField(max_length=32, blank=True)
+    payload = models.JSONField(default=dict, blank=True)
+    
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    
+    received_at = models.DateTimeField(default=timezone.now)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    # Упавшее событие не берется повторно раньше этого времени (экспоненциальная пауза)
+    next_attempt_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    
+    def __str__(self):
+        return f"{self.event_key} ({self.get_status_display()})"
+    
+    class Meta:
+        verbose_name = 'Событие платежного шлюза'
+        verbose_name_plural = 'События платежного шлюза'
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['status', 'id'], name='payments_webhook_status_idx'),
+        ]
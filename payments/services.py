@@ -0,0 +1,208 @@
+"""
+Входящие callback'и платежного шлюза (inbox).
+Запрос проверяет HMAC-подпись, только сохраняет событие с уникальным
+ключом и сразу отвечает; повтор того же callback'а упирается в уникальный
+индекс. Обработку ведет celery-задача или команда process_webhooks, а не
+запрос. Событие, чей платеж еще не найден, получает паузу next_attempt_at
+и берется снова очередным проходом: в celery его запускает beat
+(CELERY_BEAT_SCHEDULE), без celery — cron или воркер:
+    * * * * * python manage.py process_webhooks
+    python manage.py process_webhooks --loop
+Обработка идет пачками: платежи читаются и блокируются одним запросом, статусы меняются
+общими UPDATE, задачи регистрации ставятся одним INSERT.
+"""
+
+import hashlib
+import hmac
+import logging
+from collections import defaultdict
+from datetime import timedelta
+from typing import Dict, Mapping, Optional, Tuple
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from mlm.models import Payment
+from mlm.services.jobs import JOB_MODE_CELERY, enqueue_registration_batch, get_job_mode
+
+from .models import WebhookEvent
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_BATCH_SIZE = 500
+MAX_WEBHOOK_ATTEMPTS = 5
+# Пауза перед повтором: 30 с, 1 мин, 2 мин, ...
+WEBHOOK_RETRY_BACKOFF = timedelta(seconds=30)
+SIGNATURE_HEADER = "HTTP_X_SIGNATURE"
+
+
+def sign_webhook(body: bytes, secret: str) -> str:
+    return hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+def verify_webhook_signature(body: bytes, signature: Optional[str]) -> bool:
+    """
+    Проверяет подпись тела callback'а общим секретом PAYMENT_WEBHOOK_SECRET.
+    Пока секрет не задан, callback'и не принимаются.
+    """
+    secret = getattr(settings, "PAYMENT_WEBHOOK_SECRET", "")
+    if not secret:
+        logger.warning("PAYMENT_WEBHOOK_SECRET не задан, callback отклонен")
+        return False
+    if not signature:
+        return False
+    return hmac.compare_digest(sign_webhook(body, secret), signature.strip().lower())
+
+
+def get_webhook_retry_delay(attempts: int) -> timedelta:
+    return WEBHOOK_RETRY_BACKOFF * 2 ** max(attempts - 1, 0)
+
+
+def build_event_key(data: Mapping) -> str:
+    """
+    Ключ идемпотентности события: собственный id события шлюза, если он есть,
+    иначе пара transaction_id + статус (повторная доставка того же перехода).
+    """
+    event_id = data.get("event_id")
+    if event_id:
+        return f"event:{event_id}"
+    return f"{data.get('transaction_id')}:{data.get('status')}"
+
+
+def ingest_webhook(data: Mapping) -> Tuple[Optional[WebhookEvent], bool]:
+    """
+    Сохраняет callback в inbox. Возвращает (событие, создано);
+    для дубликата — (None, False). Событие здесь не обрабатывается: после
+    коммита только будится celery-задача, иначе inbox разбирает
+    process_webhooks.
+    """
+    transaction_id = data.get("transaction_id")
+    status = data.get("status")
+    if not transaction_id or not status:
+        raise ValueError("transaction_id и status обязательны")
+
+    try:
+        with transaction.atomic():
+            event = WebhookEvent.objects.create(
+                event_key=build_event_key(data)[:200],
+                transaction_id=transaction_id,
+                payment_status=status,
+                amount=data.get("amount") or "",
+                payload=data.dict() if hasattr(data, "dict") else dict(data),
+            )
+    except IntegrityError:
+        return None, False
+
+    transaction.on_commit(dispatch_webhook_processing)
+    return event, True
+
+
+def dispatch_webhook_processing() -> None:
+    """
+    Будит celery-задачу inbox. В режимах eager и deferred запрос событие не
+    обрабатывает — inbox разбирает process_webhooks по cron или с --loop.
+    """
+    if get_job_mode() != JOB_MODE_CELERY:
+        return
+    from payments.tasks import process_webhook_inbox_task
+
+    if process_webhook_inbox_task is not None:
+        process_webhook_inbox_task.delay()
+    else:
+        logger.warning("Celery недоступен, события ждут process_webhooks")
+
+
+def process_webhook_inbox(limit: int = WEBHOOK_BATCH_SIZE) -> int:
+    """
+    Обрабатывает пачку ожидающих событий и упавших, у которых истекла
+    пауза, и возвращает их число. Только что упавшие события получают
+    паузу, поэтому цикл разбора на них не зацикливается.
+    События берутся с SKIP LOCKED, платежи блокируются: параллельные
+    воркеры не возьмут одно событие дважды, а переход платежа в completed
+    срабатывает один раз, сколько бы событий о нем ни пришло.
+    """
+    with transaction.atomic():
+        events = list(
+            WebhookEvent.objects.select_for_update(skip_locked=True)
+            .filter(
+                Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=timezone.now()),
+                status__in=["pending", "failed"],
+                attempts__lt=MAX_WEBHOOK_ATTEMPTS,
+            )
+            .order_by("id")[:limit]
+        )
+        if not events:
+            return 0
+
+        payments = {
+            payment.transaction_id: payment
+            for payment in Payment.objects.select_for_update(of=("self",))
+            .select_related("user")
+            .filter(transaction_id__in={event.transaction_id for event in events})
+        }
+
+        now = timezone.now()
+        completed = {}
+        failed = {}
+        errors: Dict[int, str] = {}
+        for event in events:
+            payment = payments.get(event.transaction_id)
+            if payment is None:
+                errors[event.id] = "Payment not found"
+                continue
+
+            if event.payment_status == "success" and payment.status != "completed":
+                payment.status = "completed"
+                payment.completed_at = now
+                completed[payment.id] = payment
+                failed.pop(payment.id, None)
+                if payment.payment_type == "registration":
+                    # Через save: смена статуса обновляет счетчики структуры.
+                    payment.user.status = "partner"
+                    payment.user.last_payment_date = now
+                    payment.user.save(update_fields=["status", "last_payment_date"])
+            elif event.payment_status == "failed" and payment.status == "pending":
+                payment.status = "failed"
+                failed[payment.id] = payment
+
+        if completed:
+            Payment.objects.filter(id__in=list(completed)).exclude(status="completed").update(
+                status="completed", completed_at=now
+            )
+            # Размещение и бонусы выполняются задачами после коммита
+            enqueue_registration_batch(completed.values())
+        if failed:
+            Payment.objects.filter(id__in=list(failed), status="pending").update(status="failed")
+
+        processed_ids = [event.id for event in events if event.id not in errors]
+        WebhookEvent.objects.filter(id__in=processed_ids).update(
+            status="processed",
+            attempts=F("attempts") + 1,
+            last_error="",
+            processed_at=now,
+            next_attempt_at=None,
+        )
+        by_error = defaultdict(list)
+        for event in events:
+            if event.id in errors:
+                by_error[errors[event.id], event.attempts + 1].append(event.id)
+        for (error, attempts), event_ids in by_error.items():
+            WebhookEvent.objects.filter(id__in=event_ids).update(
+                status="failed",
+                attempts=attempts,
+                last_error=error,
+                next_attempt_at=now + get_webhook_retry_delay(attempts),
+            )
+    return len(events)
+
+
+def requeue_webhook_events(events) -> int:
+    """
+    Возвращает события в очередь для повторной обработки (инструмент replay).
+    Повтор безопасен: уже завершенные платежи и задачи повторно не срабатывают.
+    """
+    return events.update(
+        status="pending", attempts=0, last_error="", processed_at=None, next_attempt_at=None
+    )
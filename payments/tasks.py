@@ -0,0 +1,24 @@
+try:
+    from celery import shared_task
+except ImportError:
+    shared_task = None
+
+from payments.services import process_webhook_inbox
+
+process_webhook_inbox_task = None
+
+if shared_task is not None:
+
+    @shared_task
+    def process_webhook_inbox_task():
+        """
+        Обрабатывает пачки inbox, пока в нем есть ожидающие события. Будится
+        после callback'а и раз в минуту из beat — подбирает события, у
+        которых истекла пауза повтора.
+        """
+        total = 0
+        while True:
+            processed = process_webhook_inbox()
+            total += processed
+            if not processed:
+                return total
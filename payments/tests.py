@@ -1,3 +1,80 @@
-from django.test import TestCase
+from urllib.parse import urlencode
 
-# Create your tests here.
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from mlm.models import MLMSettings, MLMStructure, Payment, RegistrationJob
+from payments.models import WebhookEvent
+from payments.services import process_webhook_inbox, sign_webhook
+from users.models import User
+
+
+@override_settings(PAYMENT_WEBHOOK_SECRET='test-secret')
+class WebhookInboxTests(TestCase):
+    """Callback подтверждается сразу, повторы шлюза не обрабатываются второй раз."""
+
+    def setUp(self):
+        MLMSettings.objects.create(max_partners_per_level=3, is_active=True)
+        self.inviter = User.objects.create(username='inviter', email='inviter@example.com')
+        MLMStructure.objects.create(user=self.inviter, level=0)
+        self.user = User.objects.create(username='payer', email='payer@example.com', invited_by=self.inviter)
+        self.payment = Payment.objects.create(
+            user=self.user, amount=100, payment_type='registration', transaction_id='TX-1'
+        )
+        self.client = Client(enforce_csrf_checks=True)
+
+    def _callback(self, transaction_id='TX-1', status='success', signature=None):
+        body = urlencode({'transaction_id': transaction_id, 'status': status, 'amount': '100'})
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(
+                reverse('payments:payment_callback'),
+                body,
+                content_type='application/x-www-form-urlencoded',
+                HTTP_X_SIGNATURE=signature or sign_webhook(body.encode(), 'test-secret'),
+            )
+
+    def _drain(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return process_webhook_inbox()
+
+    def test_duplicate_callbacks_complete_payment_once(self):
+        first = self._callback()
+        second = self._callback()
+
+        self.assertEqual(first.json(), {'status': 'ok', 'duplicate': False})
+        self.assertEqual(second.json(), {'status': 'ok', 'duplicate': True})
+        # Запрос только сохраняет событие, обработка — дело воркера
+        self.assertEqual(WebhookEvent.objects.get().status, 'pending')
+        self.assertEqual(Payment.objects.get(id=self.payment.id).status, 'pending')
+
+        self.assertEqual(self._drain(), 1)
+        self.assertEqual(WebhookEvent.objects.get().status, 'processed')
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'completed')
+        self.assertEqual(RegistrationJob.objects.get(payment=self.payment).status, 'completed')
+        self.assertEqual(self.user.mlm_structure.parent, self.inviter)
+
+    def test_unsigned_callback_is_rejected_before_storing(self):
+        response = self._callback(signature='0' * 64)
+
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(WebhookEvent.objects.exists())
+
+    def test_unknown_payment_is_retried_after_backoff(self):
+        self._callback(transaction_id='TX-LATE')
+        self.assertEqual(self._drain(), 1)
+        event = WebhookEvent.objects.get()
+        self.assertEqual((event.status, event.attempts), ('failed', 1))
+        self.assertGreater(event.next_attempt_at, timezone.now())
+
+        # До истечения паузы проход inbox событие не берет, после — повторяет
+        self.payment.transaction_id = 'TX-LATE'
+        self.payment.save(update_fields=['transaction_id'])
+        self.assertEqual(self._drain(), 0)
+        WebhookEvent.objects.filter(id=event.id).update(next_attempt_at=timezone.now())
+        self.assertEqual(self._drain(), 1)
+
+        event.refresh_from_db()
+        self.assertEqual(event.status, 'processed')
+        self.assertEqual(Payment.objects.get(id=self.payment.id).status, 'completed')
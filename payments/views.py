@@ -3,10 +3,10 @@ from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.http import JsonResponse
 from django.db import transaction
-from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
 from .models import PaymentMethod, PaymentGateway
+from .services import SIGNATURE_HEADER, ingest_webhook, verify_webhook_signature
 from mlm.models import Payment
-from mlm.services import calculate_bonuses
 from users.models import User
 import uuid
 
@@ -70,43 +70,22 @@ def create_payment(request):
     })
 
 
+@csrf_exempt
 def payment_callback(request):
-    """Callback от платежного шлюза"""
+    """Callback от платежного шлюза: подписанное событие сохраняется в inbox и подтверждается сразу"""
     
     if request.method == 'POST':
-        # Получение данных от платежного шлюза
-        transaction_id = request.POST.get('transaction_id')
-        status = request.POST.get('status')
-        amount = request.POST.get('amount')
-        
+        if not verify_webhook_signature(request.body, request.META.get(SIGNATURE_HEADER)):
+            return JsonResponse({'error': 'Invalid signature'}, status=403)
         try:
-            payment = Payment.objects.get(transaction_id=transaction_id)
-            
-            with transaction.atomic():
-                if status == 'success':
-                    payment.status = 'completed'
-                    payment.completed_at = timezone.now()
-                    payment.save()
-                    
-                    # Обновление статуса пользователя если это регистрация
-                    if payment.payment_type == 'registration':
-                        payment.user.status = 'partner'
-                        payment.user.last_payment_date = timezone.now()
-                        payment.user.save()
-                    
-                    # Расчет бонусов
-                    calculate_bonuses(payment.user, payment)
-                    
-                elif status == 'failed':
-                    payment.status = 'failed'
-                    payment.save()
-                
-                return JsonResponse({'status': 'ok'})
-                
-        except Payment.DoesNotExist:
-            return JsonResponse({'error': 'Payment not found'}, status=404)
+            event, created = ingest_webhook(request.POST)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
         except Exception as e:
             return JsonResponse({'error': str(e)}, status=500)
+        
+        # Повтор того же callback'а подтверждаем, но не обрабатываем второй раз
+        return JsonResponse({'status': 'ok', 'duplicate': not created})
     
     return JsonResponse({'error': 'Invalid request method'}, status=405)
 
@@ -29,7 +29,7 @@ class Command(BaseCommand):
                 )
                 if created:
                     root_admin.set_password('admin123')
-                    root_admin.save()
+                    root_admin.save(update_fields=['password'])
                     self.stdout.write(
                         self.style.SUCCESS('✅ Создан root admin: admin / admin123')
                     )
@@ -38,7 +38,9 @@ class Command(BaseCommand):
                     if not root_admin.is_superuser:
                         root_admin.is_superuser = True
                         root_admin.is_staff = True
-                        root_admin.save()
+                        # Без update_fields сохранение затрет счетчики и баланс,
+                        # которые ведутся атомарными UPDATE
+                        root_admin.save(update_fields=['is_superuser', 'is_staff'])
                         self.stdout.write(
                             self.style.SUCCESS('✅ Пользователь admin повышен до root admin')
                         )
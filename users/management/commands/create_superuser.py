@@ -50,7 +50,8 @@ class Command(BaseCommand):
                     existing_user.is_staff = True
                     existing_user.email = email
                     existing_user.set_password(password)
-                    existing_user.save()
+                    # Только изменяемые поля: счетчики и баланс ведутся атомарными UPDATE
+                    existing_user.save(update_fields=['is_superuser', 'is_staff', 'email', 'password'])
                     self.stdout.write(
                         self.style.SUCCESS(f'✅ Суперпользователь {username} обновлён!')
                     )
@@ -64,7 +65,7 @@ class Command(BaseCommand):
                         # Делаем существующего пользователя суперпользователем
                         existing_user.is_superuser = True
                         existing_user.is_staff = True
-                        existing_user.save()
+                        existing_user.save(update_fields=['is_superuser', 'is_staff'])
                         self.stdout.write(
                             self.style.SUCCESS(f'✅ Пользователь {username} повышен до суперпользователя!')
                         )
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.1 on 2026-10-18 19:04
+
+from django.db import migrations, models
+
+
+def backfill_direct_partners_count(apps, schema_editor):
+    User = apps.get_model('users', 'User')
+
+    by_count = {}
+    rows = (
+        User.objects.filter(status='partner', invited_by__isnull=False)
+        .values('invited_by_id')
+        .annotate(total=models.Count('id'))
+        .values_list('invited_by_id', 'total')
+    )
+    for inviter_id, total in rows.iterator():
+        by_count.setdefault(total, []).append(inviter_id)
+    for total, inviter_ids in by_count.items():
+        for start in range(0, len(inviter_ids), 500):
+            User.objects.filter(id__in=inviter_ids[start:start + 500]).update(direct_partners_count=total)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='direct_partners_count',
+            field=models.PositiveIntegerField(db_index=True, default=0),
+        ),
+        migrations.RunPython(backfill_direct_partners_count, migrations.RunPython.noop),
+    ]
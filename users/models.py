@@ -37,6 +37,8 @@ class User(AbstractUser):
     invited_by = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='referrals')
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='participant')
     rank = models.IntegerField(choices=RANK_CHOICES, default=0)
+    # Партнеры первой линии (приглашенные со статусом partner), ведется сигналами
+    direct_partners_count = models.PositiveIntegerField(default=0, db_index=True)
     
     # Финансовые поля
     balance = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
@@ -68,7 +70,7 @@ class User(AbstractUser):
     
     def get_partners_count(self):
         """Возвращает количество партнеров в первой линии"""
-        return self.referrals.filter(status='partner').count()
+        return self.direct_partners_count
     
     def can_upgrade_rank(self):
         """Проверяет, может ли пользователь повысить ранг"""
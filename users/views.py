@@ -15,7 +15,7 @@ from django.utils.crypto import get_random_string
 from django.views.decorators.csrf import csrf_exempt
 
 from mlm.models import MLMSettings, MLMStructure
-from mlm.services import place_user_in_structure
+from mlm.services import move_subtree, place_user_in_structure
 
 from .models import User, UserProfile
 import json
@@ -636,10 +636,7 @@ def _ensure_structure_root(user):
     )
 
     if not created and (structure.parent_id is not None or structure.level != 0):
-        structure.parent = None
-        structure.level = 0
-        structure.position = 0
-        structure.save(update_fields=['parent', 'level', 'position'])
+        structure = move_subtree(structure, None)
 
     return structure
 
@@ -838,7 +835,7 @@ def get_referral_link(request):
     if not referral_code:
         referral_code = get_random_string(8)
         request.user.referral_code = referral_code
-        request.user.save()
+        request.user.save(update_fields=['referral_code'])
     
     referral_link = f"{request.build_absolute_uri('/')}register/?ref={referral_code}"
     